@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Compare the encodings of `HasLaunchedContext`: bytes per context and
+encode/decode cost of the JSON codec versus the compact struct codec.
+
+    ./benchmarks/context_codec.py [--redis-url redis://localhost:6379/15]
+
+With `--redis-url`, the memory actually used by each encoding in Redis is
+measured too (with `MEMORY USAGE`, keys are deleted afterwards).
+"""
+import argparse
+import asyncio
+import random
+import sys
+from pathlib import Path
+from timeit import Timer
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from rocket_man.storage import JsonCodec, has_launched_codec  # noqa: E402
+
+VIDEO_NAMES = [
+    "Falcon Heavy Test Flight (Hosted Webcast)-wbSwFU6tY1c",
+    "SpaceX CRS-20 Launch-S2VIRdHe0_g",
+    "Starship SN8 High-Altitude Flight Test-ap-BkkrRg-o",
+]
+
+
+def make_contexts(n: int) -> list[dict]:
+    """
+    Generate contexts as they look in the middle of a game.
+    """
+    contexts = []
+    for _ in range(n):
+        hi = random.randint(10_000, 70_000)
+        lo = random.randint(0, hi - 1)
+        contexts.append(
+            {
+                "step": random.randint(1, 17),
+                "lo": lo,
+                "hi": hi,
+                "mid": (lo + hi) // 2,
+                "video_name": random.choice(VIDEO_NAMES),
+            }
+        )
+    return contexts
+
+
+def measure(codec, contexts: list[dict], number: int) -> dict[str, float]:
+    encoded = [codec.encode(c) for c in contexts]
+    size = sum(len(e if isinstance(e, bytes) else e.encode()) for e in encoded) / len(encoded)
+
+    encode = Timer(lambda: [codec.encode(c) for c in contexts]).timeit(number)
+    decode = Timer(lambda: [codec.decode(e) for e in encoded]).timeit(number)
+    calls = number * len(contexts)
+
+    return {
+        "bytes": size,
+        "encode_ns": encode / calls * 1e9,
+        "decode_ns": decode / calls * 1e9,
+    }
+
+
+async def measure_redis(redis_url: str, codec, contexts: list[dict]) -> float:
+    from redis.asyncio import Redis
+
+    redis = Redis.from_url(redis_url)
+    keys = [f"bench::context::{i}" for i in range(len(contexts))]
+
+    try:
+        for key, context in zip(keys, contexts):
+            await redis.set(key, codec.encode(context), ex=20 * 60)
+        usages = [await redis.memory_usage(key) for key in keys]
+        return sum(usages) / len(usages)
+    finally:
+        await redis.delete(*keys)
+        await redis.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--contexts", type=int, default=1000, help="number of sample contexts")
+    parser.add_argument("--number", type=int, default=20, help="timing repetitions")
+    parser.add_argument("--redis-url", help="also measure the memory used in this Redis")
+    args = parser.parse_args()
+
+    random.seed(42)
+    contexts = make_contexts(args.contexts)
+    codecs = {"json": JsonCodec(), "struct": has_launched_codec}
+
+    print(f"{'codec':<8} {'bytes':>8} {'encode ns':>10} {'decode ns':>10} {'redis bytes':>12}")
+
+    for name, codec in codecs.items():
+        result = measure(codec, contexts, args.number)
+        redis_bytes = "-"
+        if args.redis_url:
+            redis_bytes = f"{asyncio.run(measure_redis(args.redis_url, codec, contexts)):.1f}"
+        print(
+            f"{name:<8} {result['bytes']:>8.1f} {result['encode_ns']:>10.0f} {result['decode_ns']:>10.0f}"
+            f" {redis_bytes:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Load test of the whole bot: thousands of simulated users say hi and play
+full bisection games, against the real BERNARD app talking to a local
+Redis, a stub FrameX and a stub Telegram Bot API.
+
+    ./benchmarks/game_load.py [--users 2000] [--concurrency 500] [--games 1] \\
+        [--redis-url redis://localhost:6379/15] [--env STATELESS_GAME=1 ...] \\
+        [--output report.json]
+
+With `--env TELEGRAM_INGESTION=polling`, the updates are served to the bot
+by the stub's `getUpdates` instead of being posted to its webhook.
+
+The Redis database is flushed before the run, don't point it at real data.
+Redis round trips are counted server-side, so nothing else should use that
+Redis server during the run.
+
+The report (JSON) has the updates per second, the latency of each state
+(from the update being posted to the bot's answer reaching Telegram), the
+Redis round trips per update, the FrameX calls per game and the time spent
+waiting for conversation locks. It records the commit and the parameters, so
+reports of different commits with the same parameters can be compared.
+"""
+import argparse
+import asyncio
+import re
+import sys
+from collections import Counter, defaultdict
+from hashlib import sha256
+from time import monotonic
+
+import ujson
+from aiohttp import ClientSession, TCPConnector
+from harness.bot import start_bot
+from harness.report import classify, revision, summarize, summarize_histogram
+from harness.stubs import StubFrameX, StubTelegram, start_stubs
+from harness.updates import callback_update, text_update
+from redis.asyncio import Redis
+
+TOKEN = "bench:token"
+
+FRAME_RE = re.compile(r"/api/video/([^/\s\\)]+)/frame/(\d+)")
+
+
+class GameLoad:
+    """
+    Simulated users playing against the bot, one conversation each.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        bot_url: str,
+        telegram: StubTelegram,
+        framex: StubFrameX,
+        timeout: float,
+        polling: bool = False,
+    ):
+        self.session = session
+        self.polling = polling
+        self.hook_url = f"{bot_url}/hooks/telegram/{sha256(TOKEN.encode()).hexdigest()}"
+        self.telegram = telegram
+        self.framex = framex
+        self.timeout = timeout
+        self.latencies: defaultdict[str, list[float]] = defaultdict(list)
+        self.errors: Counter[str] = Counter()
+        self.updates = 0
+        self.games = 0
+
+    async def send(self, chat_id: int, update: dict) -> tuple[str, dict]:
+        """
+        Post an update (or queue it for the bot to poll) and wait for the
+        answer of the bot.
+        """
+        start = monotonic()
+
+        if self.polling:
+            self.telegram.push_update(update)
+        else:
+            async with self.session.post(self.hook_url, data=ujson.dumps(update)) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    raise RuntimeError(f"webhook answered {resp.status}")
+
+        received, message = await self.telegram.next_message(chat_id, self.timeout)
+        state = classify(message)
+        self.latencies[state].append(received - start)
+        self.updates += 1
+        return state, message
+
+    async def tap(self, chat_id: int, message: dict, button: int) -> tuple[str, dict]:
+        data = message["reply_markup"]["inline_keyboard"][0][button]["callback_data"]
+        return await self.send(chat_id, callback_update(chat_id, message["message_id"], data))
+
+    async def play(self, chat_id: int, games: int) -> None:
+        """
+        One user: say hi, play `games` games answering truthfully, then say
+        goodbye.
+        """
+        try:
+            state, message = await self.send(chat_id, text_update(chat_id, "hi"))
+
+            for _ in range(games):
+                state, message = await self.tap(chat_id, message, 0)
+
+                while state == "HasLaunched":
+                    video, frame = FRAME_RE.search(message["text"]).groups()  # type: ignore[union-attr]
+                    launched = int(frame) >= self.framex.launch_frames[video]
+                    state, message = await self.tap(chat_id, message, 0 if launched else 1)
+
+                if state != "Win":
+                    self.errors[f"game ended on {state}"] += 1
+                    return
+
+                self.games += 1
+
+            await self.tap(chat_id, message, 1)
+        except asyncio.TimeoutError:
+            self.errors["no answer"] += 1
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            self.telegram.forget(chat_id)
+
+
+async def count_commands(redis: Redis) -> int:
+    return (await redis.info("stats"))["total_commands_processed"]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500, help="users playing at the same time")
+    parser.add_argument("--games", type=int, default=1, help="games played by each user")
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--framex-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--env", action="append", default=[], help="extra bot setting, as NAME=value")
+    parser.add_argument("--bot-port", type=int, default=8765)
+    parser.add_argument("--stub-port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each answer")
+    parser.add_argument("--output", help="write the report there instead of stdout")
+    args = parser.parse_args()
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+
+    framex = StubFrameX(videos=args.videos, latency=args.framex_latency)
+    telegram = StubTelegram(latency=args.telegram_latency)
+    stubs = await start_stubs("127.0.0.1", args.stub_port, framex, telegram)
+
+    redis = Redis.from_url(args.redis_url)
+    await redis.flushdb()
+
+    bot = await start_bot(
+        args.bot_port,
+        {
+            "TELEGRAM_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": stub_url,
+            "FRAMEX_URL": stub_url,
+            "REDIS_URL": args.redis_url,
+            "WEBVIEW_SECRET_KEY": "bench",
+            **extra_env,
+        },
+    )
+
+    try:
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            polling = extra_env.get("TELEGRAM_INGESTION") == "polling"
+            load = GameLoad(session, bot.url, telegram, framex, args.timeout, polling)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def user(chat_id: int):
+                async with semaphore:
+                    await load.play(chat_id, args.games)
+
+            commands_before = await count_commands(redis)
+            start = monotonic()
+            await asyncio.gather(*(user(10**9 + i) for i in range(args.users)))
+            elapsed = monotonic() - start
+            # minus the INFO of `commands_before`
+            commands = await count_commands(redis) - commands_before - 1
+
+        metrics = await bot.metrics()
+    finally:
+        bot.stop()
+        await stubs.cleanup()
+        await redis.close()
+
+    report = {
+        "revision": revision(),
+        "params": {**vars(args), "env": extra_env},
+        "updates": load.updates,
+        "games": load.games,
+        "errors": dict(load.errors),
+        "duration_s": round(elapsed, 3),
+        "updates_per_s": round(load.updates / elapsed, 1),
+        "latency_ms": {state: summarize(values) for state, values in sorted(load.latencies.items())},
+        "redis_commands_per_update": round(commands / max(load.updates, 1), 2),
+        "framex_calls": dict(framex.calls),
+        "framex_calls_per_game": round(sum(framex.calls.values()) / max(load.games, 1), 2),
+        "lock_wait_ms": summarize_histogram(metrics.get("rocket_man_redis_lock_wait_seconds")),
+        "telegram_calls": dict(telegram.calls),
+    }
+
+    output = ujson.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"{load.updates / elapsed:.1f} updates/s, report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
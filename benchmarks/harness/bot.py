@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Run the real bot (the BERNARD app with `rocket_man.transitions`) for the
+benchmarks, configured from the environment like in production. On top of
+the bot's own routes, `GET /_bench/metrics` returns the metrics of the
+process as JSON.
+
+Benchmarks start it with `start_bot()` (or several workers with
+`start_workers()`) rather than running it directly. The stub Telegram has no
+rate limits, so the bot's own are lifted unless `BENCH_TELEGRAM_RATE_LIMIT=1`:
+they would measure Telegram's limits rather than the bot (checking them still
+costs what it does in production).
+"""
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+
+project_root = Path(__file__).parent.parent.parent
+
+
+class BotProcess:
+    """
+    The bot, running in a child process.
+    """
+
+    def __init__(self, process: subprocess.Popen, url: str):
+        self.process = process
+        self.url = url
+
+    async def metrics(self) -> dict:
+        async with ClientSession() as session:
+            async with session.get(f"{self.url}/_bench/metrics") as resp:
+                return await resp.json()
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+async def start_bot(port: int, env: dict[str, str], timeout: float = 30.0) -> BotProcess:
+    """
+    Start the bot on a local port and wait until it answers.
+
+    :param env: settings of the bot, as environment variables
+    """
+    child_env = {k: v for k, v in os.environ.items() if k != "SOCKET_PATH"}
+    child_env.update(env)
+    child_env.update(
+        BIND_HOST="127.0.0.1",
+        BIND_PORT=str(port),
+        BERNARD_BASE_URL=f"http://127.0.0.1:{port}",
+    )
+
+    process = subprocess.Popen([sys.executable, __file__], env=child_env, cwd=project_root)
+    bot = BotProcess(process, f"http://127.0.0.1:{port}")
+    deadline = asyncio.get_running_loop().time() + timeout
+
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"The bot exited with code {process.returncode}")
+
+        try:
+            await bot.metrics()
+            return bot
+        except OSError:
+            if asyncio.get_running_loop().time() > deadline:
+                bot.stop()
+                raise TimeoutError("The bot did not start in time")
+            await asyncio.sleep(0.2)
+
+
+async def start_workers(port: int, env: dict[str, str], workers: int, timeout: float = 30.0) -> list[BotProcess]:
+    """
+    Start `workers` bots with `WORKERS` set, like the workers of a
+    deployment, on consecutive ports from `port`.
+
+    :param env: settings of the bots, as environment variables
+    """
+    started = await asyncio.gather(
+        *(
+            start_bot(port + n, {**env, "WORKERS": str(workers), "SUPERVISOR_PROCESS_NAME": f"bench-{n + 1}"}, timeout)
+            for n in range(workers)
+        ),
+        return_exceptions=True,
+    )
+    bots = [bot for bot in started if isinstance(bot, BotProcess)]
+
+    if len(bots) < workers:
+        for bot in bots:
+            bot.stop()
+        raise next(error for error in started if isinstance(error, BaseException))
+
+    return bots
+
+
+def dump_metrics() -> dict:
+    """
+    All the metrics of this process as plain data.
+    """
+    from rocket_man import metrics
+
+    out = {}
+
+    for metric in metrics.registry.metrics.values():
+        values = []
+
+        for labels, child in metric.children():
+            value: dict = {"labels": dict(zip(metric.labelnames, labels))}
+
+            if isinstance(child, metrics._HistogramValue):
+                value.update(
+                    buckets=list(child.buckets),
+                    counts=list(child.counts),
+                    sum=child.sum,
+                    count=child.count,
+                )
+            else:
+                value["value"] = child.value
+
+            values.append(value)
+
+        out[metric.name] = {"kind": metric.kind, "values": values}
+
+    return out
+
+
+def main():
+    sys.path.insert(0, str(project_root))
+    os.environ.setdefault("BERNARD_SETTINGS_FILE", str(project_root / "rocket_man" / "settings.py"))
+
+    import logging
+    import random
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # the same videos are picked for the same updates, as long as they come
+    # in the same order
+    if seed := os.environ.get("BENCH_SEED"):
+        random.seed(int(seed))
+
+    from bernard.conf import settings
+    from bernard.platforms import start_all
+    from bernard.server import app
+    from bernard.utils import run
+
+    if os.environ.get("BENCH_TELEGRAM_RATE_LIMIT") != "1":
+        unlimited = {"rate": 1e9, "burst": 10**9}
+        settings.TELEGRAM_RATE_LIMIT_PARAMS = {
+            **settings.TELEGRAM_RATE_LIMIT_PARAMS,
+            **{f"{scope}_{key}": value for scope in ("global", "private", "group") for key, value in unlimited.items()},
+        }
+
+    async def metrics_view(request: web.Request) -> web.Response:
+        return web.json_response(dump_metrics())
+
+    run(start_all())
+    app.router.add_get("/_bench/metrics", metrics_view)
+    # on the loop the platforms started on, which their HTTP sessions are
+    # bound to (`run_app()` would make a new one)
+    web.run_app(app, print=None, loop=asyncio.get_event_loop(), **settings.SERVER_BIND)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.parent
+
+# the state that answered, recognized from its message
+STATES = [
+    ("Hello!", "Hello"),
+    ("Has [the rocket]", "HasLaunched"),
+    ("Thanks, you helped", "Win"),
+    ("forgot what", "MaybeHasLaunched"),
+    ("Goodbye!", "Goodbye"),
+]
+
+
+def classify(message: dict) -> str:
+    """
+    The state of the bot that sent a message.
+    """
+    for marker, state in STATES:
+        if marker in message["text"]:
+            return state
+    return "Other"
+
+
+def summarize(values: list[float], scale: float = 1000.0) -> dict:
+    """
+    Count, mean and percentiles of a list of durations, in milliseconds by
+    default.
+    """
+    if not values:
+        return {"count": 0}
+
+    if len(values) == 1:
+        p50 = p95 = p99 = values[0]
+    else:
+        quantiles = statistics.quantiles(values, n=100, method="inclusive")
+        p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+
+    return {
+        "count": len(values),
+        "mean": round(statistics.fmean(values) * scale, 3),
+        "p50": round(p50 * scale, 3),
+        "p95": round(p95 * scale, 3),
+        "p99": round(p99 * scale, 3),
+    }
+
+
+def summarize_histogram(metric: dict | None, scale: float = 1000.0) -> dict:
+    """
+    Merge the children of a histogram dumped by the bot and estimate its
+    percentiles (upper bound of the bucket they fall into).
+    """
+    if not metric or not metric["values"]:
+        return {"count": 0}
+
+    buckets = metric["values"][0]["buckets"]
+    counts = [0] * (len(buckets) + 1)
+    total = count = 0
+
+    for value in metric["values"]:
+        counts = [a + b for a, b in zip(counts, value["counts"])]
+        total += value["sum"]
+        count += value["count"]
+
+    if not count:
+        return {"count": 0}
+
+    def quantile(q: float) -> float | None:
+        seen = 0
+        for bound, n in zip([*buckets, None], counts):
+            seen += n
+            if seen >= q * count:
+                return None if bound is None else bound * scale
+        return None
+
+    return {
+        "count": count,
+        "mean": round(total / count * scale, 3),
+        "p50": quantile(0.5),
+        "p95": quantile(0.95),
+        "p99": quantile(0.99),
+    }
+
+
+def revision() -> dict:
+    """
+    Which code is being measured, so reports can be compared across
+    commits.
+    """
+
+    def git(*args: str) -> str:
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=project_root, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
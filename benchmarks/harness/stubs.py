@@ -0,0 +1,214 @@
+import asyncio
+import itertools
+import random
+from collections import Counter, defaultdict
+from time import monotonic, time
+
+import ujson
+from aiohttp import web
+
+
+class StubFrameX:
+    """
+    Stand-in for the FrameX API: a fixed set of videos, each with a known
+    launch frame, and frames that are just bytes of the right size.
+
+    The videos only depend on `seed`, so runs with the same parameters play
+    the same games.
+    """
+
+    def __init__(self, videos: int = 20, frame_size: int = 30_000, latency: float = 0.0, seed: int = 0):
+        """
+        :param videos: number of videos in the catalog
+        :param frame_size: size of each frame, in bytes
+        :param latency: time taken to answer each request, in seconds
+        :param seed: seed of the generated videos
+        """
+        rng = random.Random(seed)
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.videos = {}
+        self.launch_frames = {}
+
+        for i in range(videos):
+            name = f"bench{i}"
+            frames = rng.randint(20_000, 70_000)
+            self.launch_frames[name] = rng.randrange(frames)
+            self.videos[name] = {
+                "name": name,
+                "width": 1280,
+                "height": 720,
+                "frames": frames,
+                "frame_rate": [30, 1],
+                "url": f"https://example.com/{name}.mp4",
+                "first_frame": f"/api/video/{name}/frame/0/",
+                "last_frame": f"/api/video/{name}/frame/{frames - 1}/",
+            }
+
+        self.frame = b"\xff\xd8" + b"\0" * max(frame_size - 4, 0) + b"\xff\xd9"
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_get("/api/video", self.list_videos)
+        app.router.add_get("/api/video/{name}", self.get_video)
+        app.router.add_get("/api/video/{name}/frame/{frame:\\d+}", self.get_frame)
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def list_videos(self, request: web.Request) -> web.Response:
+        self.calls["list_videos"] += 1
+        await self._delay()
+        return web.json_response(list(self.videos.values()), headers={"ETag": '"videos"'})
+
+    async def get_video(self, request: web.Request) -> web.Response:
+        self.calls["get_video"] += 1
+        await self._delay()
+        try:
+            return web.json_response(self.videos[request.match_info["name"]])
+        except KeyError:
+            raise web.HTTPNotFound()
+
+    async def get_frame(self, request: web.Request) -> web.Response:
+        self.calls["get_frame"] += 1
+        await self._delay()
+        return web.Response(body=self.frame, content_type="image/jpeg")
+
+
+class StubTelegram:
+    """
+    Stand-in for the Bot API. Every call succeeds. Messages the bot sends or
+    edits are queued per chat, for the simulated users to read with
+    `next_message()`.
+
+    Updates given to `push_update()` are served by `getUpdates`, for bots
+    that poll instead of receiving a webhook.
+    """
+
+    def __init__(self, latency: float = 0.0, keep_sent: bool = False):
+        """
+        :param latency: time taken to answer each call, in seconds
+        :param keep_sent: also keep all the messages sent to each chat in
+            `sent`, with when they were received and their method, e.g. to
+            compare runs
+        """
+        self.latency = latency
+        self.keep_sent = keep_sent
+        self.sent: defaultdict[int, list[tuple[float, str, dict]]] = defaultdict(list)
+        self.calls: Counter[str] = Counter()
+        self._inboxes: defaultdict[int, asyncio.Queue[tuple[float, dict]]] = defaultdict(asyncio.Queue)
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._updates: list[dict] = []
+        self._new_update = asyncio.Event()
+
+    def add_routes(self, app: web.Application) -> None:
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+
+        if request.content_type == "multipart/form-data":
+            form = await request.post()
+            params = {k: v for k, v in form.items() if isinstance(v, str)}
+        else:
+            params = await request.json()
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result: object = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method != "sendChatAction" and method.startswith(("send", "edit")):
+            result = self._record(method, params)
+        else:
+            result = True
+
+        return web.json_response({"ok": True, "result": result})
+
+    def _record(self, method: str, params: dict) -> dict:
+        """
+        Turn a call sending or editing a message into the message itself.
+        """
+        chat_id = int(params["chat_id"])
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        markup = params.get("reply_markup")
+        media = params.get("media")
+
+        if isinstance(markup, str):
+            markup = ujson.loads(markup)
+        if isinstance(media, str):
+            media = ujson.loads(media)
+
+        message = {
+            "message_id": message_id,
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time()),
+            "text": params.get("text") or params.get("caption") or (media or {}).get("caption", ""),
+        }
+
+        if markup:
+            message["reply_markup"] = markup
+        if method in ("sendPhoto", "editMessageMedia"):
+            message["photo"] = [{"file_id": f"stub-{message_id}", "width": 1280, "height": 720}]
+
+        received = monotonic()
+        self._inboxes[chat_id].put_nowait((received, message))
+
+        if self.keep_sent:
+            self.sent[chat_id].append((received, method, message))
+
+        return message
+
+    def push_update(self, update: dict) -> None:
+        """
+        Make an update available to `getUpdates`, with the next update id.
+        """
+        self._updates.append({**update, "update_id": next(self._update_ids)})
+        self._new_update.set()
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        """
+        Like Telegram: updates before `offset` are confirmed and forgotten,
+        and the call waits up to `timeout` seconds for new ones.
+        """
+        offset = int(params.get("offset") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+
+        return self._updates[: int(params.get("limit") or 100)]
+
+    async def next_message(self, chat_id: int, timeout: float) -> tuple[float, dict]:
+        """
+        Wait for the next message to a chat. Returns when it was received
+        (`monotonic()`) and the message.
+        """
+        return await asyncio.wait_for(self._inboxes[chat_id].get(), timeout)
+
+    def forget(self, chat_id: int) -> None:
+        self._inboxes.pop(chat_id, None)
+
+
+async def start_stubs(host: str, port: int, *stubs) -> web.AppRunner:
+    """
+    Serve the stubs from a single server. Call `cleanup()` on the returned
+    runner to stop it.
+    """
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+
+    for stub in stubs:
+        stub.add_routes(app)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
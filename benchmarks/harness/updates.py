@@ -0,0 +1,49 @@
+import itertools
+from time import time
+
+_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"bench{user_id}", "language_code": "en"}
+
+
+def _chat(user_id: int) -> dict:
+    return {"id": user_id, "type": "private", "first_name": "Bench"}
+
+
+def text_update(user_id: int, text: str) -> dict:
+    """
+    A Telegram update with a text message from a user, in their private chat.
+    """
+    return {
+        "update_id": next(_ids),
+        "message": {
+            "message_id": next(_ids),
+            "from": _user(user_id),
+            "chat": _chat(user_id),
+            "date": int(time()),
+            "text": text,
+        },
+    }
+
+
+def callback_update(user_id: int, message_id: int, data: str) -> dict:
+    """
+    A Telegram update for a user tapping a button of a message of the bot.
+    """
+    return {
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "from": _user(user_id),
+            "message": {
+                "message_id": message_id,
+                "chat": _chat(user_id),
+                "date": int(time()),
+                "text": "",
+            },
+            "chat_instance": str(user_id),
+            "data": data,
+        },
+    }
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Replay captured production traffic (see `TRAFFIC_CAPTURE_PATH`) against the
+real bot, with a local Redis, a stub FrameX and a stub Telegram Bot API, to
+see how a version copes with what users actually do: double taps, abandoned
+games, bursts...
+
+    ./benchmarks/replay.py captures/*.cap [--speed 1] [--limit 10000] \\
+        [--redis-url redis://localhost:6379/15] [--env STATELESS_GAME=1 ...] \\
+        [--output report.json] [--compare baseline.json]
+
+The captures of all workers are merged in the order the updates were
+received. With `--speed 10`, updates are posted ten times faster than they
+came, on their recorded schedule whether the bot keeps up or not, so updates
+that raced in production still race. With `--speed 0`, they are posted as
+fast as the bot answers: conversations in parallel, the updates of each one
+in order.
+
+The report (JSON) has the updates per second (achieved and targeted), the
+latency from each update being posted to the bot's answer reaching
+Telegram, per kind of update, and what the bot answered in each
+conversation (the states of its messages). With `--compare`, conversations
+answered differently than in the report of another run are listed: run the
+baseline commit and the candidate with the same captures and parameters.
+The bot picks its videos with `BENCH_SEED` set, so both runs play the same
+games as long as the updates are handled in the same order.
+
+Updates are posted to the webhook, so `TELEGRAM_INGESTION=polling` can't be
+replayed (`queue` can). The Redis database is flushed before the run,
+don't point it at real data. Buttons of stateless games can only be replayed
+with the `WEBVIEW_SECRET_KEY` of production, given with `--env`.
+"""
+import argparse
+import asyncio
+import heapq
+import sys
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from hashlib import sha256
+from operator import attrgetter
+from pathlib import Path
+from time import monotonic
+
+import ujson
+from aiohttp import ClientSession, TCPConnector
+from harness.bot import start_bot
+from harness.report import classify, revision, summarize, summarize_histogram
+from harness.stubs import StubFrameX, StubTelegram, start_stubs
+from redis.asyncio import Redis
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from rocket_man.capture import CapturedUpdate, read_capture  # noqa: E402
+
+TOKEN = "bench:token"
+
+# conversations listed in full by `--compare`, the others are only counted
+MAX_LISTED_DIFFERENCES = 50
+
+
+def update_kind(update: dict) -> str:
+    return next((key for key in update if key != "update_id"), "unknown")
+
+
+def update_chat(update: dict) -> int | None:
+    """
+    The chat the bot answers an update in.
+    """
+    content = update.get(update_kind(update)) or {}
+    chat = (content.get("message") or content).get("chat")
+    return chat["id"] if chat else None
+
+
+class Replay:
+    """
+    Posts captured updates to the bot's webhook and keeps track of when they
+    were posted, to match them with the answers of the bot.
+    """
+
+    def __init__(self, session: ClientSession, bot_url: str):
+        self.session = session
+        self.hook_url = f"{bot_url}/hooks/telegram/{sha256(TOKEN.encode()).hexdigest()}"
+        # chat -> (time posted, kind of update)
+        self.posted: defaultdict[int, list[tuple[float, str]]] = defaultdict(list)
+        self.webhook_latencies: list[float] = []
+        self.errors: Counter[str] = Counter()
+        self.late: list[float] = []
+
+    async def post(self, captured: CapturedUpdate) -> None:
+        update = captured.update
+        chat = update_chat(update)
+        start = monotonic()
+
+        if chat is not None:
+            self.posted[chat].append((start, update_kind(update)))
+
+        try:
+            async with self.session.post(self.hook_url, data=ujson.dumps(update)) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    self.errors[f"webhook answered {resp.status}"] += 1
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+
+        self.webhook_latencies.append(monotonic() - start)
+
+    async def on_schedule(self, updates: list[CapturedUpdate], speed: float) -> None:
+        """
+        Post each update at its recorded time, divided by `speed`, without
+        waiting for the previous ones to be answered.
+        """
+        origin = updates[0].received_at
+        start = monotonic()
+        tasks = []
+
+        for captured in updates:
+            delay = start + (captured.received_at - origin) / speed - monotonic()
+
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.late.append(-delay)
+
+            tasks.append(asyncio.create_task(self.post(captured)))
+
+        await asyncio.gather(*tasks)
+
+    async def flat_out(self, updates: list[CapturedUpdate], concurrency: int) -> None:
+        """
+        Post the updates as fast as possible: conversations in parallel, the
+        updates of each one after the previous one was handled.
+        """
+        conversations: defaultdict[str, list[CapturedUpdate]] = defaultdict(list)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        for captured in updates:
+            conversations[captured.conversation_id].append(captured)
+
+        async def conversation(chat_updates: list[CapturedUpdate]):
+            async with semaphore:
+                for captured in chat_updates:
+                    await self.post(captured)
+
+        await asyncio.gather(*(conversation(chat_updates) for chat_updates in conversations.values()))
+
+
+def answer_latencies(replay: Replay, telegram: StubTelegram) -> tuple[dict[str, list[float]], int]:
+    """
+    Match each posted update with the first message sent to its chat before
+    the next update of the chat was posted. Returns the latencies per kind of
+    update, and the number of updates the bot did not answer.
+    """
+    latencies: defaultdict[str, list[float]] = defaultdict(list)
+    unanswered = 0
+
+    for chat, posted in replay.posted.items():
+        posted.sort()
+        received = [sent[0] for sent in telegram.sent.get(chat, [])]
+
+        for i, (start, kind) in enumerate(posted):
+            j = bisect_left(received, start)
+            end = posted[i + 1][0] if i + 1 < len(posted) else float("inf")
+
+            if j < len(received) and received[j] < end:
+                latencies[kind].append(received[j] - start)
+            else:
+                unanswered += 1
+
+    return latencies, unanswered
+
+
+def transcripts(telegram: StubTelegram) -> dict[str, list[str]]:
+    """
+    What the bot answered in each chat, as the method and state of each
+    message (frames and videos depend on the run, states don't).
+    """
+    return {
+        str(chat): [f"{method}:{classify(message)}" for _, method, message in sent]
+        for chat, sent in sorted(telegram.sent.items())
+    }
+
+
+def compare(baseline: dict[str, list[str]], current: dict[str, list[str]]) -> dict:
+    differing = sorted(chat for chat in baseline.keys() | current.keys() if baseline.get(chat) != current.get(chat))
+
+    return {
+        "conversations": len(baseline.keys() | current.keys()),
+        "differing": len(differing),
+        "differences": {
+            chat: {"baseline": baseline.get(chat), "replay": current.get(chat)}
+            for chat in differing[:MAX_LISTED_DIFFERENCES]
+        },
+    }
+
+
+async def settle(telegram: StubTelegram, quiet: float, timeout: float) -> None:
+    """
+    Wait until the bot stopped sending messages for `quiet` seconds.
+    """
+    deadline = monotonic() + timeout
+    seen = -1
+
+    while monotonic() < deadline:
+        count = sum(telegram.calls.values())
+        if count == seen:
+            return
+        seen = count
+        await asyncio.sleep(quiet)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="capture files, from all the workers")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed-up of the recorded schedule, 0 for max")
+    parser.add_argument("--limit", type=int, help="replay the first updates only")
+    parser.add_argument("--concurrency", type=int, default=500, help="conversations at once, at max speed")
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the videos picked by the bot")
+    parser.add_argument("--framex-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--env", action="append", default=[], help="extra bot setting, as NAME=value")
+    parser.add_argument("--bot-port", type=int, default=8765)
+    parser.add_argument("--stub-port", type=int, default=8766)
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds without answers that end the run")
+    parser.add_argument("--output", help="write the report there instead of stdout")
+    parser.add_argument("--compare", help="report of a previous run, to compare the answers with")
+    args = parser.parse_args()
+
+    if args.speed < 0:
+        parser.error("--speed can't be negative")
+
+    updates = list(heapq.merge(*(read_capture(path) for path in args.captures), key=attrgetter("received_at")))
+    if args.limit:
+        updates = updates[: args.limit]
+    if not updates:
+        parser.error("the captures are empty")
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    if extra_env.get("TELEGRAM_INGESTION") == "polling":
+        parser.error("updates are replayed through the webhook, polling is not supported")
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+
+    framex = StubFrameX(videos=args.videos, latency=args.framex_latency)
+    telegram = StubTelegram(latency=args.telegram_latency, keep_sent=True)
+    stubs = await start_stubs("127.0.0.1", args.stub_port, framex, telegram)
+
+    redis = Redis.from_url(args.redis_url)
+    await redis.flushdb()
+
+    bot = await start_bot(
+        args.bot_port,
+        {
+            "TELEGRAM_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": stub_url,
+            "FRAMEX_URL": stub_url,
+            "REDIS_URL": args.redis_url,
+            "WEBVIEW_SECRET_KEY": "replay",
+            "BENCH_SEED": str(args.seed),
+            **extra_env,
+        },
+    )
+
+    try:
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            replay = Replay(session, bot.url)
+            start = monotonic()
+
+            if args.speed:
+                await replay.on_schedule(updates, args.speed)
+            else:
+                await replay.flat_out(updates, args.concurrency)
+
+            elapsed = monotonic() - start
+            await settle(telegram, args.settle, timeout=60.0)
+
+        metrics = await bot.metrics()
+    finally:
+        bot.stop()
+        await stubs.cleanup()
+        await redis.close()
+
+    latencies, unanswered = answer_latencies(replay, telegram)
+    recorded = updates[-1].received_at - updates[0].received_at
+    answers = transcripts(telegram)
+
+    report = {
+        "revision": revision(),
+        "params": {**vars(args), "env": extra_env},
+        "updates": len(updates),
+        "conversations": len({captured.conversation_id for captured in updates}),
+        "errors": dict(replay.errors),
+        "duration_s": round(elapsed, 3),
+        "updates_per_s": round(len(updates) / elapsed, 1),
+        "target_updates_per_s": round(len(updates) * args.speed / recorded, 1) if args.speed and recorded else None,
+        "late_ms": summarize(replay.late),
+        "latency_ms": {kind: summarize(values) for kind, values in sorted(latencies.items())},
+        "webhook_ms": summarize(replay.webhook_latencies),
+        "unanswered": unanswered,
+        "framex_calls": dict(framex.calls),
+        "lock_wait_ms": summarize_histogram(metrics.get("rocket_man_redis_lock_wait_seconds")),
+        "telegram_calls": dict(telegram.calls),
+        "transcripts": answers,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(ujson.load(f)["transcripts"], answers)
+
+    output = ujson.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"{len(updates) / elapsed:.1f} updates/s, report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if differing := report.get("comparison", {}).get("differing"):
+        print(f"{differing} conversations were answered differently", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Load test of the Telegram webhook: simulated users each say hi and start a
+game, as fast as the bot answers them, against 1, 2 then 4 workers of the
+bot talking to a local Redis, a stub FrameX and a stub Telegram Bot API.
+Reports the throughput and latency of each number of workers.
+
+    ./benchmarks/webhook_load.py [--workers 1 2 4] [--users 200] [--rounds 5] \\
+        [--concurrency 100] [--redis-url redis://localhost:6379/15] \\
+        [--env NAME=value ...] [--output report.json]
+
+The updates are spread over the workers in turn, like nginx does in the
+Docker image, and each one counts from it being posted to the answer of the
+bot reaching the stub Telegram. The stubs answer right away, so the
+throughput is bound by the workers rather than by Telegram.
+
+The Redis database is flushed before each run, don't point it at real data.
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+from hashlib import sha256
+from itertools import cycle
+from time import monotonic
+
+import ujson
+from aiohttp import ClientSession, TCPConnector
+from harness.bot import start_workers
+from harness.report import revision, summarize
+from harness.stubs import StubFrameX, StubTelegram, start_stubs
+from harness.updates import callback_update, text_update
+from redis.asyncio import Redis
+
+TOKEN = "bench:token"
+
+
+class WebhookLoad:
+    """
+    Simulated users posting to the webhooks of several workers.
+    """
+
+    def __init__(self, session: ClientSession, bot_urls: list[str], telegram: StubTelegram, timeout: float):
+        hook = f"/hooks/telegram/{sha256(TOKEN.encode()).hexdigest()}"
+        self.session = session
+        self.hook_urls = cycle(f"{url}{hook}" for url in bot_urls)
+        self.telegram = telegram
+        self.timeout = timeout
+        self.latencies: list[float] = []
+        self.errors: Counter[str] = Counter()
+
+    async def send(self, chat_id: int, update: dict) -> dict:
+        """
+        Post an update to the next worker and wait for the answer of the bot.
+        """
+        start = monotonic()
+
+        async with self.session.post(next(self.hook_urls), data=ujson.dumps(update)) as resp:
+            await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"webhook answered {resp.status}")
+
+        received, message = await self.telegram.next_message(chat_id, self.timeout)
+        self.latencies.append(received - start)
+        return message
+
+    async def play(self, chat_id: int, rounds: int) -> None:
+        """
+        One user: say hi and start a game, `rounds` times, waiting for each
+        answer before sending the next update like a real user.
+        """
+        try:
+            for _ in range(rounds):
+                message = await self.send(chat_id, text_update(chat_id, "hi"))
+                data = message["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+                await self.send(chat_id, callback_update(chat_id, message["message_id"], data))
+        except asyncio.TimeoutError:
+            self.errors["no answer"] += 1
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+        finally:
+            self.telegram.forget(chat_id)
+
+
+async def run(args: argparse.Namespace, workers: int, env: dict[str, str], telegram: StubTelegram) -> dict:
+    """
+    Run the load against `workers` fresh workers.
+    """
+    redis = Redis.from_url(args.redis_url)
+    await redis.flushdb()
+    await redis.close()
+
+    bots = await start_workers(args.bot_port, env, workers)
+
+    try:
+        async with ClientSession(connector=TCPConnector(limit=args.concurrency)) as session:
+            load = WebhookLoad(session, [bot.url for bot in bots], telegram, args.timeout)
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def user(chat_id: int):
+                async with semaphore:
+                    await load.play(chat_id, args.rounds)
+
+            start = monotonic()
+            await asyncio.gather(*(user(10**9 + i) for i in range(args.users)))
+            elapsed = monotonic() - start
+    finally:
+        for bot in bots:
+            bot.stop()
+
+    return {
+        "workers": workers,
+        "updates": len(load.latencies),
+        "errors": dict(load.errors),
+        "duration_s": round(elapsed, 3),
+        "updates_per_s": round(len(load.latencies) / elapsed, 1),
+        "latency_ms": summarize(load.latencies),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="numbers of workers to compare")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5, help="games started by each user")
+    parser.add_argument("--concurrency", type=int, default=100, help="users sending updates at the same time")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--env", action="append", default=[], help="extra bot setting, as NAME=value")
+    parser.add_argument("--bot-port", type=int, default=8766, help="port of the first worker, the others follow")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for each answer")
+    parser.add_argument("--output", help="write the report there instead of stdout")
+    args = parser.parse_args()
+
+    if args.bot_port <= args.stub_port < args.bot_port + max(args.workers):
+        parser.error("--stub-port is among the ports of the workers")
+
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    env = {
+        "TELEGRAM_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": stub_url,
+        "FRAMEX_URL": stub_url,
+        "REDIS_URL": args.redis_url,
+        "WEBVIEW_SECRET_KEY": "bench",
+        **extra_env,
+    }
+
+    telegram = StubTelegram()
+    stubs = await start_stubs("127.0.0.1", args.stub_port, StubFrameX(), telegram)
+
+    try:
+        runs = [await run(args, workers, env, telegram) for workers in args.workers]
+    finally:
+        await stubs.cleanup()
+
+    # relative to the first number of workers
+    for result in runs:
+        result["speedup"] = round(result["updates_per_s"] / runs[0]["updates_per_s"], 2) if runs[0]["updates"] else None
+
+    report = {
+        "revision": revision(),
+        "params": {**vars(args), "env": extra_env},
+        "runs": runs,
+    }
+
+    output = ujson.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        summary = ", ".join(f"{r['workers']} workers: {r['updates_per_s']:.1f} updates/s" for r in runs)
+        print(f"{summary}, report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
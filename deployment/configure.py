@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Generate the parts of the nginx and supervisord configurations that depend on
+the number of workers, from the bot settings (WORKERS, SOCKET_PATH,
+BIND_HOST/BIND_PORT, METRICS_PORT).
+
+    ./deployment/configure.py [--nginx PATH] [--supervisord PATH]
+
+Run it before starting supervisord, and again before a rolling restart if
+WORKERS changed.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from rocket_man import settings  # noqa: E402
+
+NGINX_UPSTREAM = """\
+upstream bernard {{
+{servers}
+  # idle connections kept open to the workers
+  keepalive 32;
+}}
+"""
+
+NGINX_METRICS = """\
+# Prometheus metrics of each worker, kept off the public port
+server {{
+  listen {port};
+
+{locations}}}
+"""
+
+NGINX_METRICS_LOCATION = """\
+  location = {path} {{
+    proxy_pass {target};
+  }}
+"""
+
+SUPERVISORD_PROGRAM = """\
+[program:aiohttp]
+command=/app/manage.py run
+process_name=rocket_man_%(process_num)02d
+user=nobody
+numprocs={workers}
+numprocs_start=1
+{environment}autostart=true
+autorestart=true
+# on SIGTERM, aiohttp stops accepting connections and lets the requests in
+# flight finish (up to 60s) before exiting
+stopsignal=TERM
+stopwaitsecs=65
+# logs (to stdout)
+redirect_stderr=true
+stdout_logfile=/dev/stdout
+stdout_logfile_maxbytes=0
+"""
+
+
+def make_upstream() -> str:
+    """
+    One server per worker socket or, without SOCKET_PATH, the TCP port all
+    the workers share.
+    """
+    if settings.env.socket_path:
+        servers = [
+            f"  server unix:{settings.worker_socket_path(num)} fail_timeout=0;"
+            for num in range(1, settings.WORKERS + 1)
+        ]
+    else:
+        if settings.WORKERS > 1 and not settings.env.reuse_port:
+            raise SystemExit("Several workers without SOCKET_PATH need REUSE_PORT=1")
+        servers = [f"  server {settings.env.bind_host}:{settings.env.bind_port} fail_timeout=0;"]
+
+    return NGINX_UPSTREAM.format(servers="\n".join(servers)) + "\n" + make_metrics()
+
+
+def make_metrics() -> str:
+    """
+    Each worker has its own metrics, so each one must be scraped: with
+    sockets, worker N is at `/metrics/N`. Workers sharing a port can't be
+    told apart, `/metrics` then reaches one of them at random.
+    """
+    if settings.env.socket_path:
+        targets = {
+            f"/metrics/{num}": f"http://unix:{settings.worker_socket_path(num)}:/metrics"
+            for num in range(1, settings.WORKERS + 1)
+        }
+    else:
+        targets = {"/metrics": f"http://{settings.env.bind_host}:{settings.env.bind_port}/metrics"}
+
+    locations = "\n".join(NGINX_METRICS_LOCATION.format(path=path, target=target) for path, target in targets.items())
+    return NGINX_METRICS.format(port=settings.env.metrics_port, locations=locations)
+
+
+def make_program() -> str:
+    """
+    The workers, each with its own socket if there is a SOCKET_PATH.
+    """
+    environment = ""
+
+    if settings.env.socket_path:
+        path = settings.env.socket_path
+        pattern = path.with_name(f"{path.stem}-%(process_num)02d{path.suffix}")
+        environment = f'environment=SOCKET_PATH="{pattern}"\n'
+
+    return SUPERVISORD_PROGRAM.format(workers=settings.WORKERS, environment=environment)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nginx", type=Path, default=Path("/etc/nginx/http.d/bernard-upstream.conf"))
+    parser.add_argument("--supervisord", type=Path, default=Path("/etc/supervisord/conf.d/aiohttp.conf"))
+    args = parser.parse_args()
+
+    for path, content in [(args.nginx, make_upstream()), (args.supervisord, make_program())]:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        print(f"Wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
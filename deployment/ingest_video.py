@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Ingest videos into the local frame library (LOCAL_FRAMES_PATH), for the bot
+to serve their frames itself with FRAME_BACKEND=local. Needs ffmpeg and
+ffprobe.
+
+    ./deployment/ingest_video.py VIDEO [VIDEO ...] [--name NAME] [--quality 3]
+
+A video that is already in the library is replaced. Running workers pick up
+the new videos when they next refresh their catalog.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+os.environ.setdefault("BERNARD_SETTINGS_FILE", str(project_root / "rocket_man" / "settings.py"))
+
+
+async def ingest(paths: list[Path], name: str | None, quality: int) -> None:
+    from bernard.conf import settings
+
+    from rocket_man.services.local_frames import ingest_video
+    from rocket_man.storage.frame_library import FrameLibrary
+
+    if not settings.LOCAL_FRAMES_PARAMS["root"]:
+        raise SystemExit("Set LOCAL_FRAMES_PATH to the directory of the library")
+
+    library = FrameLibrary(**settings.LOCAL_FRAMES_PARAMS)
+
+    try:
+        for path in paths:
+            video = await ingest_video(library, path, name=name, quality=quality)
+            print(f"{video.name}: {video.frames} frames ({video.width}x{video.height})")
+    finally:
+        library.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("videos", type=Path, nargs="+")
+    parser.add_argument("--name", help="name of the video, defaults to the file name (only with one video)")
+    parser.add_argument("--quality", type=int, default=3, help="JPEG quality, from 2 (best) to 31 (smallest)")
+    args = parser.parse_args()
+
+    if args.name and len(args.videos) > 1:
+        parser.error("--name can only be used with a single video")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(ingest(args.videos, args.name, args.quality))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+#!/bin/sh
+# Restart the workers one at a time, so the others keep serving. nginx sends
+# new requests to the remaining workers while one is down, and each worker
+# finishes its requests in flight before exiting (see configure.py).
+#
+#     ./deployment/rolling-restart.sh [seconds to wait for a worker to be up]
+
+set -eu
+
+TIMEOUT=${1:-30}
+CONF=/etc/supervisord/supervisord.conf
+
+for process in $(supervisorctl -c "$CONF" status | awk '/^aiohttp:/ {print $1}'); do
+    echo "Restarting $process"
+    supervisorctl -c "$CONF" restart "$process"
+
+    # wait for the worker to accept connections before touching the next one
+    # (with a shared TCP port, supervisorctl already waited for it to start)
+    if [ -n "${SOCKET_PATH:-}" ]; then
+        socket=$(printf '%s' "$SOCKET_PATH" | sed "s/\.sock$/-${process##*_}.sock/")
+        waited=0
+        until python3 -c "import socket, sys; socket.socket(socket.AF_UNIX).connect(sys.argv[1])" "$socket" 2>/dev/null; do
+            waited=$((waited + 1))
+            if [ "$waited" -ge "$TIMEOUT" ]; then
+                echo "$process is not accepting connections after ${TIMEOUT}s, stopping here" >&2
+                exit 1
+            fi
+            sleep 1
+        done
+    fi
+done
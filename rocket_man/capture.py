@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import mmap
+import struct
+import zlib
+from pathlib import Path
+from time import time
+from typing import Any, Iterator, NamedTuple
+
+import ujson
+from bernard.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"RMCAP\x01"
+
+# marker, CRC32 of the rest of the record, time received (s), length of the
+# conversation id, length of the compressed update
+RECORD_HEADER = struct.Struct(">4sIdHI")
+RECORD_MARKER = b"\xferec"
+
+# personal data that the replay doesn't need
+ANONYMIZED_FIELDS = {"first_name", "last_name", "username", "language_code", "title", "phone_number"}
+
+
+class CapturedUpdate(NamedTuple):
+    received_at: float
+    conversation_id: str
+    update: dict[str, Any]
+
+
+def anonymize(value: Any) -> Any:
+    """
+    Drop the names of users and chats from an update, keeping the ids that
+    tie the conversations together.
+    """
+    if isinstance(value, dict):
+        return {k: anonymize(v) for k, v in value.items() if k not in ANONYMIZED_FIELDS}
+    if isinstance(value, list):
+        return [anonymize(v) for v in value]
+    return value
+
+
+class TrafficRecorder:
+    """
+    Records incoming updates to an append-only file, to replay them later
+    (see `benchmarks/replay.py`): each record is the time the update was
+    received, its conversation and the update itself, compressed.
+
+    Records are buffered and written at most `flush_interval` seconds after
+    they were made, so a crash loses the last ones at most. Each record
+    starts with a marker and a checksum: a record torn by a crash, even with
+    records appended after it by the next process, is skipped by
+    `read_capture()`.
+    """
+
+    def __init__(self, path: Path | str, anonymized: bool = True, flush_interval: float = 1.0):
+        """
+        :param path: file to append to, created if needed
+        :param anonymized: drop the names of users and chats from the updates
+        :param flush_interval: longest time records stay buffered, in seconds
+        """
+        self.path = Path(path)
+        self.anonymized = anonymized
+        self.flush_interval = flush_interval
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=64 * 1024)
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def record(self, conversation_id: str, update: dict[str, Any]) -> None:
+        if self.anonymized:
+            update = anonymize(update)
+
+        conversation = conversation_id.encode()
+        body = zlib.compress(ujson.dumps(update).encode())
+        fields = struct.pack(">dHI", time(), len(conversation), len(body)) + conversation + body
+        self._file.write(RECORD_MARKER + zlib.crc32(fields).to_bytes(4, "big") + fields)
+
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        self._file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+
+def _read_record(data: mmap.mmap, pos: int) -> tuple[CapturedUpdate, int] | None:
+    """
+    Read the record at `pos`, with the position of the next one, or `None`
+    if there is no valid record there.
+    """
+    if data[pos : pos + len(RECORD_MARKER)] != RECORD_MARKER or pos + RECORD_HEADER.size > len(data):
+        return None
+
+    _, crc, received_at, conversation_size, body_size = RECORD_HEADER.unpack_from(data, pos)
+    start = pos + RECORD_HEADER.size
+    end = start + conversation_size + body_size
+
+    # the checksum covers the record after itself
+    if end > len(data) or zlib.crc32(data[pos + 8 : end]) != crc:
+        return None
+
+    try:
+        conversation = data[start : start + conversation_size].decode()
+        update = ujson.loads(zlib.decompress(data[start + conversation_size : end]))
+    except (zlib.error, ValueError):
+        return None
+
+    return CapturedUpdate(received_at, conversation, update), end
+
+
+def read_capture(path: Path | str) -> Iterator[CapturedUpdate]:
+    """
+    Read the updates of a capture file, in the order they were recorded.
+    Records that were torn by a crash are skipped, reading resumes at the
+    next valid record.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a traffic capture")
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos = len(MAGIC)
+            skipped = 0
+
+            while pos < len(data):
+                if (record := _read_record(data, pos)) is None:
+                    # resynchronize on the next marker
+                    next_pos = data.find(RECORD_MARKER, pos + 1)
+                    next_pos = len(data) if next_pos < 0 else next_pos
+                    skipped += next_pos - pos
+                    pos = next_pos
+                    continue
+
+                captured, pos = record
+                yield captured
+
+            if skipped:
+                logger.warning("Skipped %s bytes of torn records in %s", skipped, path)
+
+
+# --- Worker-wide instance ---
+
+_recorder: TrafficRecorder | None = None
+
+
+def get_recorder() -> TrafficRecorder | None:
+    """
+    Get the recorder of the worker, or `None` if
+    `settings.TRAFFIC_CAPTURE_PARAMS` does not enable it.
+    """
+    global _recorder
+
+    if _recorder is None and settings.TRAFFIC_CAPTURE_PARAMS:
+        _recorder = TrafficRecorder(**settings.TRAFFIC_CAPTURE_PARAMS)
+    return _recorder
+
+
+async def close_recorder(app=None) -> None:
+    """
+    Write the pending records and close the file. Can be used as an aiohttp
+    cleanup callback.
+    """
+    global _recorder
+
+    if _recorder is not None:
+        _recorder.close()
+        _recorder = None
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import zlib
+from time import monotonic
+from typing import Awaitable, Callable
+
+from bernard.conf import settings
+
+from rocket_man import metrics
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[object]]
+# when the job was queued, the job, and the future resolved once it ran
+Entry = tuple[float, Job, "asyncio.Future[None] | None"]
+
+queue_depth = metrics.Gauge(
+    "rocket_man_update_queue_depth",
+    "Updates waiting to be handled, all shards together",
+)
+queue_rejected_total = metrics.Counter(
+    "rocket_man_update_queue_rejected_total",
+    "Updates refused because their shard was full",
+)
+queue_wait_seconds = metrics.Histogram(
+    "rocket_man_update_queue_wait_seconds",
+    "Time updates spent in the queue before being handled",
+)
+updates_handled_total = metrics.Counter(
+    "rocket_man_updates_handled_total",
+    "Updates taken out of the queue and handled",
+    ["result"],
+)
+
+
+class UpdateDispatcher:
+    """
+    Runs the handling of incoming updates in the background, on a fixed pool
+    of tasks instead of one task (or one open HTTP request) per update.
+
+    Updates are spread over `shards` queues by conversation, each consumed by
+    its own task: updates of a conversation are handled one after the other,
+    in the order they arrived, while different conversations are handled in
+    parallel.
+
+    Each queue holds at most `max_depth` updates. When it's full, `submit()`
+    refuses the update so the caller can push back on the sender.
+    """
+
+    def __init__(self, shards: int = 64, max_depth: int = 100):
+        """
+        :param shards: number of queues, and of tasks consuming them
+        :param max_depth: maximum number of updates waiting in each queue
+        """
+        self.shards = shards
+        self.max_depth = max_depth
+        self._queues: list[asyncio.Queue[Entry]] = []
+        self._workers: list[asyncio.Task] = []
+
+    def _start(self) -> None:
+        self._queues = [asyncio.Queue(self.max_depth) for _ in range(self.shards)]
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    def shard(self, conversation_id: str) -> int:
+        """
+        Index of the queue of a conversation.
+        """
+        return zlib.crc32(conversation_id.encode()) % self.shards
+
+    def submit(self, conversation_id: str, job: Job) -> bool:
+        """
+        Queue a job for a conversation. Returns `False` if the queue of the
+        conversation is full.
+        """
+        if not self._workers:
+            self._start()
+
+        try:
+            self._queues[self.shard(conversation_id)].put_nowait((monotonic(), job, None))
+        except asyncio.QueueFull:
+            queue_rejected_total.inc()
+            return False
+
+        queue_depth.inc()
+        return True
+
+    async def put(self, conversation_id: str, job: Job) -> "asyncio.Future[None]":
+        """
+        Queue a job for a conversation, waiting for room in its queue.
+        Returns a future resolved once the job ran (whether it failed or not),
+        or cancelled if the dispatcher is closed before the job is done.
+        """
+        if not self._workers:
+            self._start()
+
+        done = asyncio.get_running_loop().create_future()
+        queue_depth.inc()
+
+        try:
+            await self._queues[self.shard(conversation_id)].put((monotonic(), job, done))
+        except BaseException:
+            queue_depth.dec()
+            raise
+
+        return done
+
+    async def _work(self, queue: asyncio.Queue[Entry]) -> None:
+        while True:
+            queued_at, job, done = await queue.get()
+            queue_depth.dec()
+            queue_wait_seconds.observe(monotonic() - queued_at)
+
+            try:
+                await job()
+            except asyncio.CancelledError:
+                # interrupted by `close()`, the job didn't run to its end
+                if done is not None:
+                    done.cancel()
+                raise
+            except Exception:
+                updates_handled_total.labels("error").inc()
+                logger.exception("Error while handling an update")
+            else:
+                updates_handled_total.labels("ok").inc()
+            finally:
+                queue.task_done()
+
+                if done is not None and not done.done():
+                    done.set_result(None)
+
+    async def close(self, timeout: float = 60.0) -> None:
+        """
+        Let the queued updates be handled (for up to `timeout` seconds), then
+        stop the workers. The futures of the jobs that were interrupted or
+        never started are cancelled.
+        """
+        if not self._workers:
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            left = sum(queue.qsize() for queue in self._queues)
+            logger.warning("Stopping with %s updates still queued", left)
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        for queue in self._queues:
+            while not queue.empty():
+                _, _, done = queue.get_nowait()
+                queue_depth.dec()
+
+                if done is not None:
+                    done.cancel()
+
+
+# --- Worker-wide instance ---
+
+_dispatcher: UpdateDispatcher | None = None
+
+
+def get_dispatcher() -> UpdateDispatcher:
+    """
+    Get the dispatcher shared by the whole worker, configured from
+    `settings.UPDATE_QUEUE_PARAMS`.
+    """
+    global _dispatcher
+
+    if _dispatcher is None:
+        _dispatcher = UpdateDispatcher(**settings.UPDATE_QUEUE_PARAMS)
+    return _dispatcher
+
+
+async def close_dispatcher(app=None) -> None:
+    """
+    Drain and stop the shared dispatcher, if it was started. Can be used as
+    an aiohttp cleanup callback.
+    """
+    if _dispatcher is not None:
+        await _dispatcher.close()
@@ -0,0 +1,64 @@
+import hmac
+import struct
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as B64Error
+from hashlib import sha256
+from typing import NamedTuple
+
+from bernard.conf import settings
+
+# step, lo, hi, hash of the video name
+GAME_STATE = struct.Struct("<BIII")
+
+# Truncated HMAC-SHA256. With the state it makes 23 bytes, 31 characters of
+# base64, which keeps `{"action":"has_launched","g":"..."}` within the 64
+# bytes allowed in Telegram's `callback_data`.
+TAG_SIZE = 10
+
+
+class GameState(NamedTuple):
+    """
+    Where a user is in the bisection of a video: the launch frame is in
+    `[lo, hi]` and `step` is the number of the next question.
+    """
+
+    step: int
+    lo: int
+    hi: int
+    video_hash: int
+
+
+def _tag(body: bytes, conversation_id: str) -> bytes:
+    key = settings.WEBVIEW_SECRET_KEY.encode()
+    return hmac.new(key, body + conversation_id.encode(), sha256).digest()[:TAG_SIZE]
+
+
+def sign_game(game: GameState, conversation_id: str) -> str:
+    """
+    Pack a game state into a short signed token. The token is bound to the
+    conversation so it can't be replayed in another one.
+    """
+    body = GAME_STATE.pack(*game)
+    token = urlsafe_b64encode(body + _tag(body, conversation_id))
+    return token.rstrip(b"=").decode()
+
+
+def verify_game(token: str, conversation_id: str) -> GameState | None:
+    """
+    Unpack a token made by `sign_game()`. Returns `None` if it is malformed
+    or if its signature does not match.
+    """
+    try:
+        raw = urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (B64Error, ValueError):
+        return None
+
+    if len(raw) != GAME_STATE.size + TAG_SIZE:
+        return None
+
+    body, tag = raw[: GAME_STATE.size], raw[GAME_STATE.size :]
+
+    if not hmac.compare_digest(tag, _tag(body, conversation_id)):
+        return None
+
+    return GameState(*GAME_STATE.unpack(body))
@@ -0,0 +1,21 @@
+import io
+
+
+def render_jpeg(data: bytes, max_size: int, quality: int) -> bytes:
+    """
+    Scale a JPEG image down so it fits in a `max_size` square, and encode it
+    again at the given quality. Meant to run in a worker process: it only
+    depends on Pillow, imported here so the bot runs without it.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        # let the decoder do most of the downscaling, which is much faster
+        # than decoding at full size
+        image.draft("RGB", (max_size, max_size))
+        image = image.convert("RGB")
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
@@ -0,0 +1,21 @@
+from bernard.layers.definitions import BaseLayer
+
+
+class Frame(BaseLayer):
+    """
+    A frame of a FrameX video, to be shown along with the Markdown text that
+    follows it in the stack.
+
+    Depending on the platform configuration it is either delivered as a link
+    inside the text, or as a photo with the text as its caption.
+    """
+
+    def __init__(self, video_name: str, frame: int):
+        self.video_name = video_name
+        self.frame = frame
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and self.video_name == other.video_name and self.frame == other.frame
+
+    def _repr_arguments(self):
+        return [self.video_name, self.frame]
@@ -0,0 +1,263 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from math import inf
+from time import perf_counter
+from typing import Any, Iterator, Sequence, cast
+
+from aiohttp import web
+
+# Default buckets, in seconds, suited to network round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    Base class for metrics, modelled after the Prometheus client: a metric is
+    declared once at module level and then updated from the hot path, which
+    only costs a dictionary lookup and a few additions.
+
+    Each combination of label values has its own child holding the values.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], "MetricValue"] = {}
+        registry.register(self)
+
+    def _make_child(self) -> "MetricValue":
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """
+        Get the child metric for these label values.
+        """
+        try:
+            # label values are almost always strings already
+            return self._children[values]
+        except KeyError:
+            pass
+
+        key = tuple(str(v) for v in values)
+
+        try:
+            return self._children[key]
+        except KeyError:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}") from None
+
+            child = self._children[key] = self._make_child()
+            return child
+
+    def children(self) -> Iterator[tuple[tuple[str, ...], "MetricValue"]]:
+        """
+        Iterate over all label values and the values of their child metric.
+        """
+        if not self.labelnames:
+            # without labels, the metric holds the values itself
+            yield (), cast("MetricValue", self)
+        else:
+            yield from list(self._children.items())
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_CounterValue, Metric):
+    """
+    A value that only goes up.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        Metric.__init__(self, name, documentation, labelnames)
+        _CounterValue.__init__(self)
+
+    def _make_child(self):
+        return _CounterValue()
+
+
+class _GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class Gauge(_GaugeValue, Metric):
+    """
+    A value that goes up and down.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        Metric.__init__(self, name, documentation, labelnames)
+        _GaugeValue.__init__(self)
+
+    def _make_child(self):
+        return _GaugeValue()
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """
+        Observe the time spent in the `with` block.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+
+class Histogram(_HistogramValue, Metric):
+    """
+    Distribution of observed values (typically durations) into buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.bucket_bounds = tuple(sorted(buckets))
+        Metric.__init__(self, name, documentation, labelnames)
+        _HistogramValue.__init__(self, self.bucket_bounds)
+
+    def _make_child(self):
+        return _HistogramValue(self.bucket_bounds)
+
+
+# what a metric, or one of its children, holds
+MetricValue = _CounterValue | _GaugeValue | _HistogramValue
+
+
+class Registry:
+    """
+    Keeps track of all the declared metrics.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        All the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+            for values, child in metric.children():
+                labels = list(zip(metric.labelnames, values))
+
+                if isinstance(child, _HistogramValue):
+                    cumulative = 0
+
+                    for bound, count in zip([*child.buckets, inf], child.counts):
+                        cumulative += count
+                        lines.append(f"{metric.name}_bucket{_labels([*labels, ('le', bound)])} {cumulative}")
+
+                    lines.append(f"{metric.name}_sum{_labels(labels)} {_number(child.sum)}")
+                    lines.append(f"{metric.name}_count{_labels(labels)} {child.count}")
+                else:
+                    lines.append(f"{metric.name}{_labels(labels)} {_number(child.value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    if value == inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _labels(labels: list[tuple[str, Any]]) -> str:
+    if not labels:
+        return ""
+
+    def value(v: Any) -> str:
+        if isinstance(v, float):
+            return _number(v)
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{value(v)}"' for name, v in labels) + "}"
+
+
+registry = Registry()
+
+
+# --- Exposition ---
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics_view(request: web.Request) -> web.Response:
+    """
+    Serve the metrics of this process to Prometheus.
+    """
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+# --- Labels ---
+
+STATE_KEY = "metrics::state"
+
+
+def set_state(request, state: str) -> None:
+    """
+    Remember which state is handling a (BERNARD) request, to label the
+    metrics recorded while handling it.
+    """
+    request.custom_content[STATE_KEY] = state
+
+
+def get_state(request) -> str:
+    """
+    Name of the state handling a request, "none" before one is picked.
+    """
+    return request.custom_content.get(STATE_KEY, "none")
@@ -1,26 +1,413 @@
 import logging
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+from urllib.parse import quote
 
 import ujson
+from aiohttp import ClientResponse, ClientTimeout, FormData
 from aiohttp.web_request import Request
+from aiohttp.web_response import json_response
+from aiohttp.web_urldispatcher import UrlDispatcher
+from bernard import layers as lyr
+from bernard.conf import settings
+from bernard.engine.platform import PlatformOperationError
 from bernard.i18n import render
 from bernard.i18n import translate as t
 from bernard.layers import Stack
-from bernard.platforms.telegram.platform import Telegram
+from bernard.platforms.telegram import layers as tgr
+from bernard.platforms.telegram._utils import set_reply_markup
+from bernard.platforms.telegram.platform import (
+    Telegram,
+    TelegramMessage,
+    TelegramResponder,
+)
+
+from rocket_man import metrics, services
+from rocket_man.capture import close_recorder, get_recorder
+from rocket_man.dispatch import close_dispatcher, get_dispatcher
+from rocket_man.layers import Frame
+from rocket_man.polling import UpdatePoller
+from rocket_man.ratelimit import TelegramRateLimiter, counts_for_chat
+from rocket_man.services import get_frame_cache
+from rocket_man.storage import file_id_store
 
 logger = logging.getLogger(__name__)
 
+send_seconds = metrics.Histogram(
+    "rocket_man_telegram_send_seconds",
+    "Time spent sending a message to Telegram, throttling and retries included",
+    ["state"],
+)
+send_errors_total = metrics.Counter(
+    "rocket_man_telegram_send_errors_total",
+    "Messages that could not be sent to Telegram",
+    ["state"],
+)
+
 
 class RocketTg(Telegram):
     """
     BERNARD Telegram Platform with extended functionality
     """
 
+    PATTERNS = {
+        **Telegram.PATTERNS,
+        "frame": "^Frame Markdown InlineKeyboard? Update?$",
+    }
+
+    # created on first use
+    _rate_limiter: TelegramRateLimiter
+    _poller: UpdatePoller
+
+    @property
+    def frame_delivery(self) -> str:
+        """
+        How frames are delivered: "link" puts a link to FrameX in the text,
+        "photo" uploads the frame once and then re-sends it by `file_id`,
+        editing the game message in place.
+        """
+        return self.settings().get("frame_delivery", "link")
+
+    def make_url(self, method: str) -> str:
+        """
+        Generate a Telegram URL for this bot, on the configured Bot API
+        server.
+        """
+        api_url = self.settings().get("api_url", "https://api.telegram.org").rstrip("/")
+        return f"{api_url}/bot{quote(self.settings()['token'])}/{quote(method)}"
+
+    @property
+    def rate_limiter(self) -> TelegramRateLimiter:
+        """
+        Keeps the calls to Telegram under its rate limits, configured from
+        `settings.TELEGRAM_RATE_LIMIT_PARAMS`.
+        """
+        try:
+            return self._rate_limiter
+        except AttributeError:
+            self._rate_limiter = TelegramRateLimiter(**settings.TELEGRAM_RATE_LIMIT_PARAMS)
+            return self._rate_limiter
+
+    @property
+    def ingestion(self) -> str:
+        """
+        How updates are received: "webhook" handles them before answering the
+        webhook request, "queue" answers right away and handles them in the
+        background (see `rocket_man.dispatch`), "polling" fetches them with
+        `getUpdates` instead of setting a webhook (see `rocket_man.polling`).
+        """
+        return self.settings().get("ingestion", "webhook")
+
+    @property
+    def fsm_creates_task(self) -> bool:  # type: ignore[override]
+        # queued and polled updates are handled by the dispatcher's tasks,
+        # which must wait for the FSM to be done with each update
+        return self.ingestion == "webhook"
+
+    @property
+    def poller(self) -> UpdatePoller:
+        """
+        Fetches the updates in "polling" ingestion, configured from
+        `settings.TELEGRAM_POLLING_PARAMS`.
+        """
+        try:
+            return self._poller
+        except AttributeError:
+            self._poller = UpdatePoller(self, **settings.TELEGRAM_POLLING_PARAMS)
+            return self._poller
+
+    async def _deferred_init(self):
+        """
+        Register the webhook, or in "polling" ingestion remove it (Telegram
+        refuses `getUpdates` while there is one) and start polling.
+        """
+        if self.ingestion != "polling":
+            return await super()._deferred_init()
+
+        await self.call("deleteWebhook")
+        logger.info("Polling Telegram for updates")
+        self.poller.start()
+
+    async def _stop_polling(self, app=None) -> None:
+        if self.ingestion == "polling":
+            await self.poller.stop()
+
+    def hook_up(self, router: UrlDispatcher):
+        """
+        Register the platform routes and the metrics, and tie the shared
+        services to the app lifecycle. The update queue is drained before the
+        services close, after the poller stopped.
+        """
+        # imported here: the server imports the platforms while they load
+        from bernard.server.http import app
+
+        super().hook_up(router)
+        router.add_get("/metrics", metrics.metrics_view)
+
+        # polling stops first, so the updates it fetched get queued
+        if self._stop_polling not in app.on_cleanup:
+            app.on_cleanup.append(self._stop_polling)
+        if close_dispatcher not in app.on_cleanup:
+            app.on_cleanup.append(close_dispatcher)
+        if close_recorder not in app.on_cleanup:
+            app.on_cleanup.append(close_recorder)
+        services.hook_up(app)
+
+    async def receive_updates(self, request: Request):
+        """
+        Handle updates from Telegram. In "queue" ingestion, the update is
+        queued and acknowledged right away, so slow handling doesn't make
+        Telegram time out and send it again. If the queue is full, Telegram
+        is told to retry later.
+        """
+        if self.ingestion != "queue":
+            if get_recorder() is not None:
+                self._capture(await request.read())
+            return await super().receive_updates(request)
+
+        body = await request.read()
+
+        try:
+            content = ujson.loads(body)
+        except ValueError:
+            return json_response({"error": True, "message": "Cannot decode body"}, status=400)
+
+        logger.debug("Received from Telegram: %s", content)
+        conversation_id, job = self.make_update_job(content)
+
+        if not get_dispatcher().submit(conversation_id, job):
+            logger.warning("Update queue of %s is full, asking Telegram to retry", conversation_id)
+            return json_response({"error": True, "message": "Too many pending updates"}, status=503)
+
+        return json_response({"error": False})
+
+    def make_update_job(self, content: dict) -> tuple[str, Callable[[], Awaitable[None]]]:
+        """
+        Turn an update into the job handling it, for the dispatcher, along
+        with its conversation.
+        """
+        message = TelegramMessage(content, self)
+        responder = TelegramResponder(content, self)
+        conversation_id = message.get_conversation().id
+
+        if (recorder := get_recorder()) is not None:
+            recorder.record(conversation_id, content)
+
+        return conversation_id, lambda: self._notify(message, responder)
+
+    def _capture(self, body: bytes) -> None:
+        """
+        Record an update handled straight from the webhook, when traffic is
+        captured (see `rocket_man.capture`).
+        """
+        try:
+            content = ujson.loads(body)
+            conversation_id = TelegramMessage(content, self).get_conversation().id
+            get_recorder().record(conversation_id, content)  # type: ignore[union-attr]
+        except Exception:
+            logger.warning("Could not capture an update", exc_info=True)
+
+    async def get_updates(self, offset: int | None, limit: int, timeout: int) -> list[dict]:
+        """
+        Long poll Telegram for updates, confirming those before `offset`.
+        Unlike other calls, it is not rate limited: it sends no message.
+
+        :param timeout: how long Telegram waits for updates, in seconds
+        """
+        params: dict[str, Any] = {"limit": limit, "timeout": timeout}
+        if offset is not None:
+            params["offset"] = offset
+
+        async with self.session.post(
+            self.make_url("getUpdates"),
+            data=ujson.dumps(params),
+            headers={"content-type": "application/json"},
+            timeout=ClientTimeout(total=timeout + 10),
+        ) as resp:
+            data = await self._handle_telegram_response(resp)
+
+        return data["result"]
+
     async def _send_markdown(self, request: Request, stack: Stack):
         """
         Sends Markdown using `_send_text()`
         """
         await self._send_text(request, stack, "MarkdownV2")
 
+    async def _send_frame(self, request: Request, stack: Stack):
+        """
+        Sends a frame with its Markdown caption, according to the configured
+        frame delivery.
+        """
+        if self.frame_delivery != "photo":
+            layers = [layer for layer in stack.layers if not isinstance(layer, (Frame, tgr.Update))]
+            return await self._send_markdown(request, Stack(layers))
+
+        frame = stack.get_layer(Frame)
+        msg: dict[str, Any] = {
+            "chat_id": request.message.get_chat_id(),  # type: ignore[attr-defined]
+            "caption": await render(stack.get_layer(lyr.Markdown).text, request),
+            "parse_mode": "MarkdownV2",
+        }
+        await set_reply_markup(msg, request, stack)
+
+        if stack.has_layer(tgr.Update):
+            update = stack.get_layer(tgr.Update)
+
+            try:
+                return await self._edit_photo(msg, update, frame)
+            except PlatformOperationError:
+                logger.info("Could not edit message %s in place, sending a new one", update.message_id, exc_info=True)
+
+        return await self._send_photo(msg, frame)
+
+    async def _send_photo(self, msg: dict[str, Any], frame: Frame):
+        """
+        Send a frame as a new photo message, by `file_id` if it was already
+        uploaded.
+        """
+        if file_id := await file_id_store.get_file_id(frame.video_name, frame.frame):
+            try:
+                return await self.call("sendPhoto", photo=file_id, **msg)
+            except PlatformOperationError:
+                logger.warning("Telegram rejected file_id of %r, uploading it again", frame, exc_info=True)
+                await file_id_store.delete_file_id(frame.video_name, frame.frame)
+
+        data = await self._call_multipart("sendPhoto", msg, frame, "photo")
+        await self._remember_file_id(data, frame)
+        return data
+
+    async def _edit_photo(self, msg: dict[str, Any], update: tgr.Update, frame: Frame):
+        """
+        Replace the photo and caption of an existing message with a frame.
+        """
+        msg = dict(msg)
+        media = {
+            "type": "photo",
+            "caption": msg.pop("caption"),
+            "parse_mode": msg.pop("parse_mode"),
+        }
+
+        if update.inline_message_id:
+            del msg["chat_id"]
+            msg["inline_message_id"] = update.inline_message_id
+        else:
+            msg["message_id"] = update.message_id
+
+        if file_id := await file_id_store.get_file_id(frame.video_name, frame.frame):
+            try:
+                return await self.call(
+                    "editMessageMedia",
+                    {"Bad Request: message is not modified"},
+                    media={**media, "media": file_id},
+                    **msg,
+                )
+            except PlatformOperationError:
+                logger.warning("Telegram rejected file_id of %r, uploading it again", frame, exc_info=True)
+                await file_id_store.delete_file_id(frame.video_name, frame.frame)
+
+        msg["media"] = ujson.dumps({**media, "media": "attach://frame"})
+        data = await self._call_multipart("editMessageMedia", msg, frame, "frame")
+        await self._remember_file_id(data, frame)
+        return data
+
+    async def _make_upload_form(self, msg: dict[str, Any], frame: Frame, field: str) -> FormData:
+        """
+        Build a multipart form with the message fields and the frame JPEG.
+        """
+        form = FormData()
+
+        for name, value in msg.items():
+            if not isinstance(value, str):
+                value = ujson.dumps(value)
+            form.add_field(name, value)
+
+        jpeg = await get_frame_cache().get_video_frame(frame.video_name, frame.frame)
+        form.add_field(field, jpeg, filename=f"{frame.video_name}-{frame.frame}.jpg", content_type="image/jpeg")
+        return form
+
+    async def _call_multipart(self, method: str, msg: dict[str, Any], frame: Frame, field: str):
+        """
+        Call a Telegram method with a multipart body, uploading the frame in
+        `field`. The form is built again if the call must be retried.
+        """
+        logger.debug("Calling Telegram %s(<multipart>)", method)
+        url = self.make_url(method)
+
+        async def post():
+            return self.session.post(url, data=await self._make_upload_form(msg, frame, field))
+
+        data = await self._throttled(msg.get("chat_id"), post, lambda resp: resp.json())
+        logger.debug("Telegram replied: %s", data)
+
+        if not data.get("ok"):
+            raise PlatformOperationError(f"Telegram replied with an error: {data.get('description')}")
+        return data
+
+    async def call(self, method: str, _ignore: set[str] | None = None, **params: Any):
+        """
+        Call a Telegram method, within the rate limits.
+
+        :param _ignore: List of reasons to ignore
+        :param method: Name of the method to call
+        :param params: Dictionary of the parameters to send
+
+        :return: Returns the API response
+        """
+        logger.debug("Calling Telegram %s(%s)", method, params)
+        url = self.make_url(method)
+        headers = {
+            "content-type": "application/json",
+        }
+
+        async def post():
+            return self.session.post(url, data=ujson.dumps(params), headers=headers)
+
+        out = await self._throttled(
+            params.get("chat_id") if counts_for_chat(method) else None,
+            post,
+            lambda resp: self._handle_telegram_response(resp, _ignore),
+        )
+        logger.debug("Telegram replied: %s", out)
+        return out
+
+    async def _throttled(
+        self,
+        chat_id: int | str | None,
+        make_request: Callable[[], Awaitable[Any]],
+        handle_response: Callable[[ClientResponse], Awaitable[Any]],
+    ):
+        """
+        Make a request once the rate limiter allows it. If Telegram answers
+        429 anyway, wait for as long as it says and try again (a 429 means
+        the call was not carried out, so it's safe to repeat).
+        """
+        limiter = self.rate_limiter
+
+        for attempt in range(limiter.max_retries + 1):
+            await limiter.acquire(chat_id)
+
+            async with await make_request() as resp:
+                if resp.status == 429 and attempt < limiter.max_retries:
+                    retry_after = await _get_retry_after(resp)
+                    logger.warning("Telegram asks to slow down for %ss (chat %s)", retry_after, chat_id)
+                    await limiter.retry_after(chat_id, retry_after)
+                    continue
+
+                return await handle_response(resp)
+
+    async def _remember_file_id(self, data: dict, frame: Frame) -> None:
+        """
+        Store the file_id Telegram assigned to a freshly uploaded frame.
+        """
+        result = data.get("result")
+        if not isinstance(result, dict) or not result.get("photo"):
+            return
+
+        # sizes are sorted, the last one is the original
+        file_id = result["photo"][-1]["file_id"]
+        await file_id_store.set_file_id(frame.video_name, frame.frame, file_id)
+
     async def send(self, request: Request, stack: Stack) -> None:
         """
         Send a stack to the platform.
@@ -28,12 +415,18 @@ class RocketTg(Telegram):
         Actually this will delegate to one of the `_send_*` functions depending
         on what the stack looks like.
         """
+        state = metrics.get_state(request)
+        start = perf_counter()
+
         try:
             return await super().send(request, stack)
         except Exception as err:
+            send_errors_total.labels(state).inc()
             logger.exception("Error sending message to Telegram")
             await self.send_failure(request)
             raise err
+        finally:
+            send_seconds.labels(state).observe(perf_counter() - start)
 
     async def send_failure(self, request: Request):
         """
@@ -51,11 +444,20 @@ class RocketTg(Telegram):
             "content-type": "application/json",
         }
 
-        async with self.session.post(
-            url,
-            data=ujson.dumps(params),
-            headers=headers,
-        ) as resp:
-            data = await resp.json()
-            logger.debug("Telegram replied: %s", data)
-            return data
+        async def post():
+            return self.session.post(url, data=ujson.dumps(params), headers=headers)
+
+        data = await self._throttled(params["chat_id"], post, lambda resp: resp.json())
+        logger.debug("Telegram replied: %s", data)
+        return data
+
+
+async def _get_retry_after(resp: ClientResponse) -> float:
+    """
+    Read how long Telegram asks to wait from a 429 answer.
+    """
+    try:
+        data = await resp.json()
+        return float(data["parameters"]["retry_after"])
+    except (ValueError, TypeError, KeyError):
+        return float(resp.headers.get("Retry-After", 1))
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+from rocket_man import metrics
+from rocket_man.dispatch import get_dispatcher
+
+if TYPE_CHECKING:
+    from rocket_man.platforms import RocketTg
+
+logger = logging.getLogger(__name__)
+
+batch_size = metrics.Histogram(
+    "rocket_man_telegram_poll_batch_size",
+    "Updates received by each call to getUpdates",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+poll_errors_total = metrics.Counter(
+    "rocket_man_telegram_poll_errors_total",
+    "Calls to getUpdates that failed",
+)
+
+
+class UpdatePoller:
+    """
+    Fetches updates from Telegram with `getUpdates` long polling, for bots
+    that can't (or don't want to) receive webhooks.
+
+    Each call fetches up to `limit` updates, which are handed to the update
+    dispatcher (see `rocket_man.dispatch`): conversations are handled in
+    parallel, the updates of each one in order. The next call only confirms
+    the batch (by moving the offset past it) once all of it was handled, so
+    updates of a worker that dies are fetched again rather than lost.
+
+    Telegram only allows one `getUpdates` at a time per bot, so only one
+    process may poll.
+    """
+
+    def __init__(
+        self,
+        platform: "RocketTg",
+        limit: int = 100,
+        timeout: int = 30,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 30.0,
+    ):
+        """
+        :param platform: the platform that fetches and handles the updates
+        :param limit: maximum number of updates per call, 100 at most
+        :param timeout: how long each call waits for updates, in seconds
+        :param retry_delay: wait after a failed call, in seconds, doubled at
+            each consecutive failure
+        :param max_retry_delay: longest wait after a failed call, in seconds
+        """
+        self.platform = platform
+        self.limit = limit
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.offset: int | None = None
+
+        self._task: asyncio.Task | None = None
+        self._fetch: asyncio.Future | None = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 60.0) -> None:
+        """
+        Stop fetching, let the current batch be handled (for up to `timeout`
+        seconds) and confirm it.
+        """
+        if self._task is None:
+            return
+
+        self._stopping = True
+
+        if self._fetch is not None:
+            self._fetch.cancel()
+
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopped polling in the middle of a batch, it will be fetched again")
+        finally:
+            self._task = None
+
+    async def _run(self) -> None:
+        delay = self.retry_delay
+
+        while not self._stopping:
+            self._fetch = asyncio.ensure_future(self.platform.get_updates(self.offset, self.limit, self.timeout))
+
+            try:
+                updates = await self._fetch
+            except asyncio.CancelledError:
+                if self._stopping:
+                    break
+                raise
+            except Exception:
+                poll_errors_total.inc()
+                logger.warning("Could not get updates from Telegram, retrying in %ss", delay, exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            finally:
+                self._fetch = None
+
+            delay = self.retry_delay
+            batch_size.observe(len(updates))
+
+            if updates:
+                self.offset = await self._handle(updates)
+
+                if self.offset <= updates[-1]["update_id"]:
+                    logger.warning("The update queue closed in the middle of a batch, stopped polling")
+                    break
+
+        await self._confirm()
+
+    async def _handle(self, updates: list[dict]) -> int:
+        """
+        Dispatch a batch of updates and wait until all of them are handled,
+        or the dispatcher closed. Returns the offset confirming the updates
+        that were handled, up to the first that wasn't.
+        """
+        dispatcher = get_dispatcher()
+        handled = []
+
+        for update in updates:
+            try:
+                conversation_id, handle = self.platform.make_update_job(update)
+            except Exception:
+                logger.exception("Skipping update %s that could not be read", update.get("update_id"))
+                continue
+
+            handled.append((update["update_id"], await dispatcher.put(conversation_id, handle)))
+
+        if handled:
+            await asyncio.wait([done for _, done in handled])
+
+        for update_id, done in handled:
+            if done.cancelled():
+                return update_id
+
+        return updates[-1]["update_id"] + 1
+
+    async def _confirm(self) -> None:
+        """
+        Confirm the last handled batch, which otherwise only happens with the
+        next call.
+        """
+        if self.offset is None:
+            return
+
+        try:
+            await self.platform.get_updates(self.offset, 1, 0)
+        except Exception:
+            logger.warning("Could not confirm the last updates, they will be fetched again", exc_info=True)
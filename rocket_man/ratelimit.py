@@ -0,0 +1,191 @@
+import asyncio
+import random
+from collections import OrderedDict
+from time import monotonic
+
+from rocket_man import metrics
+from rocket_man.storage.buckets import TokenBucketStore
+
+throttle_waiting = metrics.Gauge(
+    "rocket_man_telegram_throttle_waiting",
+    "Calls to Telegram waiting for the rate limiter",
+)
+throttle_seconds = metrics.Histogram(
+    "rocket_man_telegram_throttle_seconds",
+    "Time calls to Telegram were held back by the rate limiter",
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0),
+)
+rate_limited_total = metrics.Counter(
+    "rocket_man_telegram_rate_limited_total",
+    "Calls to Telegram answered with 429 Too Many Requests",
+    ["scope"],
+)
+
+
+def counts_for_chat(method: str) -> bool:
+    """
+    Whether a Bot API method posts to a chat and so counts towards the
+    chat's rate limit (chat actions and callback answers don't).
+    """
+    if method == "sendChatAction":
+        return False
+    return method.startswith(("send", "edit")) or method in ("copyMessage", "forwardMessage")
+
+
+class TokenBucket:
+    """
+    Token bucket of `rate` tokens per second holding up to `burst` tokens,
+    implemented as GCRA: instead of counting tokens, it keeps the time at
+    which the bucket will be full again.
+
+    Tokens are reserved in advance: `reserve()` tells how long to wait for
+    the token it just took, so waiters are served in order, each at its own
+    slot, rather than all waking up and competing for the next token.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        :param rate: tokens per second
+        :param burst: tokens that can be taken at once from a full bucket
+        """
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+
+    def reserve(self, now: float) -> float:
+        """
+        Take a token, returning how long to wait before using it.
+        """
+        at = max(now, self.tat - self.tolerance)
+        self.tat = max(self.tat, at) + self.interval
+        return at - now
+
+    def block(self, until: float) -> None:
+        """
+        Give no token before `until`, and then resume at the steady rate
+        rather than with a burst.
+        """
+        self.tat = max(self.tat, until + self.tolerance)
+
+
+class TokenBuckets:
+    """
+    Token buckets of this process, by key, with the same interface as
+    `TokenBucketStore`. Only the `max_buckets` most recently used ones are
+    remembered.
+    """
+
+    def __init__(self, max_buckets: int = 10_000):
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def _bucket(self, key: str, rate: float, burst: int) -> TokenBucket:
+        try:
+            self._buckets.move_to_end(key)
+            return self._buckets[key]
+        except KeyError:
+            pass
+
+        bucket = self._buckets[key] = TokenBucket(rate, burst)
+
+        if len(self._buckets) > self.max_buckets:
+            # the least recently used one, which is most likely idle
+            self._buckets.popitem(last=False)
+
+        return bucket
+
+    async def reserve(self, key: str, rate: float, burst: int) -> float:
+        return self._bucket(key, rate, burst).reserve(monotonic())
+
+    async def block(self, key: str, rate: float, burst: int, duration: float) -> None:
+        self._bucket(key, rate, burst).block(monotonic() + duration)
+
+
+class TelegramRateLimiter:
+    """
+    Keeps calls to the Bot API under Telegram's limits, so the bot is held
+    back a bit rather than banned for a while: a global bucket (~30
+    messages/s), and one bucket per chat (~1 message/s in private chats,
+    ~20 messages/min in groups, which have negative ids).
+
+    The buckets are kept in Redis, so the limits hold for all the workers
+    together, whichever of them handles a chat. With the "memory" backend
+    (a single worker), they are kept in the process.
+
+    When Telegram answers 429 anyway, the chat is blocked for the
+    `retry_after` it asked for (plus some jitter so the calls that were
+    waiting don't all retry at once), or the whole bot if the call was not
+    for a chat.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        global_burst: int = 30,
+        private_rate: float = 1.0,
+        private_burst: int = 3,
+        group_rate: float = 20 / 60,
+        group_burst: int = 5,
+        max_retries: int = 3,
+        jitter: float = 0.1,
+        max_chats: int = 10_000,
+        backend: str = "redis",
+    ):
+        """
+        :param global_rate: calls per second for the whole bot
+        :param global_burst: calls at once for the whole bot
+        :param private_rate: calls per second in a private chat
+        :param private_burst: calls at once in a private chat
+        :param group_rate: calls per second in a group
+        :param group_burst: calls at once in a group
+        :param max_retries: how many times a call answered with 429 is retried
+        :param jitter: extra fraction of `retry_after` waited at random
+        :param max_chats: number of chats whose bucket is remembered, with
+            the "memory" backend
+        :param backend: "redis" to share the buckets between workers,
+            "memory" to keep them in the process
+        """
+        self.buckets: TokenBucketStore | TokenBuckets
+        self.buckets = TokenBucketStore() if backend == "redis" else TokenBuckets(max_chats)
+        self.limits = (global_rate, global_burst)
+        self.private = (private_rate, private_burst)
+        self.group = (group_rate, group_burst)
+        self.max_retries = max_retries
+        self.jitter = jitter
+
+    def _bucket(self, chat_id: int | str | None) -> tuple[str, float, int]:
+        """
+        Key, rate and burst of the bucket of a chat, or of the global one.
+        """
+        if chat_id is None:
+            return ("global", *self.limits)
+
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        return (f"chat::{chat_id}", *(self.group if is_group else self.private))
+
+    async def acquire(self, chat_id: int | str | None) -> None:
+        """
+        Wait for the right to make a call, to a chat if given. The chat's
+        turn is awaited before reserving a global slot, so a flooding chat
+        doesn't hold global slots that other chats could use.
+        """
+        started = monotonic()
+        throttle_waiting.inc()
+
+        try:
+            if chat_id is not None:
+                if (delay := await self.buckets.reserve(*self._bucket(chat_id))) > 0:
+                    await asyncio.sleep(delay)
+
+            if (delay := await self.buckets.reserve(*self._bucket(None))) > 0:
+                await asyncio.sleep(delay)
+        finally:
+            throttle_waiting.dec()
+            throttle_seconds.observe(monotonic() - started)
+
+    async def retry_after(self, chat_id: int | str | None, retry_after: float) -> None:
+        """
+        Handle a 429 answer asking to wait `retry_after` seconds.
+        """
+        rate_limited_total.labels("global" if chat_id is None else "chat").inc()
+        await self.buckets.block(*self._bucket(chat_id), retry_after * (1 + random.uniform(0, self.jitter)))
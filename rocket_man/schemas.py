@@ -1,3 +1,4 @@
+from functools import cache
 from typing import Self
 
 from pydantic import BaseModel, TypeAdapter
@@ -28,16 +29,42 @@ class BaseSchema(BaseModel):
         Returns:
             The list of validated model instances.
         """
-        return TypeAdapter(list[cls]).validate_json(json_list_data)  # type: ignore[valid-type]
+        return cls.list_adapter().validate_json(json_list_data)  # type: ignore[arg-type]
 
+    @classmethod
+    def list_adapter(cls) -> TypeAdapter[list[Self]]:
+        """Get the adapter validating lists of this model.
+
+        Building an adapter compiles a validator, so there is one per schema,
+        built on first use.
+
+        Returns:
+            The adapter of `list[cls]`.
+        """
+        return _list_adapter(cls)
+
+
+@cache
+def _list_adapter(schema: type[BaseSchema]) -> TypeAdapter:
+    return TypeAdapter(list[schema])  # type: ignore[valid-type]
 
-class Video(BaseSchema):
-    """FrameX Video schema."""
+
+class VideoEntry(BaseSchema):
+    """What the game needs to know about a FrameX video.
+
+    Parsing a listing into entries skips the other fields, which are never
+    used for the videos of the catalog.
+    """
 
     name: str
+    frames: int
+
+
+class Video(VideoEntry):
+    """FrameX Video schema."""
+
     width: int
     height: int
-    frames: int
     frame_rate: tuple[int, int]
     url: str
     first_frame: str
@@ -0,0 +1,162 @@
+from bernard.conf import settings
+
+from rocket_man.services import get_catalog, next_frames
+from rocket_man.storage import launch_prior_store
+from rocket_man.storage.priors import LaunchPriorStore, prior_edges
+
+
+class SearchStrategy:
+    """
+    Decides which frame to show next while looking for the launch in a
+    video. The launch is known to be in `[lo, hi]`: the user is shown a frame
+    `mid`, and the search goes on in `[lo, mid]` if the rocket launched
+    already, in `[mid + 1, hi]` otherwise, until a single frame is left.
+    """
+
+    async def split(self, video_name: str, lo: int, hi: int) -> int:
+        """
+        Frame to show next, between `lo` and `hi - 1` (or `lo` if it is the
+        only frame left).
+        """
+        raise NotImplementedError
+
+    async def next_splits(self, video_name: str, lo: int, hi: int, mid: int) -> tuple[int, int]:
+        """
+        Frames that can be shown after `mid`, depending on the answer of the
+        user.
+        """
+        return await self.split(video_name, lo, mid), await self.split(video_name, mid + 1, hi)
+
+    async def record_win(self, video_name: str, frame: int) -> None:
+        """
+        Learn from a game that found the launch at `frame`.
+        """
+
+
+class Bisection(SearchStrategy):
+    """
+    Always show the frame in the middle, which takes `log2(frames)` steps
+    whatever the video.
+    """
+
+    async def split(self, video_name: str, lo: int, hi: int) -> int:
+        return (lo + hi) // 2
+
+    async def next_splits(self, video_name: str, lo: int, hi: int, mid: int) -> tuple[int, int]:
+        return next_frames(lo, hi)
+
+
+class PriorGuided(SearchStrategy):
+    """
+    Split where the launch is as likely to be before as after, according to
+    where players found it in previous games of the same video. Each answer
+    then brings a full bit of information, so the expected number of steps
+    is about the entropy of the prior instead of `log2(frames)`: a video
+    whose launch everybody finds around the same frame takes a handful of
+    steps.
+
+    The prior is mixed with a uniform distribution (`exploration` of it), so
+    that a misleading prior still finds the launch in a bounded number of
+    steps (about twice those of a bisection with the default).
+    Videos with fewer than `min_games` recorded games are bisected.
+    """
+
+    def __init__(self, store: LaunchPriorStore, min_games: int = 20, exploration: float = 0.1):
+        """
+        :param store: histograms of the launch frames
+        :param min_games: games needed before the prior of a video is used
+        :param exploration: share of the uniform distribution in the mix,
+            from 0 (trust the prior entirely) to 1 (bisection)
+        """
+        self.store = store
+        self.min_games = min_games
+        self.exploration = exploration
+
+    async def split(self, video_name: str, lo: int, hi: int) -> int:
+        if lo >= hi:
+            return lo
+
+        frames = (await get_catalog().get_video(video_name)).frames
+        counts = await self.store.get(video_name, frames)
+
+        if sum(counts) < self.min_games:
+            return (lo + hi) // 2
+
+        return weighted_median(counts, prior_edges(frames), lo, hi, self.exploration)
+
+    async def record_win(self, video_name: str, frame: int) -> None:
+        frames = (await get_catalog().get_video(video_name)).frames
+        await self.store.record(video_name, frames, frame)
+
+
+def weighted_median(counts: list[int], edges: list[int], lo: int, hi: int, exploration: float) -> int:
+    """
+    Smallest `mid` of `[lo, hi - 1]` such that `[lo, mid]` holds at least
+    half of the probability of `[lo, hi]`.
+
+    The probability of a frame is the count of its bin spread evenly over the
+    frames of the bin, normalized over `[lo, hi]` and mixed with a uniform
+    distribution.
+
+    :param counts: count of each bin
+    :param edges: first frame of each bin, followed by the number of frames
+    """
+    # `hi` can be one past the last frame, count it in the last bin
+    edges = [*edges[:-1], max(edges[-1], hi + 1)]
+    bins = []
+
+    for i, count in enumerate(counts):
+        start, end = max(edges[i], lo), min(edges[i + 1], hi + 1)
+
+        if start < end:
+            bins.append((start, end, count / (edges[i + 1] - edges[i])))
+
+    prior_mass = sum((end - start) * density for start, end, density in bins)
+
+    if prior_mass <= 0:
+        return (lo + hi) // 2
+
+    uniform = exploration / (hi - lo + 1)
+    half = 0.5
+    mass = 0.0
+
+    for start, end, density in bins:
+        weight = (1 - exploration) * density / prior_mass + uniform
+        bin_mass = (end - start) * weight
+
+        if weight > 0 and mass + bin_mass >= half:
+            # frames of this bin needed to reach half of the probability
+            needed = -int(-(half - mass) // weight)
+            return min(max(start + needed - 1, lo), hi - 1)
+
+        mass += bin_mass
+
+    return hi - 1
+
+
+# --- Worker-wide instance ---
+
+_strategy: SearchStrategy | None = None
+
+
+def get_search_strategy() -> SearchStrategy:
+    """
+    Get the search strategy of the worker, as chosen by
+    `settings.SEARCH_STRATEGY`.
+    """
+    global _strategy
+
+    if _strategy is None:
+        if settings.SEARCH_STRATEGY == "prior":
+            _strategy = PriorGuided(launch_prior_store, **settings.SEARCH_PARAMS)
+        else:
+            _strategy = Bisection()
+    return _strategy
+
+
+def set_search_strategy(strategy: SearchStrategy | None) -> None:
+    """
+    Replace the search strategy of the worker.
+    """
+    global _strategy
+    _strategy = strategy
@@ -0,0 +1,68 @@
+from typing import Any, Awaitable, Callable, MutableSequence
+
+from aiohttp.web import Application
+
+from rocket_man.services.catalog import (
+    CatalogCache,
+    VideoCatalog,
+    get_catalog,
+    set_catalog,
+    video_hash,
+)
+from rocket_man.services.frames import (
+    FrameCache,
+    FramePrefetcher,
+    close_frames,
+    get_frame_cache,
+    get_prefetcher,
+    next_frames,
+    set_frame_cache,
+)
+from rocket_man.services.framex import (
+    FrameXService,
+    FrameXUnavailable,
+    VideoList,
+    close_framex,
+    get_framex,
+    set_framex,
+)
+from rocket_man.services.local_frames import (
+    LocalFrameService,
+    VideoNotFound,
+    ingest_video,
+)
+
+
+async def _start_services(app: Application) -> None:
+    get_framex()
+    get_catalog()
+    get_prefetcher()
+
+
+async def _close_services(app: Application) -> None:
+    close_frames()
+    await close_framex()
+
+
+def _connect(signal: MutableSequence[Any], callback: Callable[[Application], Awaitable[None]]) -> None:
+    """
+    Add a callback to a signal of the app, once. aiohttp 3.8 declares its
+    signals for an older aiosignal, whose type checks every callback against
+    the wrong signature, hence the loose `signal` type.
+    """
+    if callback not in signal:
+        signal.append(callback)
+
+
+def hook_up(app: Application) -> None:
+    """
+    Tie the shared services to the lifecycle of the aiohttp app: they are
+    created on startup and their connections are closed on cleanup. Local
+    frames are served by the app itself.
+    """
+    service = get_framex()
+    if isinstance(service, LocalFrameService) and not service.routes_added(app.router):
+        service.add_routes(app.router)
+
+    _connect(app.on_startup, _start_services)
+    _connect(app.on_cleanup, _close_services)
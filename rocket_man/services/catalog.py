@@ -0,0 +1,280 @@
+import logging
+import random
+import zlib
+from array import array
+from time import monotonic
+from typing import Callable, Sequence
+
+from bernard.conf import settings
+
+from rocket_man.schemas import VideoEntry
+from rocket_man.services.framex import FrameXService, get_framex
+from rocket_man.services.local_frames import LocalFrameService
+from rocket_man.utils import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def video_hash(video_name: str) -> int:
+    """
+    A short, stable identifier of a video, for when its name is too long
+    (e.g. in callback payloads).
+    """
+    return zlib.crc32(video_name.encode())
+
+
+class VideoCatalog:
+    """
+    The videos of the catalog, packed for the game: names in a list with an
+    index by name (and by `video_hash()`), frame counts in an array, and no
+    model per video.
+
+    `sample()` picks a video at random in constant time with the alias
+    method, by default with the same probability for all of them.
+
+    Catalogs are immutable, `updated()` makes the next one, reusing what did
+    not change.
+    """
+
+    def __init__(self, entries: Sequence[VideoEntry] = (), weight: Callable[[VideoEntry], float] | None = None):
+        """
+        :param entries: the videos, duplicate names are ignored
+        :param weight: how likely each video is to be sampled, relative to
+            the others
+        """
+        self.names: list[str] = []
+        self.frames = array("I")
+        self.index: dict[str, int] = {}
+        self._weight = weight
+        weights = []
+
+        for entry in entries:
+            if entry.name in self.index:
+                continue
+
+            self.index[entry.name] = len(self.names)
+            self.names.append(entry.name)
+            self.frames.append(entry.frames)
+            weights.append(weight(entry) if weight else 1.0)
+
+        self._by_hash = {video_hash(name): i for i, name in enumerate(self.names)}
+        self._prob, self._alias = _alias_tables(weights)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, video_name: str) -> bool:
+        return video_name in self.index
+
+    def entry(self, i: int) -> VideoEntry:
+        return VideoEntry.model_construct(name=self.names[i], frames=self.frames[i])
+
+    def get(self, video_name: str) -> VideoEntry | None:
+        if (i := self.index.get(video_name)) is None:
+            return None
+        return self.entry(i)
+
+    def get_by_hash(self, video_hash: int) -> VideoEntry | None:
+        if (i := self._by_hash.get(video_hash)) is None:
+            return None
+        return self.entry(i)
+
+    def sample(self, rng: random.Random | None = None) -> VideoEntry:
+        """
+        Pick a video at random. Raises `IndexError` if the catalog is empty.
+        """
+        if not self.names:
+            raise IndexError("The video catalog is empty")
+
+        # one draw gives both the column and the coin flip
+        u = (rng or random).random() * len(self.names)
+        i = int(u)
+        return self.entry(i if u - i < self._prob[i] else self._alias[i])
+
+    def updated(self, entries: Sequence[VideoEntry]) -> "VideoCatalog":
+        """
+        The catalog with the given videos instead. It is this very catalog if
+        they are the same, and otherwise the names of the videos that were
+        already there are shared with it.
+        """
+        if len(entries) == len(self.names) and all(
+            self.index.get(entry.name) == i and self.frames[i] == entry.frames for i, entry in enumerate(entries)
+        ):
+            return self
+
+        known = self.index
+        shared = [
+            entry
+            if (i := known.get(entry.name)) is None
+            else VideoEntry.model_construct(name=self.names[i], frames=entry.frames)
+            for entry in entries
+        ]
+        return VideoCatalog(shared, self._weight)
+
+
+def _alias_tables(weights: list[float]) -> tuple[array, array]:
+    """
+    Tables of the alias method (Vose): sampling column `i` uniformly, then
+    keeping it with probability `prob[i]` or taking `alias[i]` otherwise,
+    picks each index with a probability proportional to its weight.
+    """
+    n = len(weights)
+    prob = array("d", [1.0] * n)
+    alias = array("I", range(n))
+    total = sum(weights)
+
+    if not n or total <= 0:
+        return prob, alias
+
+    scaled = [w * n / total for w in weights]
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less] = scaled[less]
+        alias[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        (small if scaled[more] < 1.0 else large).append(more)
+
+    # what is left is 1 up to rounding errors
+    return prob, alias
+
+
+class CatalogCache:
+    """
+    Cache in front of the FrameX video catalog.
+
+    The catalog is fresh for `ttl` seconds. After that it keeps being served
+    for up to `stale_ttl` more seconds while it is refreshed in the background
+    (stale-while-revalidate). Past that point callers wait for the refresh.
+
+    Concurrent refreshes are collapsed into a single FrameX request, which
+    sends the validators of the previous response so an unchanged catalog
+    costs a 304 and no parsing at all. A changed one is parsed into a
+    `VideoCatalog`, without the metadata the game doesn't need.
+
+    While the circuit breaker of FrameX is open, the catalog is served as is,
+    however old, without trying to refresh it.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        stale_ttl: float = 3600.0,
+        service: FrameXService | None = None,
+        weight: Callable[[VideoEntry], float] | None = None,
+    ):
+        """
+        :param ttl: how long the catalog is fresh, in seconds
+        :param stale_ttl: how long a stale catalog is still served while it is
+            refreshed, in seconds
+        :param service: FrameX service to use, defaults to the shared one
+        :param weight: how likely each video is to be played, relative to the
+            others, all the same by default
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._service = service
+
+        self._videos = VideoCatalog(weight=weight)
+        self._etag: str | None = None
+        self._last_modified: str | None = None
+        self._fetched_at: float | None = None
+        self._flight = SingleFlight[str, None]()
+        self._video_flight = SingleFlight[str, VideoEntry]()
+
+    @property
+    def service(self) -> FrameXService | LocalFrameService:
+        return self._service or get_framex()
+
+    def _age(self) -> float | None:
+        if self._fetched_at is None:
+            return None
+        return monotonic() - self._fetched_at
+
+    async def _refresh(self) -> None:
+        result = await self.service.list_videos_if_modified(self._etag, self._last_modified, schema=VideoEntry)
+
+        if result.videos is not None:
+            self._videos = self._videos.updated(result.videos)
+
+        self._etag = result.etag
+        self._last_modified = result.last_modified
+        self._fetched_at = monotonic()
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self._refresh()
+        except Exception:
+            logger.warning("Could not refresh the video catalog, serving stale data", exc_info=True)
+
+    async def refresh(self) -> None:
+        """
+        Refresh the catalog now, or wait for the refresh already running.
+        """
+        await self._flight.do("catalog", self._refresh)
+
+    async def list_videos(self) -> VideoCatalog:
+        """
+        List all videos.
+        """
+        age = self._age()
+
+        if age is None:
+            await self.refresh()
+        elif self.service.circuit_open:
+            # FrameX is failing, whatever we have is better than an error
+            pass
+        elif age >= self.ttl + self.stale_ttl:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.warning("Could not refresh the expired video catalog, serving it anyway", exc_info=True)
+        elif age >= self.ttl:
+            self._flight.start("catalog", self._background_refresh)
+
+        return self._videos
+
+    async def get_video(self, video_name: str) -> VideoEntry:
+        """
+        Get a video. Videos missing from the catalog are asked to FrameX
+        directly.
+        """
+        videos = await self.list_videos()
+
+        if (entry := videos.get(video_name)) is not None:
+            return entry
+        return await self._video_flight.do(video_name, lambda: self.service.get_video(video_name))
+
+    async def get_video_by_hash(self, video_hash: int) -> VideoEntry | None:
+        """
+        Find a video of the catalog from the hash of its name (see
+        `video_hash()`).
+        """
+        return (await self.list_videos()).get_by_hash(video_hash)
+
+
+# --- Worker-wide instance ---
+
+_catalog: CatalogCache | None = None
+
+
+def get_catalog() -> CatalogCache:
+    """
+    Get the catalog cache shared by the whole worker. It is built from
+    `settings.CATALOG_PARAMS` the first time it is needed.
+    """
+    global _catalog
+
+    if _catalog is None:
+        _catalog = CatalogCache(**settings.CATALOG_PARAMS)
+    return _catalog
+
+
+def set_catalog(catalog: CatalogCache | None) -> None:
+    """
+    Replace the shared catalog cache, typically with a stub in tests.
+    """
+    global _catalog
+    _catalog = catalog
@@ -0,0 +1,388 @@
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from time import perf_counter
+from typing import Iterable
+
+from bernard.conf import settings
+
+from rocket_man import metrics
+from rocket_man.imaging import render_jpeg
+from rocket_man.services.framex import FrameXService, get_framex
+from rocket_man.services.local_frames import LocalFrameService
+from rocket_man.storage.frames import FrameStore, get_frame_store
+from rocket_man.utils import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+FrameKey = tuple[str, int]
+FrameData = bytes | memoryview
+
+renditions_total = metrics.Counter(
+    "rocket_man_frame_renditions_total",
+    "Frames scaled down for Telegram (scaled), kept as is because that was smaller (original) or failed (error)",
+    ["result"],
+)
+rendition_seconds = metrics.Histogram(
+    "rocket_man_frame_rendition_seconds",
+    "Time to scale a frame down in the process pool, waiting for a process included",
+)
+
+
+class FrameCache:
+    """
+    In-memory LRU of frames (JPEG images), bounded by their total size.
+
+    Frames are fetched from FrameX on a miss. Concurrent misses on the same
+    frame, whoever they come from, share a single download.
+
+    If a frame store is given, it is used as a second level: misses are
+    looked up there before going to FrameX, and downloads are saved there.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        service: FrameXService | None = None,
+        store: FrameStore | None = None,
+    ):
+        """
+        :param max_bytes: maximum total size of the cached frames
+        :param service: FrameX service to use, defaults to the shared one
+        :param store: on-disk frame store backing this cache, if any
+        """
+        self.max_bytes = max_bytes
+        self._service = service
+        self.store = store
+
+        self._frames: OrderedDict[FrameKey, FrameData] = OrderedDict()
+        self._size = 0
+        self._flight = SingleFlight[FrameKey, FrameData]()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def service(self) -> FrameXService | LocalFrameService:
+        return self._service or get_framex()
+
+    def __contains__(self, key: FrameKey) -> bool:
+        return key in self._frames or (self.store is not None and key in self.store)
+
+    def get(self, video_name: str, frame: int) -> FrameData | None:
+        """
+        Get a frame if it is cached, without fetching it.
+        """
+        key = (video_name, frame)
+
+        try:
+            data = self._frames[key]
+        except KeyError:
+            return None
+
+        self._frames.move_to_end(key)
+        return data
+
+    def put(self, video_name: str, frame: int, data: FrameData) -> None:
+        """
+        Store a frame, evicting the least recently used ones to make room.
+        """
+        key = (video_name, frame)
+
+        if len(data) > self.max_bytes:
+            return
+
+        if (old := self._frames.pop(key, None)) is not None:
+            self._size -= len(old)
+
+        self._frames[key] = data
+        self._size += len(data)
+
+        while self._size > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self._size -= len(evicted)
+
+    def is_loading(self, video_name: str, frame: int) -> bool:
+        """
+        Is this frame being downloaded right now?
+        """
+        return (video_name, frame) in self._flight
+
+    async def _download(self, video_name: str, frame: int) -> FrameData:
+        """
+        Get a frame that is neither in memory nor in the store.
+        """
+        return await self.service.get_video_frame(video_name, frame)
+
+    async def _fetch(self, video_name: str, frame: int) -> FrameData:
+        data: FrameData | None = None
+
+        if self.store is not None:
+            data = self.store.get(video_name, frame)
+
+        if data is None:
+            data = await self._download(video_name, frame)
+
+            if self.store is not None:
+                await self.store.put(video_name, frame, data)
+
+        self.put(video_name, frame, data)
+        return data
+
+    async def get_video_frame(self, video_name: str, frame: int) -> FrameData:
+        """
+        Get a single frame from a video as a JPEG image, from the cache if
+        possible.
+        """
+        if (data := self.get(video_name, frame)) is not None:
+            self.hits += 1
+            return data
+
+        self.misses += 1
+
+        while True:
+            try:
+                return await self._flight.do((video_name, frame), lambda: self._fetch(video_name, frame))
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():  # type: ignore[union-attr]
+                    raise
+                # we joined a prefetch that got cancelled, download it for real
+
+    def load(self, video_name: str, frame: int) -> asyncio.Task[FrameData]:
+        """
+        Start downloading a frame in the background (or join the download
+        already running).
+        """
+        return self._flight.start((video_name, frame), lambda: self._fetch(video_name, frame))
+
+
+class RenditionCache(FrameCache):
+    """
+    Frames scaled down to fit in `max_size` pixels and encoded again at
+    `quality`, which is all a chat bubble needs: they weigh a fraction of the
+    originals and reach mobile users sooner. This cache holds the renditions
+    of a single size, so a frame is only ever scaled down once.
+
+    Originals come from the `source` cache. Decoding and encoding happen in
+    a pool of `processes` worker processes, so they never block the event
+    loop. When a rendition comes out bigger than the original (e.g. it was
+    small already), the original is kept instead.
+    """
+
+    def __init__(
+        self,
+        source: FrameCache,
+        max_size: int = 1280,
+        quality: int = 80,
+        processes: int = 2,
+        max_bytes: int = 32 * 1024 * 1024,
+    ):
+        """
+        :param source: cache of the original frames
+        :param max_size: maximum width and height of the renditions, in pixels
+        :param quality: JPEG quality of the renditions, from 1 to 95
+        :param processes: number of worker processes
+        :param max_bytes: maximum total size of the cached renditions
+        """
+        super().__init__(max_bytes=max_bytes, service=source._service)
+        self.source = source
+        self.max_size = max_size
+        self.quality = quality
+        self.processes = processes
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """
+        The worker processes, started on first use. They are started from a
+        fork server rather than forked from the event loop's process.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    async def _download(self, video_name: str, frame: int) -> FrameData:
+        original = await self.source.get_video_frame(video_name, frame)
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        start = perf_counter()
+
+        try:
+            rendition = await loop.run_in_executor(executor, render_jpeg, bytes(original), self.max_size, self.quality)
+        except BrokenProcessPool:
+            # unless another failed call already replaced the pool
+            if self._executor is executor:
+                logger.warning("Rendition processes died, starting new ones")
+                self.close()
+            renditions_total.labels("error").inc()
+            return original
+        except Exception:
+            logger.warning(
+                "Could not scale frame %s of %s down, keeping the original", frame, video_name, exc_info=True
+            )
+            renditions_total.labels("error").inc()
+            return original
+        finally:
+            rendition_seconds.observe(perf_counter() - start)
+
+        if len(rendition) >= len(original):
+            renditions_total.labels("original").inc()
+            return original
+
+        renditions_total.labels("scaled").inc()
+        return rendition
+
+    def close(self) -> None:
+        """
+        Stop the worker processes.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class FramePrefetcher:
+    """
+    Downloads in the background the frames that users are likely to ask for
+    next, so they are already in the frame cache when needed.
+
+    Prefetching is best-effort: there are at most `max_concurrency` downloads
+    at once for the whole worker, and a prefetch that cannot get a slot right
+    away is dropped instead of queued, so it never delays real traffic.
+    Nothing is prefetched while FrameX is unavailable.
+    """
+
+    def __init__(self, cache: FrameCache, max_concurrency: int = 4, enabled: bool = True):
+        """
+        :param cache: frame cache to fill
+        :param max_concurrency: maximum number of simultaneous prefetches
+        :param enabled: set to False to turn prefetching off
+        """
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.enabled = enabled
+        self._tasks: dict[FrameKey, asyncio.Task[FrameData]] = {}
+
+    def prefetch(self, video_name: str, frames: Iterable[int]) -> None:
+        """
+        Prefetch these frames of a video. Frames already cached or being
+        downloaded (for any user) are skipped.
+        """
+        if not self.enabled or self.cache.service.circuit_open:
+            return
+
+        for frame in frames:
+            key = (video_name, frame)
+
+            if key in self.cache or self.cache.is_loading(*key):
+                continue
+
+            if len(self._tasks) >= self.max_concurrency:
+                logger.debug("Prefetch slots are full, dropping %s", key)
+                return
+
+            task = self.cache.load(*key)
+            self._tasks[key] = task
+            task.add_done_callback(partial(self._forget, key))
+
+    def _forget(self, key: FrameKey, task: asyncio.Task) -> None:
+        self._tasks.pop(key, None)
+
+    def cancel(self, video_name: str, frames: Iterable[int]) -> None:
+        """
+        Cancel the prefetches of these frames, if they are still running.
+        """
+        for frame in frames:
+            if (task := self._tasks.get((video_name, frame))) is not None:
+                task.cancel()
+
+    def cancel_all(self) -> None:
+        """
+        Cancel all running prefetches.
+        """
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+
+def next_frames(lo: int, hi: int) -> tuple[int, int]:
+    """
+    Frames that can be shown after the one in the middle of `[lo, hi]`,
+    depending on the answer of the user.
+    """
+    mid = (lo + hi) // 2
+    return (lo + mid) // 2, (mid + 1 + hi) // 2
+
+
+# --- Worker-wide instances ---
+
+_frame_cache: FrameCache | None = None
+_prefetcher: FramePrefetcher | None = None
+
+
+def get_frame_cache() -> FrameCache:
+    """
+    Get the frame cache shared by the whole worker, built from
+    `settings.FRAME_CACHE_PARAMS`. If `settings.FRAME_RENDITION_PARAMS` is
+    set, it holds the frames scaled down for Telegram.
+    """
+    global _frame_cache
+
+    if _frame_cache is None:
+        # local frames are already on disk, no need for another copy
+        store = get_frame_store() if settings.FRAME_BACKEND != "local" else None
+        _frame_cache = FrameCache(store=store, **settings.FRAME_CACHE_PARAMS)
+
+        if settings.FRAME_RENDITION_PARAMS:
+            if importlib.util.find_spec("PIL") is None:
+                logger.warning("Pillow is not installed, frames are sent without being scaled down")
+            else:
+                _frame_cache = RenditionCache(_frame_cache, **settings.FRAME_RENDITION_PARAMS)
+    return _frame_cache
+
+
+def get_prefetcher() -> FramePrefetcher:
+    """
+    Get the frame prefetcher shared by the whole worker, built from
+    `settings.PREFETCH_PARAMS`.
+    """
+    global _prefetcher
+
+    if _prefetcher is None:
+        _prefetcher = FramePrefetcher(get_frame_cache(), **settings.PREFETCH_PARAMS)
+    return _prefetcher
+
+
+def set_frame_cache(cache: FrameCache | None) -> None:
+    """
+    Replace the shared frame cache (and reset the prefetcher that fills it).
+    """
+    global _frame_cache, _prefetcher
+
+    if _prefetcher is not None:
+        _prefetcher.cancel_all()
+
+    _frame_cache = cache
+    _prefetcher = None
+
+
+def close_frames() -> None:
+    """
+    Stop all background downloads and renditions, and release the frame
+    store.
+    """
+    if _prefetcher is not None:
+        _prefetcher.cancel_all()
+
+    cache = _frame_cache
+
+    if isinstance(cache, RenditionCache):
+        cache.close()
+        cache = cache.source
+
+    if cache is not None and cache.store is not None:
+        cache.store.close()
@@ -0,0 +1,438 @@
+import asyncio
+import logging
+from collections import defaultdict
+from functools import wraps
+from time import monotonic, perf_counter
+from types import TracebackType
+from typing import TYPE_CHECKING, Awaitable, Callable, NamedTuple, Self, TypeVar
+
+from aiohttp import (
+    ClientResponse,
+    ClientResponseError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    hdrs,
+)
+from bernard.conf import settings
+from yarl import URL
+
+from rocket_man import metrics
+from rocket_man.schemas import Video, VideoEntry
+from rocket_man.utils import CircuitBreaker, LatencyWindow
+
+if TYPE_CHECKING:
+    from rocket_man.services.local_frames import LocalFrameService
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+request_seconds = metrics.Histogram(
+    "rocket_man_framex_request_seconds",
+    "Duration of the calls to FrameX, body download included",
+    ["call"],
+)
+errors_total = metrics.Counter(
+    "rocket_man_framex_errors_total",
+    "Calls to FrameX that failed",
+    ["call"],
+)
+rejected_total = metrics.Counter(
+    "rocket_man_framex_rejected_total",
+    "Calls to FrameX refused right away because the circuit was open",
+    ["call"],
+)
+circuit_opened_total = metrics.Counter(
+    "rocket_man_framex_circuit_opened_total",
+    "Times FrameX failed enough for the circuit to open",
+)
+hedges_total = metrics.Counter(
+    "rocket_man_framex_hedges_total",
+    "Calls to FrameX slow enough to be sent a second time",
+    ["call"],
+)
+hedge_wins_total = metrics.Counter(
+    "rocket_man_framex_hedge_wins_total",
+    "Hedged calls to FrameX where the second request answered first",
+    ["call"],
+)
+
+
+def _timed(call: str):
+    """
+    Record the duration and the failures of a FrameX call.
+    """
+    timer = request_seconds.labels(call)
+    errors = errors_total.labels(call)
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                timer.observe(perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+class VideoList(NamedTuple):
+    """
+    Result of a conditional listing of the videos. `videos` is `None` when
+    FrameX answered that the list did not change.
+    """
+
+    videos: list[VideoEntry] | None
+    etag: str | None
+    last_modified: str | None
+
+
+class FrameXUnavailable(Exception):
+    """
+    FrameX is failing, calls are refused until it recovers (see
+    `FrameXService`).
+    """
+
+
+class FrameXService:
+    """
+    FrameX API service.
+    It allows downloading videos, frame by frame.
+
+    The underlying HTTP session is created lazily (so it belongs to the
+    running event loop) and is meant to be shared by the whole worker, see
+    `get_framex()`.
+
+    Calls are kept from hanging on a degraded FrameX:
+
+    - Each call has a deadline, retries and downloads included.
+    - After a series of failures a circuit breaker opens, and calls fail
+      right away with `FrameXUnavailable` until a trial call succeeds.
+    - All calls are idempotent GETs, so when one is slower than most recent
+      ones (`hedge_quantile`), the same request is sent a second time and the
+      first answer wins. Hedges are limited to a fraction (`hedge_ratio`) of
+      the calls, so they can't double the load when FrameX is slow overall.
+    """
+
+    base_url = URL(settings.FRAMEX_URL) / "api" / "video"
+
+    # deadline of each call, in seconds
+    DEADLINES = {
+        "list_videos": 10.0,
+        "get_video": 3.0,
+        "get_frame": 5.0,
+    }
+
+    def __init__(
+        self,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 30.0,
+        dns_cache_ttl: int = 300,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 10.0,
+        deadlines: dict[str, float] | None = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        hedge_quantile: float | None = 0.95,
+        hedge_ratio: float = 0.1,
+        session: ClientSession | None = None,
+    ):
+        """
+        Create a FrameX client.
+
+        :param limit_per_host: maximum number of simultaneous connections to FrameX
+        :param keepalive_timeout: how long an idle connection is kept alive, in seconds
+        :param dns_cache_ttl: how long a DNS resolution is cached, in seconds
+        :param connect_timeout: timeout for establishing a connection, in seconds
+        :param read_timeout: timeout between two reads of the response, in seconds
+        :param deadlines: deadline of each call ("list_videos", "get_video",
+            "get_frame"), in seconds, overriding `DEADLINES`
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: how long the circuit stays open, in seconds
+        :param hedge_quantile: a call slower than this quantile of the recent
+            ones is sent again. `None` disables hedging.
+        :param hedge_ratio: maximum fraction of the calls that can be hedged
+        :param session: use this session instead of creating one (e.g. for tests)
+        """
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadlines = {**self.DEADLINES, **(deadlines or {})}
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.hedge_quantile = hedge_quantile
+        self.hedge_ratio = hedge_ratio
+        self._hedge_budget = 0.0
+        self._latencies: defaultdict[str, LatencyWindow] = defaultdict(LatencyWindow)
+        self._session = session
+
+    def _make_session(self) -> ClientSession:
+        """
+        Create a session with a connector tuned for talking to a single host.
+        """
+        connector = TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        timeout = ClientTimeout(
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        return ClientSession(connector=connector, timeout=timeout)
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        The HTTP session, created on first use.
+        """
+        if self._session is None or self._session.closed:
+            self._session = self._make_session()
+        return self._session
+
+    @property
+    def circuit_open(self) -> bool:
+        """
+        Whether calls are being refused because FrameX is failing.
+        """
+        return self.breaker.state == CircuitBreaker.OPEN
+
+    async def close(self) -> None:
+        """
+        Close the HTTP session and all its pooled connections.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self, tp: type[BaseException] | None, val: BaseException | None, tb: TracebackType | None
+    ) -> None:
+        await self.close()
+
+    @classmethod
+    def get_video_url(cls, video_name: str) -> URL:
+        """
+        Get the URL of a video.
+        """
+        return cls.base_url / video_name
+
+    @classmethod
+    def get_video_frame_url(cls, video_name: str, frame: int) -> URL:
+        """
+        Get the URL of a single frame from a video.
+        """
+        return cls.base_url / video_name / "frame" / str(frame)
+
+    async def _request(
+        self,
+        call: str,
+        url: URL,
+        handle: Callable[[ClientResponse], Awaitable[T]],
+        headers: dict[str, str] | None = None,
+    ) -> T:
+        """
+        GET an URL and handle the response, within the deadline of the call,
+        through the circuit breaker and hedged if it's slow.
+        """
+        if not self.breaker.allow():
+            rejected_total.labels(call).inc()
+            raise FrameXUnavailable(f"FrameX is unavailable, not calling {call}")
+
+        async def attempt() -> T:
+            start = monotonic()
+
+            async with self.session.get(url, headers=headers) as resp:
+                result = await handle(resp)
+
+            self._latencies[call].add(monotonic() - start)
+            return result
+
+        try:
+            async with asyncio.timeout(self.deadlines[call]):
+                result = await self._hedged(call, attempt)
+        except ClientResponseError as err:
+            # FrameX did answer, only server errors count against it
+            if err.status >= 500 or err.status == 429:
+                self._failure()
+            else:
+                self.breaker.success()
+            raise
+        except Exception:
+            self._failure()
+            raise
+
+        self.breaker.success()
+        return result
+
+    def _failure(self) -> None:
+        if self.breaker.failure():
+            circuit_opened_total.inc()
+            logger.warning("FrameX keeps failing, refusing calls for %ss", self.breaker.reset_timeout)
+
+    def _hedge_delay(self, call: str) -> float | None:
+        """
+        How long to wait before hedging a call, `None` to not hedge it.
+        """
+        self._hedge_budget = min(self._hedge_budget + self.hedge_ratio, 10.0)
+
+        if self.hedge_quantile is None or self._hedge_budget < 1.0:
+            return None
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            # a single trial call
+            return None
+
+        return self._latencies[call].quantile(self.hedge_quantile)
+
+    async def _hedged(self, call: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """
+        Make an attempt, and a second one if the first is too slow. The first
+        to succeed wins, the other is cancelled.
+        """
+        delay = self._hedge_delay(call)
+        pending = {asyncio.ensure_future(attempt())}
+        first = next(iter(pending))
+
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    self._hedge_budget -= 1.0
+                    hedges_total.labels(call).inc()
+                    pending.add(asyncio.ensure_future(attempt()))
+                    delay = None
+                    continue
+
+                succeeded = [task for task in done if task.exception() is None]
+
+                if succeeded:
+                    if succeeded[0] is not first:
+                        hedge_wins_total.labels(call).inc()
+                    return succeeded[0].result()
+
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @_timed("list_videos")
+    async def list_videos(self) -> list[Video]:
+        """ "
+        List all videos.
+        """
+
+        async def handle(resp: ClientResponse) -> list[Video]:
+            resp.raise_for_status()
+            return Video.validate_json_list(await resp.read())
+
+        return await self._request("list_videos", self.base_url, handle)
+
+    @_timed("list_videos")
+    async def list_videos_if_modified(
+        self,
+        etag: str | None = None,
+        last_modified: str | None = None,
+        schema: type[VideoEntry] = Video,
+    ) -> VideoList:
+        """
+        List all videos, unless they did not change since the response that
+        carried the given validators.
+
+        :param schema: what to parse each video into, `VideoEntry` skips the
+            metadata that is not needed
+        """
+        headers: dict[str, str] = {}
+        if etag:
+            headers[hdrs.IF_NONE_MATCH] = etag
+        if last_modified:
+            headers[hdrs.IF_MODIFIED_SINCE] = last_modified
+
+        async def handle(resp: ClientResponse) -> VideoList:
+            new_etag = resp.headers.get(hdrs.ETAG, etag)
+            new_last_modified = resp.headers.get(hdrs.LAST_MODIFIED, last_modified)
+            if resp.status == 304:
+                return VideoList(None, new_etag, new_last_modified)
+
+            resp.raise_for_status()
+            return VideoList(schema.validate_json_list(await resp.read()), new_etag, new_last_modified)
+
+        return await self._request("list_videos", self.base_url, handle, headers)
+
+    @_timed("get_video")
+    async def get_video(self, video_name) -> Video:
+        """
+        Get video metadata.
+        """
+
+        async def handle(resp: ClientResponse) -> Video:
+            resp.raise_for_status()
+            return Video.validate_json(await resp.read())
+
+        return await self._request("get_video", self.get_video_url(video_name), handle)
+
+    @_timed("get_frame")
+    async def get_video_frame(self, video_name: str, frame: int) -> bytes:
+        """
+        Get a single frame from a video as a JPEG image.
+        """
+
+        async def handle(resp: ClientResponse) -> bytes:
+            resp.raise_for_status()
+            return await resp.read()
+
+        return await self._request("get_frame", self.get_video_frame_url(video_name, frame), handle)
+
+
+# --- Worker-wide instance ---
+
+_framex: "FrameXService | LocalFrameService | None" = None
+
+
+def get_framex() -> "FrameXService | LocalFrameService":
+    """
+    Get the frame service shared by the whole worker: FrameX, built from
+    `settings.FRAMEX_PARAMS`, or the local frame library if
+    `settings.FRAME_BACKEND` is "local".
+    """
+    global _framex
+
+    if _framex is None:
+        if settings.FRAME_BACKEND == "local":
+            from rocket_man.services.local_frames import LocalFrameService
+
+            _framex = LocalFrameService(**settings.LOCAL_FRAMES_PARAMS)
+        else:
+            _framex = FrameXService(**settings.FRAMEX_PARAMS)
+    return _framex
+
+
+def set_framex(service: "FrameXService | LocalFrameService | None") -> None:
+    """
+    Replace the shared FrameX service, typically with a stub in tests.
+    Passing `None` resets it so the next `get_framex()` builds a new one.
+    """
+    global _framex
+    _framex = service
+
+
+async def close_framex() -> None:
+    """
+    Close the connections of the shared FrameX service, if it was built.
+    """
+    if _framex is not None:
+        await _framex.close()
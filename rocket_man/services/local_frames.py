@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+from fractions import Fraction
+from pathlib import Path
+from typing import AsyncIterator
+
+from aiohttp import hdrs, web
+from bernard.conf import settings
+from yarl import URL
+
+from rocket_man.schemas import Video, VideoEntry
+from rocket_man.services.framex import VideoList
+from rocket_man.storage.frame_library import FrameLibrary
+
+logger = logging.getLogger(__name__)
+
+JPEG_START = b"\xff\xd8"
+JPEG_END = b"\xff\xd9"
+
+# frames never change once ingested
+FRAME_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LIST_CACHE_CONTROL = "public, max-age=60"
+
+
+class VideoNotFound(LookupError):
+    """
+    The video is not in the local library.
+    """
+
+
+class LocalFrameService:
+    """
+    Drop-in replacement for `FrameXService` that serves videos ingested into
+    a local `FrameLibrary` (see `ingest_video()`), so the game doesn't depend
+    on FrameX at all.
+
+    Users get the frames from the bot itself: `add_routes()` serves the
+    library with FrameX-like URLs under `/frames/video`, with cache headers
+    so that Telegram and browsers don't ask twice.
+    """
+
+    # nothing can fail remotely
+    circuit_open = False
+
+    def __init__(self, root: Path | str, base_url: str | None = None):
+        """
+        :param root: directory of the library
+        :param base_url: public URL of the bot, defaults to `BERNARD_BASE_URL`
+        """
+        self.library = FrameLibrary(root, read_only=True)
+        self.base_url = URL(base_url or settings.BERNARD_BASE_URL or "http://localhost") / "frames" / "video"
+
+    async def close(self) -> None:
+        self.library.close()
+
+    def get_video_url(self, video_name: str) -> URL:
+        """
+        Get the URL of a video.
+        """
+        return self.base_url / video_name
+
+    def get_video_frame_url(self, video_name: str, frame: int) -> URL:
+        """
+        Get the URL of a single frame from a video.
+        """
+        return self.base_url / video_name / "frame" / str(frame)
+
+    async def list_videos(self) -> list[Video]:
+        """
+        List all videos.
+        """
+        self.library.reload()
+        return list(self.library.videos.values())
+
+    async def list_videos_if_modified(
+        self,
+        etag: str | None = None,
+        last_modified: str | None = None,
+        schema: type[VideoEntry] = Video,
+    ) -> VideoList:
+        """
+        List all videos, unless the library did not change since `etag`. The
+        videos are already in memory, they are listed whatever the `schema`.
+        """
+        self.library.reload()
+        version = f'"{self.library.version}"'
+
+        if etag == version:
+            return VideoList(None, etag, None)
+        return VideoList(list(self.library.videos.values()), version, None)
+
+    async def get_video(self, video_name: str) -> Video:
+        """
+        Get video metadata.
+        """
+        try:
+            return self.library.videos[video_name]
+        except KeyError:
+            raise VideoNotFound(video_name) from None
+
+    async def get_video_frame(self, video_name: str, frame: int) -> memoryview:
+        """
+        Get a single frame from a video as a JPEG image, straight from the
+        memory map of the library.
+        """
+        if (data := self.library.get_frame(video_name, frame)) is None:
+            raise VideoNotFound(f"{video_name}/{frame}")
+        return data
+
+    # --- HTTP routes ---
+
+    @staticmethod
+    def routes_added(router: web.UrlDispatcher) -> bool:
+        return any(resource.canonical == "/frames/video" for resource in router.resources())
+
+    def add_routes(self, router: web.UrlDispatcher) -> None:
+        router.add_get("/frames/video", self._list_view)
+        router.add_get("/frames/video/{name}", self._video_view)
+        router.add_get(r"/frames/video/{name}/frame/{frame:\d+}", self._frame_view)
+        router.add_get(r"/frames/video/{name}/frame/{frame:\d+}/", self._frame_view)
+
+    async def _list_view(self, request: web.Request) -> web.Response:
+        listing = await self.list_videos_if_modified(request.headers.get(hdrs.IF_NONE_MATCH))
+        headers: dict[str, str] = {hdrs.ETAG: listing.etag or "", hdrs.CACHE_CONTROL: LIST_CACHE_CONTROL}
+
+        if listing.videos is None:
+            return web.Response(status=304, headers=headers)
+
+        body = json.dumps([video.model_dump(mode="json") for video in listing.videos])
+        return web.Response(text=body, content_type="application/json", headers=headers)
+
+    async def _video_view(self, request: web.Request) -> web.Response:
+        try:
+            video = await self.get_video(request.match_info["name"])
+        except VideoNotFound:
+            raise web.HTTPNotFound()
+
+        return web.Response(
+            text=video.model_dump_json(),
+            content_type="application/json",
+            headers={hdrs.CACHE_CONTROL: LIST_CACHE_CONTROL},
+        )
+
+    async def _frame_view(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        frame = int(request.match_info["frame"])
+
+        try:
+            data = await self.get_video_frame(name, frame)
+        except VideoNotFound:
+            raise web.HTTPNotFound()
+
+        # a frame of a video is only ever stored once
+        etag = f'"{self.library.version}-{frame}"'
+
+        if request.headers.get(hdrs.IF_NONE_MATCH) == etag:
+            return web.Response(status=304, headers={hdrs.ETAG: etag})
+
+        return web.Response(
+            body=data,
+            content_type="image/jpeg",
+            headers={hdrs.ETAG: etag, hdrs.CACHE_CONTROL: FRAME_CACHE_CONTROL},
+        )
+
+
+# --- Ingestion ---
+
+
+async def _probe(path: Path) -> dict:
+    """
+    Size and frame rate of the first video stream of a file, with ffprobe.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=width,height,r_frame_rate",
+        "-of",
+        "json",
+        str(path),
+        stdout=asyncio.subprocess.PIPE,
+    )
+    out, _ = await process.communicate()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed on {path}")
+
+    streams = json.loads(out)["streams"]
+    if not streams:
+        raise ValueError(f"{path} has no video stream")
+    return streams[0]
+
+
+async def split_jpegs(stream: asyncio.StreamReader, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """
+    Split a stream of concatenated JPEG images (as written by ffmpeg's
+    `image2pipe`) into images.
+
+    The end marker can also appear inside the header segments (quantization
+    tables, EXIF thumbnails...), so they are skipped by their length. Only
+    in the compressed data, where 0xFF bytes are escaped, is the next marker
+    looked for.
+    """
+    buffer = bytearray()
+    # where the parsing of the current image stopped, and whether it's in
+    # compressed data
+    pos = 0
+    in_scan = False
+
+    while chunk := await stream.read(chunk_size):
+        buffer += chunk
+
+        while pos + 1 < len(buffer):
+            if in_scan:
+                pos = buffer.find(b"\xff", pos)
+
+                if pos < 0 or pos + 1 >= len(buffer):
+                    pos = len(buffer) - 1 if pos < 0 else pos
+                    break
+
+                # escaped 0xFF, restart marker or fill byte
+                if buffer[pos + 1] == 0 or 0xD0 <= buffer[pos + 1] <= 0xD7:
+                    pos += 2
+                elif buffer[pos + 1] == 0xFF:
+                    pos += 1
+                else:
+                    in_scan = False
+                continue
+
+            if buffer[pos] != 0xFF:
+                raise ValueError("The image stream is not made of JPEG images")
+
+            marker = buffer[pos + 1]
+
+            if marker == JPEG_END[1]:
+                yield bytes(buffer[: pos + 2])
+                del buffer[: pos + 2]
+                pos = 0
+            elif marker == 0xFF:
+                # fill byte
+                pos += 1
+            elif marker in (0x01, JPEG_START[1]) or 0xD0 <= marker <= 0xD7:
+                # markers without a segment
+                pos += 2
+            elif pos + 4 <= len(buffer):
+                # a segment, followed by compressed data for a start of scan
+                pos += 2 + int.from_bytes(buffer[pos + 2 : pos + 4], "big")
+                in_scan = marker == 0xDA
+            else:
+                break
+
+    if buffer.strip():
+        raise ValueError("The image stream ended in the middle of an image")
+
+
+async def ingest_video(
+    library: FrameLibrary,
+    path: Path | str,
+    name: str | None = None,
+    quality: int = 3,
+    batch_size: int = 256,
+) -> Video:
+    """
+    Decode a video with ffmpeg and store all its frames as JPEG images in the
+    library, replacing the video of the same name if any. The video is only
+    listed once all its frames are stored.
+
+    :param library: where to store the video
+    :param path: video file, in any format ffmpeg can read
+    :param name: name of the video, defaults to the file name without
+        extension
+    :param quality: JPEG quality, from 2 (best) to 31 (smallest)
+    :param batch_size: number of frames written to disk at once
+    """
+    path = Path(path)
+    name = name or path.stem
+    probe = await _probe(path)
+
+    library.remove(name)
+
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        str(path),
+        "-map",
+        "0:v:0",
+        "-vsync",
+        "passthrough",
+        "-f",
+        "image2pipe",
+        "-c:v",
+        "mjpeg",
+        "-q:v",
+        str(quality),
+        "-",
+        stdout=asyncio.subprocess.PIPE,
+    )
+    assert process.stdout is not None
+
+    count = 0
+    batch: list[tuple[int, bytes]] = []
+
+    try:
+        async for jpeg in split_jpegs(process.stdout):
+            if not jpeg.startswith(JPEG_START):
+                raise ValueError(f"ffmpeg produced something else than a JPEG for frame {count}")
+
+            batch.append((count, jpeg))
+            count += 1
+
+            if len(batch) >= batch_size:
+                await library.frames.put_many(name, batch)
+                batch = []
+
+        if batch:
+            await library.frames.put_many(name, batch)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        raise
+
+    await process.wait()
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed on {path} (code {process.returncode})")
+    if not count:
+        raise ValueError(f"No frame could be decoded from {path}")
+
+    rate = Fraction(probe["r_frame_rate"])
+    video = Video(
+        name=name,
+        width=probe["width"],
+        height=probe["height"],
+        frames=count,
+        frame_rate=(rate.numerator, rate.denominator),
+        url=path.name,
+        first_frame=f"/frames/video/{name}/frame/0/",
+        last_frame=f"/frames/video/{name}/frame/{count - 1}/",
+    )
+    library.publish(video)
+    logger.info("Ingested %s frames of %s as %r", count, path, name)
+    return video
@@ -1,7 +1,8 @@
+import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
-from pydantic import HttpUrl, RedisDsn, field_validator
+from pydantic import Field, HttpUrl, RedisDsn, field_validator
 from pydantic_core.core_schema import FieldValidationInfo
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -34,8 +35,22 @@ class Settings(BaseSettings):
     socket_path: Path | None = None
     bind_host: str = "127.0.0.1"
     bind_port: int = 8080
+    reuse_port: bool = False
+    workers: int = 1
+    metrics_port: int = 9100
+
+    frame_store_path: Path | None = None
+    frame_store_max_bytes: int = 1024 * 1024 * 1024
+    frame_rendition_size: int = 0
+    frame_rendition_quality: int = 80
 
     redis_url: RedisDsn = "redis://localhost:6379/0"  # type: ignore[assignment]
+    redis_cluster: bool = False
+    store_backend: Literal["redis", "memory"] = "redis"
+    framex_url: str = "https://framex-dev.wadrid.net"
+    frame_backend: Literal["framex", "local"] = "framex"
+    local_frames_path: Path | None = Field(None, validate_default=True)
+    context_local_cache_size: int = 0
 
     fb_page_token: str = ""
     fb_app_id: str = ""
@@ -43,6 +58,14 @@ class Settings(BaseSettings):
     fb_page_id: str = ""
 
     telegram_token: str = ""
+    telegram_api_url: str = "https://api.telegram.org"
+    telegram_frame_delivery: Literal["link", "photo"] = "link"
+    telegram_ingestion: Literal["webhook", "queue", "polling"] = "webhook"
+    update_queue_depth: int = 100
+
+    stateless_game: bool = False
+    traffic_capture_path: Path | None = None
+    search_strategy: Literal["bisection", "prior"] = "bisection"
 
     @field_validator("fb_app_id", "fb_app_secret", "fb_page_id")
     def check_fb_settings(cls, v: str, info: FieldValidationInfo):
@@ -53,6 +76,25 @@ class Settings(BaseSettings):
             raise ValueError("Facebook settings are not set")
         return v
 
+    @field_validator("local_frames_path")
+    def check_local_frames_path(cls, v: Path | None, info: FieldValidationInfo):
+        """
+        Check that the local frame library is set if it's used
+        """
+        if info.data.get("frame_backend") == "local" and v is None:
+            raise ValueError("LOCAL_FRAMES_PATH is required by FRAME_BACKEND=local")
+        return v
+
+    @field_validator("stateless_game")
+    def check_stateless_game(cls, v: bool, info: FieldValidationInfo):
+        """
+        Check that the game tokens are signed with a secret key, otherwise
+        anyone could forge them
+        """
+        if v and not info.data.get("webview_secret_key"):
+            raise ValueError("STATELESS_GAME requires WEBVIEW_SECRET_KEY")
+        return v
+
 
 env = Settings()
 
@@ -159,10 +201,47 @@ if env.telegram_token:
             "class": "rocket_man.platforms.RocketTg",
             "settings": {
                 "token": env.telegram_token,
+                # another Bot API server, e.g. a local one or a stub
+                "api_url": env.telegram_api_url,
+                # "link" sends a link to the frame, "photo" uploads it once and
+                # then edits the game message in place with its file_id
+                "frame_delivery": env.telegram_frame_delivery,
+                # "webhook" handles each update before answering Telegram,
+                # "queue" answers right away and handles it in the background,
+                # "polling" fetches updates with getUpdates, without webhook
+                "ingestion": env.telegram_ingestion,
             },
         }
     )
 
+# Telegram limits how fast a bot can send messages: about 30/s overall, 1/s in
+# a private chat and 20/min in a group. Calls are held back to stay within
+# them (bursts allowed), and retried when Telegram answers 429 anyway. The
+# buckets are shared by the workers in Redis, or kept in the (single) worker
+# with the "memory" store backend.
+TELEGRAM_RATE_LIMIT_PARAMS = {
+    "global_rate": 30.0,
+    "global_burst": 30,
+    "private_rate": 1.0,
+    "private_burst": 3,
+    "group_rate": 20 / 60,
+    "group_burst": 5,
+    "max_retries": 3,
+    "backend": env.store_backend,
+}
+
+# With the "polling" ingestion, each getUpdates call waits up to `timeout`
+# seconds for updates and returns at most `limit` of them (100 at most). Each
+# batch is handled, in parallel across conversations, before the next call
+# confirms it.
+TELEGRAM_POLLING_PARAMS = {
+    "limit": 100,
+    "timeout": 30,
+}
+
+if env.telegram_ingestion == "polling" and env.workers > 1:
+    raise ValueError("Telegram only lets a single worker poll for updates")
+
 # --- Self-awareness ---
 
 # Public base URL, used to generate links to the bot itself.
@@ -190,21 +269,214 @@ else:
         "port": env.bind_port,
     }
 
+    # lets several workers listen on the same port, the kernel balances the
+    # connections between them
+    if env.reuse_port:
+        SERVER_BIND["reuse_port"] = True
+
+# Number of worker processes. Each one is a separate event loop with its own
+# connections and caches, they coordinate through the Redis locks of the
+# context and register. With a SOCKET_PATH, each worker listens on its own
+# socket derived from it (see `worker_socket_path()`).
+WORKERS = env.workers
+
+
+def worker_socket_path(num: int) -> Path:
+    """
+    Socket of the worker number `num` (starting at 1), e.g.
+    `/tmp/bernard-01.sock` for a SOCKET_PATH of `/tmp/bernard.sock`.
+    """
+    if not env.socket_path:
+        raise ValueError("SOCKET_PATH is not set")
+    return env.socket_path.with_name(f"{env.socket_path.stem}-{num:02d}{env.socket_path.suffix}")
+
+
 REDIS_PARAMS = {
     "redis_url": env.redis_url.unicode_string(),
     "ttl": 20 * 60,
+    # lease of the conversation locks: a crashed worker can't hold one longer
+    "lock_ttl": 60,
+    # `redis_url` is a node of a Redis Cluster, conversations are spread over
+    # its nodes by hash slot
+    "cluster": env.redis_cluster,
+}
+
+# Where contexts and registers are stored: "redis" (the default) or
+# "memory", in the process itself. The latter saves all the round trips but is
+# only correct with a single worker, and loses all games on restart.
+STORE_BACKEND = env.store_backend
+
+# Values kept in memory by the "memory" backend. They expire like in Redis,
+# and the least recently used ones are dropped past `max_entries`.
+MEMORY_STORE_PARAMS = {
+    "ttl": REDIS_PARAMS["ttl"],
+    "max_entries": 100_000,
+    "shards": 16,
 }
 
-# By default, store the register in local redis
-REGISTER_STORE = {
-    "class": "rocket_man.storage.RegisterStore",
-    "params": REDIS_PARAMS,
+if STORE_BACKEND == "memory":
+    if WORKERS > 1:
+        raise ValueError("The memory store backend only works with a single worker")
+
+    REGISTER_STORE = {
+        "class": "rocket_man.storage.MemoryRegisterStore",
+        "params": MEMORY_STORE_PARAMS,
+    }
+    CONTEXT_STORE = {
+        "class": "rocket_man.storage.MemoryContextStore",
+        "params": MEMORY_STORE_PARAMS,
+    }
+else:
+    # By default, store the register in local redis
+    REGISTER_STORE = {
+        "class": "rocket_man.storage.RegisterStore",
+        "params": REDIS_PARAMS,
+    }
+
+    # By default, store the context in local redis. Recently used contexts
+    # can also be kept in memory (up to `local_cache_size` of them, 0 to
+    # disable), Redis tells each worker when another one changes them.
+    CONTEXT_STORE = {
+        "class": "rocket_man.storage.ContextStore",
+        "params": {
+            **REDIS_PARAMS,
+            "local_cache_size": env.context_local_cache_size,
+            "local_cache_ttl": 60,
+        },
+    }
+
+# --- FrameX ---
+
+# Root of the FrameX API
+FRAMEX_URL = env.framex_url
+
+# Where frames come from: "framex" (the FrameX API) or "local" (videos
+# ingested into a library on disk with `deployment/ingest_video.py`, and served
+# by the bot itself under /frames).
+FRAME_BACKEND = env.frame_backend
+
+LOCAL_FRAMES_PARAMS = {
+    "root": env.local_frames_path,
+}
+
+# Parameters of the FrameX client shared by each worker. Connections are kept
+# alive and reused across games, so only the first request pays the TLS
+# handshake.
+#
+# Each call has a deadline (in seconds). After `failure_threshold` failures in
+# a row, calls are refused for `reset_timeout` seconds. Calls slower than the
+# `hedge_quantile` of the recent ones are sent a second time, for at most
+# `hedge_ratio` of the calls.
+FRAMEX_PARAMS = {
+    "limit_per_host": 20,
+    "keepalive_timeout": 30.0,
+    "dns_cache_ttl": 300,
+    "connect_timeout": 5.0,
+    "read_timeout": 10.0,
+    "deadlines": {
+        "list_videos": 10.0,
+        "get_video": 3.0,
+        "get_frame": 5.0,
+    },
+    "failure_threshold": 5,
+    "reset_timeout": 30.0,
+    "hedge_quantile": 0.95,
+    "hedge_ratio": 0.1,
+}
+
+# The video catalog hardly ever changes, so it is cached by each worker. After
+# `ttl` seconds it is revalidated in the background while the stale copy keeps
+# being served for up to `stale_ttl` seconds.
+CATALOG_PARAMS = {
+    "ttl": 5 * 60,
+    "stale_ttl": 60 * 60,
+}
+
+# Frames downloaded from FrameX are kept in memory, up to `max_bytes`.
+FRAME_CACHE_PARAMS = {
+    "max_bytes": 64 * 1024 * 1024,
+}
+
+# Frames sent as photos can be scaled down to fit in `max_size` pixels and
+# encoded again at `quality` first (this needs Pillow). That happens in
+# `processes` worker processes per worker, and the renditions are kept in
+# memory up to `max_bytes`.
+FRAME_RENDITION_PARAMS = (
+    {
+        "max_size": env.frame_rendition_size,
+        "quality": env.frame_rendition_quality,
+        "processes": 2,
+        "max_bytes": 32 * 1024 * 1024,
+    }
+    if env.frame_rendition_size and env.telegram_frame_delivery == "photo"
+    else None
+)
+
+# Optionally, frames are also kept on disk (in `FRAME_STORE_PATH`), packed into
+# one segment file per video and read through memory maps. The least recently
+# used videos are evicted when the store grows beyond `max_bytes`.
+#
+# The store is not shared between processes, so under supervisord each worker
+# gets its own directory and share of the size.
+FRAME_STORE_PARAMS = (
+    {
+        "root": env.frame_store_path / os.environ.get("SUPERVISOR_PROCESS_NAME", ""),
+        "max_bytes": env.frame_store_max_bytes // WORKERS,
+    }
+    if env.frame_store_path
+    else None
+)
+
+# Optionally, incoming updates are recorded (anonymized) in `TRAFFIC_CAPTURE_PATH`,
+# to be replayed against another version with `benchmarks/replay.py`. Each
+# worker appends to its own file.
+TRAFFIC_CAPTURE_PARAMS = (
+    {
+        "path": env.traffic_capture_path / f"{os.environ.get('SUPERVISOR_PROCESS_NAME') or 'bot'}.cap",
+        "anonymized": True,
+    }
+    if env.traffic_capture_path
+    else None
+)
+
+# While the user looks at a frame, the two frames that can come next are
+# downloaded in the background, and the one the user did not pick is
+# cancelled. Only photo delivery reads the frames from the frame cache, links
+# send users to FrameX directly. `max_concurrency` caps the number of
+# prefetches running at once in the worker.
+PREFETCH_PARAMS = {
+    "enabled": env.telegram_frame_delivery == "photo",
+    "max_concurrency": 8,
+}
+
+# --- Updates ---
+
+# With the "queue" ingestion, updates wait in `shards` queues (by conversation,
+# to keep them in order) of at most `max_depth` updates each, consumed by one
+# task per queue. Updates arriving at a full queue are refused, and Telegram
+# sends them again later.
+UPDATE_QUEUE_PARAMS = {
+    "shards": 64,
+    "max_depth": env.update_queue_depth,
 }
 
-# By default, store the context in local redis
-CONTEXT_STORE = {
-    "class": "rocket_man.storage.ContextStore",
-    "params": REDIS_PARAMS,
+# --- Game ---
+
+# When enabled, the game state travels in the (signed) payload of the answer
+# buttons instead of the context store, so answering doesn't touch Redis and
+# games never expire. Requires `WEBVIEW_SECRET_KEY`.
+STATELESS_GAME = env.stateless_game
+
+# How the frame to show is picked: "bisection" always shows the middle of the
+# remaining frames, "prior" splits according to where players found the launch
+# in previous games of the video (kept in Redis), which takes fewer steps once
+# a video has `min_games` games. `exploration` is the share of a uniform
+# distribution mixed with that prior, so a misleading one makes games at most
+# about twice as long.
+SEARCH_STRATEGY = env.search_strategy
+SEARCH_PARAMS = {
+    "min_games": 20,
+    "exploration": 0.1,
 }
 
 # --- Natural language understanding/generation ---
@@ -3,6 +3,8 @@ from bernard.analytics import page_view
 from bernard.engine import BaseState
 from bernard.i18n import translate as t
 
+from rocket_man import metrics
+
 
 class RocketManState(BaseState):
     """
@@ -13,6 +15,11 @@ class RocketManState(BaseState):
     CONFUSED texts are defined in `i18n/en/responses.csv`.
     """
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # label what happens next (context lock, sending) with this state
+        metrics.set_state(self.request, type(self).__name__)
+
     @page_view("/bot/error")
     async def error(self) -> None:
         """
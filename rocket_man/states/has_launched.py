@@ -1,22 +1,39 @@
-import random
+import logging
 
 from bernard import layers as lyr
 from bernard.analytics import page_view
+from bernard.conf import settings
 from bernard.i18n import translate as t
 from bernard.platforms.telegram import layers as tgr
 
-from rocket_man.services import FrameXService
+from rocket_man.game import GameState, sign_game, verify_game
+from rocket_man.layers import Frame
+from rocket_man.search import get_search_strategy
+from rocket_man.services import get_catalog, get_framex, get_prefetcher, video_hash
 from rocket_man.states.base import RocketManState
 from rocket_man.states.common import has_launched_or_goodbye
 from rocket_man.storage import HasLaunchedContext
 from rocket_man.storage import context_store as cs
 from rocket_man.utils import escape_md_link
 
+logger = logging.getLogger(__name__)
+
 
 class HasLaunched(RocketManState):
     @page_view("/bot/has_launched")
+    async def handle(self) -> None:
+        payload = self.request.get_layer(lyr.Postback).payload
+
+        if "g" in payload:
+            await self._handle_token(payload["g"])
+        elif settings.STATELESS_GAME and payload.get("cond") is None:
+            # the state will travel in the buttons, nothing to store
+            await self._handle_initial({})
+        else:
+            await self._handle_stored()
+
     @cs.inject()
-    async def handle(self, context: HasLaunchedContext) -> None:
+    async def _handle_stored(self, context: HasLaunchedContext) -> None:
         payload = self.request.get_layer(lyr.Postback).payload
 
         cond = payload.get("cond")
@@ -28,9 +45,7 @@ class HasLaunched(RocketManState):
     async def _handle_initial(self, context):
         step = 1
         # choose a random image
-        async with FrameXService() as fx:
-            videos = await fx.list_videos()
-        vid = random.choice(videos)
+        vid = (await get_catalog().list_videos()).sample()
 
         context["video_name"] = video_name = vid.name
         lo, hi = 0, vid.frames
@@ -49,19 +64,55 @@ class HasLaunched(RocketManState):
         else:
             lo = mid + 1
 
-        await self._handle_step(context, lo, hi, video_name, step)
+        prefetcher = get_prefetcher()
+        if prefetcher.enabled:
+            # the frame that would have followed the other answer isn't needed
+            yes, no = await get_search_strategy().next_splits(video_name, context["lo"], context["hi"], mid)
+            prefetcher.cancel(video_name, [no if cond == "ge" else yes])
+
+        # the user answered on the message of the previous step, update it
+        await self._handle_step(context, lo, hi, video_name, step, edit=True)
+
+    async def _handle_token(self, token):
+        game = verify_game(token, self.request.conversation.id)
+        if game is None:
+            # forged, signed with a previous key or from another conversation:
+            # nothing to resume, start over
+            logger.info("Ignoring an invalid game token in %s", self.request.conversation.id)
+            await self._handle_initial({})
+            return
 
-    async def _handle_step(self, context, lo, hi, video_name, step):
-        mid = (lo + hi) // 2
+        video = await get_catalog().get_video_by_hash(game.video_hash)
+        if video is None:
+            # the video left the catalog, start over with another one
+            await self._handle_initial({})
+            return
+
+        await self._handle_step({}, game.lo, game.hi, video.name, game.step, edit=True)
+
+    async def _record_win(self, search, video_name, frame):
+        try:
+            await search.record_win(video_name, frame)
+        except Exception:
+            # learning is a bonus, the player won anyway
+            logger.warning("Could not record the launch of %s", video_name, exc_info=True)
+
+    async def _handle_step(self, context, lo, hi, video_name, step, edit=False):
+        search = get_search_strategy()
+        mid = await search.split(video_name, lo, hi)
+        update = [tgr.Update()] if edit else []
 
-        frame_url = FrameXService.get_video_frame_url(video_name, mid)
+        frame_url = get_framex().get_video_frame_url(video_name, mid)
         frame_url = escape_md_link(frame_url)
 
         if lo == hi:
             context.clear()
+            await self._record_win(search, video_name, mid)
             self.send(
+                Frame(video_name, mid),
                 lyr.Markdown(t("WIN", url=frame_url, step=step - 1)),
                 has_launched_or_goodbye(),
+                *update,
             )
             return
 
@@ -70,20 +121,28 @@ class HasLaunched(RocketManState):
         context["mid"] = mid
         context["step"] = step + 1
 
+        get_prefetcher().prefetch(video_name, await search.next_splits(video_name, lo, hi, mid))
+
+        if settings.STATELESS_GAME:
+            # each button carries the state that follows its answer
+            conv_id = self.request.conversation.id
+            vid_hash = video_hash(video_name)
+            yes = {"action": "has_launched", "g": sign_game(GameState(step + 1, lo, mid, vid_hash), conv_id)}
+            no = {"action": "has_launched", "g": sign_game(GameState(step + 1, mid + 1, hi, vid_hash), conv_id)}
+        else:
+            yes = {"action": "has_launched", "cond": "ge"}
+            no = {"action": "has_launched", "cond": "lt"}
+
         self.send(
+            Frame(video_name, mid),
             lyr.Markdown(t("HAS_LAUNCHED", url=frame_url, step=step)),
             tgr.InlineKeyboard(
                 [
                     [
-                        tgr.InlineKeyboardCallbackButton(
-                            text=t.YES,
-                            payload={"action": "has_launched", "cond": "ge"},
-                        ),
-                        tgr.InlineKeyboardCallbackButton(
-                            text=t.NO,
-                            payload={"action": "has_launched", "cond": "lt"},
-                        ),
+                        tgr.InlineKeyboardCallbackButton(text=t.YES, payload=yes),
+                        tgr.InlineKeyboardCallbackButton(text=t.NO, payload=no),
                     ]
                 ]
             ),
+            *update,
         )
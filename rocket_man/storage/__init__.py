@@ -1,6 +1,16 @@
 from typing import TypedDict
 
+from bernard.conf import settings
+from bernard.utils import import_class
+
+from rocket_man.storage.buckets import TokenBucketStore
+from rocket_man.storage.codecs import Codec, JsonCodec, StructCodec
 from rocket_man.storage.context import ContextStore
+from rocket_man.storage.file_ids import FileIdStore
+from rocket_man.storage.frame_library import FrameLibrary
+from rocket_man.storage.frames import FrameStore, get_frame_store
+from rocket_man.storage.memory import MemoryContextStore, MemoryRegisterStore
+from rocket_man.storage.priors import LaunchPriorStore
 from rocket_man.storage.redis import Context
 from rocket_man.storage.register import RegisterStore
 
@@ -13,4 +23,17 @@ class HasLaunchedContext(TypedDict):
     video_name: str | None
 
 
-context_store = ContextStore[HasLaunchedContext](name="has_launched")
+# ~16 bytes plus the video name, instead of ~60 bytes of JSON keys
+has_launched_codec = StructCodec[HasLaunchedContext](
+    [("step", "H"), ("lo", "I"), ("hi", "I"), ("mid", "I")],
+    text_field="video_name",
+)
+
+context_store: ContextStore[HasLaunchedContext] | MemoryContextStore[HasLaunchedContext]
+context_store = import_class(settings.CONTEXT_STORE["class"])(
+    name="has_launched",
+    codec=has_launched_codec,
+    **settings.CONTEXT_STORE["params"],
+)
+file_id_store = FileIdStore()
+launch_prior_store = LaunchPriorStore()
@@ -0,0 +1,67 @@
+from rocket_man.storage.redis import RedisStore
+
+# Take a token from a bucket, as GCRA (see `rocket_man.ratelimit.TokenBucket`)
+# on the clock of Redis, so all the workers share the bucket. Returns how long
+# to wait before using the token, in ms. The bucket is forgotten once full
+# again, which is the same as an unknown bucket.
+#
+# KEYS: bucket
+# ARGV: interval between tokens (ms), tolerance (ms)
+RESERVE_SCRIPT = """
+local time = redis.call("TIME")
+local now = time[1] * 1000 + time[2] / 1000
+local tat = tonumber(redis.call("GET", KEYS[1]) or "0")
+local at = math.max(now, tat - tonumber(ARGV[2]))
+tat = math.max(tat, at) + tonumber(ARGV[1])
+redis.call("SET", KEYS[1], string.format("%.3f", tat), "PX", math.max(math.ceil(tat - now), 1))
+return string.format("%.3f", at - now)
+"""
+
+# Give no token for `block` ms, then resume at the steady rate.
+#
+# KEYS: bucket
+# ARGV: tolerance (ms), block (ms)
+BLOCK_SCRIPT = """
+local time = redis.call("TIME")
+local now = time[1] * 1000 + time[2] / 1000
+local tat = math.max(tonumber(redis.call("GET", KEYS[1]) or "0"), now + tonumber(ARGV[2]) + tonumber(ARGV[1]))
+redis.call("SET", KEYS[1], string.format("%.3f", tat), "PX", math.max(math.ceil(tat - now), 1))
+return 1
+"""
+
+
+class TokenBucketStore(RedisStore):
+    """
+    Token buckets kept in Redis, so a rate limit holds for all the workers
+    together rather than for each of them.
+    """
+
+    def __init__(self, content_prefix: str = "bucket::", **kwargs):
+        super().__init__(content_prefix=content_prefix, **kwargs)
+
+    async def ensure_async_init(self) -> None:
+        """
+        Connect and register the scripts on first use
+        """
+        if not self._init_done:
+            await super().ensure_async_init()
+            self._reserve = self.redis.register_script(RESERVE_SCRIPT)
+            self._block = self.redis.register_script(BLOCK_SCRIPT)
+
+    async def reserve(self, key: str, rate: float, burst: int) -> float:
+        """
+        Take a token from a bucket of `rate` tokens per second holding up to
+        `burst` tokens, returning how long to wait before using it, in
+        seconds.
+        """
+        await self.ensure_async_init()
+        interval = 1000 / rate
+        delay = await self._reserve(keys=[self.content_key(key)], args=[interval, (burst - 1) * interval])
+        return float(delay) / 1000
+
+    async def block(self, key: str, rate: float, burst: int, duration: float) -> None:
+        """
+        Give no token from a bucket for `duration` seconds.
+        """
+        await self.ensure_async_init()
+        await self._block(keys=[self.content_key(key)], args=[(burst - 1) * 1000 / rate, duration * 1000])
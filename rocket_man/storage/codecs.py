@@ -0,0 +1,121 @@
+import struct
+from typing import Generic, Mapping, Sequence, TypeVar
+
+import ujson
+
+Context = TypeVar("Context", bound=Mapping)
+
+
+class Codec(Generic[Context]):
+    """
+    Turns a context into the bytes stored in Redis, and back.
+    """
+
+    def encode(self, data: Context) -> bytes | str:
+        raise NotImplementedError
+
+    def decode(self, value: bytes) -> Context:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec[Context]):
+    """
+    Stores the context as JSON. It works with any context but is quite
+    verbose.
+    """
+
+    def encode(self, data: Context) -> bytes | str:
+        return ujson.dumps(data)
+
+    def decode(self, value: bytes) -> Context:
+        return ujson.loads(value)
+
+
+class StructCodec(Codec[Context]):
+    """
+    Compact binary encoding for contexts with a fixed schema: a few integer
+    fields and at most one text field.
+
+    The layout is a version byte, a bitmask of the fields that are present, a
+    bitmask of the fields that are `None`, the integer fields packed with
+    `struct` and finally the text field in UTF-8. An empty context is an
+    empty value.
+
+    Contexts that don't fit the schema (unknown keys, out of range values)
+    are stored as JSON instead, and JSON values are still decoded, so the
+    codec can be switched on with contexts of the previous one still alive.
+    """
+
+    VERSION = 1
+
+    def __init__(self, fields: Sequence[tuple[str, str]], text_field: str | None = None):
+        """
+        :param fields: name and `struct` format character of each integer field
+        :param text_field: name of the text field, if any
+        """
+        names = [name for name, _ in fields]
+        if text_field is not None:
+            names.append(text_field)
+
+        if len(names) > 8:
+            raise ValueError("StructCodec supports at most 8 fields")
+
+        self.fields = list(fields)
+        self.text_field = text_field
+        self.names = frozenset(names)
+        self.int_names = [name for name, _ in fields]
+        self.bits = [(1 << i, name) for i, name in enumerate(names)]
+        self.header = struct.Struct("<BBB")
+        self.body = struct.Struct("<" + "".join(fmt for _, fmt in fields))
+        self.json = JsonCodec[Context]()
+
+    def encode(self, data: Context) -> bytes:
+        if not data:
+            return b""
+
+        if not self.names.issuperset(data):
+            return self._encode_json(data)
+
+        present = nulls = 0
+        for bit, name in self.bits:
+            if name in data:
+                present |= bit
+                if data[name] is None:
+                    nulls |= bit
+
+        try:
+            body = self.body.pack(*[data.get(name) or 0 for name in self.int_names])
+        except struct.error:
+            return self._encode_json(data)
+
+        head = self.header.pack(self.VERSION, present, nulls)
+
+        if self.text_field is not None and (text := data.get(self.text_field)) is not None:
+            return head + body + text.encode()
+        return head + body
+
+    def _encode_json(self, data: Context) -> bytes:
+        # as bytes, like the packed contexts, so `decode()` reads both alike
+        return ujson.dumps(data).encode()
+
+    def decode(self, value: bytes) -> Context:
+        if not value:
+            return {}  # type: ignore[return-value]
+
+        if value[:1] == b"{":
+            return self.json.decode(value)
+
+        version, present, nulls = self.header.unpack_from(value)
+        if version != self.VERSION:
+            raise ValueError(f"Unknown context encoding version {version}")
+
+        values = list(self.body.unpack_from(value, self.header.size))
+
+        if self.text_field is not None:
+            values.append(value[self.header.size + self.body.size :].decode())
+
+        out = {}
+        for (bit, name), item in zip(self.bits, values):
+            if present & bit:
+                out[name] = None if nulls & bit else item
+        return out  # type: ignore[return-value]
@@ -1,15 +1,30 @@
+import asyncio
+from copy import deepcopy
 from functools import wraps
+from time import perf_counter
 from typing import AsyncGenerator, Generic
 
 from bernard.core.health_check import HealthCheckFail
+from bernard.engine.request import Request
 from bernard.engine.state import BaseState
 from bernard.engine.triggers import BaseTrigger
-from bernard.storage.context.base import ContextContextManager
 
+from rocket_man import metrics
 from rocket_man.storage.redis import Context, RedisMixin
 
+context_lock_wait_seconds = metrics.Histogram(
+    "rocket_man_context_lock_wait_seconds",
+    "Time a state handler waited for the lock of its context",
+    ["store", "state"],
+)
+context_lock_hold_seconds = metrics.Histogram(
+    "rocket_man_context_lock_hold_seconds",
+    "Time a state handler held the lock of its context, saving included",
+    ["store", "state"],
+)
 
-class BaseContextStore:
+
+class BaseContextStore(Generic[Context]):
     """
     Defines the interface of a context store.
 
@@ -42,25 +57,60 @@ class BaseContextStore:
             await self.async_init()
             self._init_done = True
 
+    async def _start(self, key: str) -> None:
+        """
+        Implement this to lock the given key. By default there is no locking.
+        """
+
+    async def _finish(self, key: str) -> None:
+        """
+        Implement this to unlock the given key. It is called even if getting
+        or setting the context failed.
+        """
+
     async def _get(self, key: str) -> Context:
         """
         Implement this as a method to get the context for the given key.
         """
         raise NotImplementedError
 
+    async def _peek(self, key: str) -> Context:
+        """
+        Implement this to read the context without locking it. By default it
+        is the same as `_get()`.
+        """
+        return await self._get(key)
+
     async def _set(self, key: str, data: Context) -> None:
         """
         Implement this as a method to set the context at the given key.
         """
         raise NotImplementedError
 
-    def open(self, key: str) -> ContextContextManager:
+    def open(self, key: str, request: Request | None = None) -> "ContextContextManager[Context]":
         """
         Opens a context using the a Python context manager.
 
-        The `key` is the arbitrary key identifying the context.
+        The `key` is the arbitrary key identifying the context. If a `request`
+        is given, the context it leaves is also cached into it (see `peek()`).
         """
-        return ContextContextManager(key, self)
+        return ContextContextManager(key, self, request)
+
+    async def peek(self, request: Request, key: str) -> Context:
+        """
+        Read the context without locking it, once per request: triggers
+        ranking the same request concurrently share the same copy, cached in
+        the request's custom content. It must be treated as read-only.
+        """
+        cc = request.custom_content
+        lock = cc.setdefault(f"{key}::lock", asyncio.Lock())
+
+        async with lock:
+            if key not in cc:
+                await self.ensure_async_init()
+                cc[key] = await self._peek(key)
+
+        return cc[key]
 
     def inject(
         self,
@@ -81,6 +131,11 @@ class BaseContextStore:
         default, the arg is expected to be named `context` but you can change
         it to anything you'd like using `var_name`.
 
+        Triggers only get a read-only copy of the context, loaded once for the
+        whole request without taking the lock (see `peek()`). The lock is only
+        held around state handlers, and the context is only written back if
+        the handler modified it.
+
         See `create_context_store()` for a full example.
         """
 
@@ -102,7 +157,17 @@ class BaseContextStore:
                 conv_id = state.request.conversation.id
                 key = f"context::{self.name}::{conv_id}"
 
-                x = self.open(key)
+                if isinstance(state, BaseTrigger):
+                    context = await self.peek(state.request, key)
+
+                    for item in require or []:
+                        if item not in context:
+                            return await getattr(state, fail)(state, **kwargs)
+
+                    kwargs[var_name] = context
+                    return await func(state, **kwargs)
+
+                x = self.open(key, state.request)
                 async with x as context:
                     for item in require or []:
                         if item not in context:
@@ -116,8 +181,69 @@ class BaseContextStore:
         return decorator
 
 
-class ContextStore(RedisMixin, BaseContextStore, Generic[Context]):
+# noinspection PyProtectedMember
+class ContextContextManager(Generic[Context]):
+    """
+    A (Python) context manager to handle the locking, opening and
+    saving/closing of the (Bernard) context.
+    """
+
+    def __init__(self, key: str, store: BaseContextStore[Context], request: Request | None = None):
+        self.key = key
+        self.data: Context | None = None
+        self.original: Context | None = None
+        self.store = store
+        self.request = request
+        self.acquired = 0.0
+
+    @property
+    def metrics_labels(self) -> tuple[str, str]:
+        return self.store.name, metrics.get_state(self.request) if self.request is not None else "none"
+
+    async def __aenter__(self) -> Context:
+        """
+        When we enter the (Python) context, we lock the (Bernard) context and
+        load it into a plain dictionary.
+        """
+        await self.store.ensure_async_init()
+        started = perf_counter()
+        await self.store._start(self.key)
+        self.acquired = perf_counter()
+        context_lock_wait_seconds.labels(*self.metrics_labels).observe(self.acquired - started)
+
+        try:
+            self.data = await self.store._get(self.key)
+        except BaseException:
+            await self.store._finish(self.key)
+            raise
+
+        self.original = deepcopy(self.data)
+        return self.data
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        """
+        When leaving the (Python) context, the (Bernard) context is sent back
+        to the storage for saving if it was modified, and the lock is lifted
+        whatever happens.
+        """
+        try:
+            if self.data is not None and self.data != self.original:
+                await self.store._set(self.key, self.data)
+        finally:
+            await self.store._finish(self.key)
+            context_lock_hold_seconds.labels(*self.metrics_labels).observe(perf_counter() - self.acquired)
+
+        if self.request is not None:
+            self.request.custom_content[self.key] = self.data
+
+
+class ContextStore(RedisMixin[Context], BaseContextStore[Context]):
     """
-    Store the context as a serialized JSON inside Redis. It's made to be
-    compatible with the register storage, if using the same Redis DB.
+    Store the context serialized inside Redis, as JSON unless another codec
+    is given. It's made to be compatible with the register storage, if using
+    the same Redis DB.
     """
+
+    def __init__(self, name, lock_prefix: str = "lock::", **kwargs):
+        kwargs.setdefault("local_cache_prefix", f"context::{name}::")
+        super().__init__(name=name, lock_prefix=lock_prefix, **kwargs)
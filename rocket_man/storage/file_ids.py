@@ -0,0 +1,48 @@
+from rocket_man.storage.redis import RedisStore
+
+
+class FileIdStore(RedisStore):
+    """
+    Remembers the `file_id` that Telegram gave to each uploaded frame, so a
+    frame is uploaded once and then re-sent by reference.
+
+    Entries expire after `ttl` seconds without being used, so frames nobody
+    plays anymore are evicted (as well as by Redis itself under memory
+    pressure, with a `volatile-*` eviction policy).
+    """
+
+    def __init__(self, content_prefix: str = "telegram::file_id::", ttl: int = 7 * 24 * 60 * 60, **kwargs):
+        super().__init__(content_prefix=content_prefix, **kwargs)
+        self.ttl = ttl
+
+    def frame_key(self, video_name: str, frame: int) -> str:
+        """
+        Compute the content key of a frame
+        """
+        return self.content_key(f"{video_name}::{frame}")
+
+    async def get_file_id(self, video_name: str, frame: int) -> str | None:
+        """
+        Get the file_id of a frame, if it was uploaded already. Using it
+        resets its expiration.
+        """
+        await self.ensure_async_init()
+        value = await self.redis.getex(self.frame_key(video_name, frame), ex=self.ttl)
+        if value is None:
+            return None
+        return value.decode()
+
+    async def set_file_id(self, video_name: str, frame: int, file_id: str) -> None:
+        """
+        Remember the file_id of a frame.
+        """
+        await self.ensure_async_init()
+        await self.redis.set(self.frame_key(video_name, frame), file_id, ex=self.ttl)
+
+    async def delete_file_id(self, video_name: str, frame: int) -> None:
+        """
+        Forget the file_id of a frame (e.g. when Telegram does not know it
+        anymore).
+        """
+        await self.ensure_async_init()
+        await self.redis.delete(self.frame_key(video_name, frame))
@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from rocket_man.schemas import Video
+from rocket_man.storage.frames import FrameStore
+
+logger = logging.getLogger(__name__)
+
+
+class FrameLibrary:
+    """
+    Videos ingested locally, to play without FrameX: the frames of each video
+    are packed in a `FrameStore` segment (never evicted), and its metadata is
+    kept next to them in a JSON file.
+
+    The metadata is written once all the frames are stored, and only videos
+    with metadata are listed, so a video being ingested (or whose ingestion
+    was interrupted) is invisible.
+
+    Several processes can read the same library while another one ingests
+    videos: `reload()` picks up the changes. Readers open it `read_only`, so
+    they don't mistake the files of a video being ingested for leftovers.
+    """
+
+    def __init__(self, root: Path | str, read_only: bool = False):
+        """
+        :param root: directory of the library
+        :param read_only: whether this process only reads the library, while
+            another one may be writing to it
+        """
+        self.root = Path(root)
+        self.read_only = read_only
+        self.frames = FrameStore(self.root, max_bytes=None, clean_up=not read_only)
+        self._videos: dict[str, Video] | None = None
+        self.version = ""
+
+    def _meta_path(self, video_name: str) -> Path:
+        return self.root / f"{quote(video_name, safe='')}.json"
+
+    def _scan(self) -> tuple[str, list[Path]]:
+        """
+        The metadata files, and a version that changes whenever one of them
+        does.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        paths = sorted(self.root.glob("*.json"))
+        digest = hashlib.sha1()
+
+        for path in paths:
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+
+        return digest.hexdigest()[:16], paths
+
+    def reload(self) -> bool:
+        """
+        Read the metadata again if it changed on disk. Returns `True` if it
+        did.
+        """
+        version, paths = self._scan()
+
+        if self._videos is not None and version == self.version:
+            return False
+
+        videos = {}
+
+        for path in paths:
+            try:
+                video = Video.validate_json(path.read_bytes())
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable video metadata %s", path, exc_info=True)
+                continue
+
+            videos[unquote(path.stem)] = video
+
+        # segments of videos ingested since the last load are not known yet
+        self.frames.close()
+        self.frames = FrameStore(self.root, max_bytes=None, clean_up=not self.read_only)
+        self._videos = videos
+        self.version = version
+        return True
+
+    @property
+    def videos(self) -> dict[str, Video]:
+        if self._videos is None:
+            self.reload()
+        return self._videos  # type: ignore[return-value]
+
+    def get_frame(self, video_name: str, frame: int) -> memoryview | None:
+        """
+        Get a frame of a listed video.
+        """
+        if video_name not in self.videos:
+            return None
+        return self.frames.get(video_name, frame)
+
+    def remove(self, video_name: str) -> None:
+        """
+        Remove a video, unlisting it before deleting its frames.
+        """
+        self._meta_path(video_name).unlink(missing_ok=True)
+        self.frames.delete(video_name)
+
+        if self._videos is not None:
+            self._videos.pop(video_name, None)
+
+    def publish(self, video: Video) -> None:
+        """
+        List a video whose frames are all stored. The metadata file is
+        replaced atomically, readers never see half of it.
+        """
+        path = self._meta_path(video.name)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(video.model_dump_json())
+        os.replace(tmp, path)
+
+        if self._videos is not None:
+            self._videos[video.name] = video
+
+    def close(self) -> None:
+        self.frames.close()
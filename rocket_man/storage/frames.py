@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Sequence
+from urllib.parse import quote, unquote
+
+from bernard.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# frame number, offset in the segment, length, CRC32 of the data
+INDEX_RECORD = struct.Struct("<IQII")
+
+
+class _Segment:
+    """
+    All the stored frames of one video: a data file where the JPEGs are
+    appended one after the other, and an index file with one fixed-size
+    record per frame pointing into it.
+    """
+
+    def __init__(self, data_path: Path, index_path: Path):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.index: dict[int, tuple[int, int, int]] = {}
+        self.verified: set[int] = set()
+        self.data_size = 0
+        self.index_size = 0
+        self._map: mmap.mmap | None = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.data_size + self.index_size
+
+    def load(self) -> None:
+        """
+        Read the index. A record that was being written during a crash is
+        incomplete: it is dropped and the index truncated back to the last
+        complete record.
+        """
+        raw = self.index_path.read_bytes()
+        valid = len(raw) - len(raw) % INDEX_RECORD.size
+        self.data_size = self.data_path.stat().st_size
+
+        if valid != len(raw):
+            logger.warning("Truncating incomplete record at the end of %s", self.index_path)
+            os.truncate(self.index_path, valid)
+
+        for frame, offset, length, crc in INDEX_RECORD.iter_unpack(raw[:valid]):
+            if offset + length <= self.data_size:
+                self.index[frame] = (offset, length, crc)
+
+        self.index_size = valid
+
+    def read(self, frame: int) -> memoryview | None:
+        """
+        Get a zero-copy view of a frame, straight from the memory map of the
+        data file.
+        """
+        try:
+            offset, length, crc = self.index[frame]
+        except KeyError:
+            return None
+
+        mapped = self._map
+        if mapped is None or len(mapped) < offset + length:
+            mapped = self._remap()
+
+        view = memoryview(mapped)[offset : offset + length]
+
+        if frame not in self.verified:
+            if zlib.crc32(view) != crc:
+                logger.warning("Frame %s of %s is corrupted, dropping it", frame, self.data_path)
+                del self.index[frame]
+                return None
+            self.verified.add(frame)
+
+        return view
+
+    def write(self, frame: int, data: bytes | memoryview) -> None:
+        """
+        Append a frame. The data is flushed to disk before the index record
+        that points to it, so a crash never leaves the index pointing to
+        missing data (at worst some unreferenced bytes at the end of the data
+        file).
+        """
+        self.write_many([(frame, data)])
+
+    def write_many(self, frames: Sequence[tuple[int, bytes | memoryview]]) -> None:
+        """
+        Append several frames, with a single flush of each file.
+        """
+        entries = []
+
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+
+            for frame, data in frames:
+                f.write(data)
+                entries.append((frame, offset, len(data), zlib.crc32(data)))
+                offset += len(data)
+
+            f.flush()
+            os.fsync(f.fileno())
+
+        records = b"".join(INDEX_RECORD.pack(*entry) for entry in entries)
+
+        with open(self.index_path, "ab") as f:
+            f.write(records)
+            f.flush()
+            os.fsync(f.fileno())
+
+        for frame, offset, length, crc in entries:
+            self.index[frame] = (offset, length, crc)
+            self.verified.add(frame)
+
+        self.data_size = offset
+        self.index_size += len(records)
+
+    def _remap(self) -> mmap.mmap:
+        self.close()
+        with open(self.data_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def close(self) -> None:
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # views of it are still in use, it will be unmapped once they
+                # are released
+                pass
+            self._map = None
+
+    def delete(self) -> None:
+        """
+        Remove the segment from disk, index first so a crash in between
+        leaves no index pointing to a missing data file.
+        """
+        self.close()
+        self.index_path.unlink(missing_ok=True)
+        self.data_path.unlink(missing_ok=True)
+
+
+class FrameStore:
+    """
+    On-disk store of frames, keyed by `(video_name, frame)`.
+
+    Frames of a video are packed into a single segment file and indexed by
+    offset. Reads are served as memory views of a memory map of that file, so
+    the same copy of each JPEG is shared by whoever needs it.
+
+    The total size is bounded by `max_bytes`. When it is exceeded, the least
+    recently used videos are evicted as a whole.
+    """
+
+    def __init__(self, root: Path | str, max_bytes: int | None = 1024 * 1024 * 1024, clean_up: bool = True):
+        """
+        :param root: directory where the segment files are stored
+        :param max_bytes: maximum total size of the store on disk, `None` to
+            never evict anything
+        :param clean_up: delete the leftovers of interrupted operations when
+            loading. Another process writing to `root` at the same time would
+            have its new segments deleted: only its writer should do it.
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.clean_up = clean_up
+        self._segments: OrderedDict[str, _Segment] = OrderedDict()
+        self._size = 0
+        self._loaded = False
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _paths(self, video_name: str) -> tuple[Path, Path]:
+        name = quote(video_name, safe="")
+        return self.root / f"{name}.seg", self.root / f"{name}.idx"
+
+    def _load(self) -> None:
+        """
+        Scan the root directory for existing segments, least recently
+        modified first, and clean up the leftovers of interrupted operations
+        (if `clean_up`).
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        if self.clean_up:
+            for path in self.root.glob("*.seg"):
+                if not path.with_suffix(".idx").exists():
+                    path.unlink()
+
+        indexes = sorted(self.root.glob("*.idx"), key=lambda p: p.stat().st_mtime)
+
+        for index_path in indexes:
+            data_path = index_path.with_suffix(".seg")
+
+            if not data_path.exists():
+                if self.clean_up:
+                    index_path.unlink()
+                continue
+
+            segment = _Segment(data_path, index_path)
+            segment.load()
+            self._segments[unquote(index_path.stem)] = segment
+            self._size += segment.size
+
+        self._loaded = True
+
+    def _segment(self, video_name: str, create: bool = False) -> _Segment | None:
+        if not self._loaded:
+            self._load()
+
+        try:
+            segment = self._segments[video_name]
+        except KeyError:
+            if not create:
+                return None
+            data_path, index_path = self._paths(video_name)
+            data_path.touch()
+            index_path.touch()
+            segment = self._segments[video_name] = _Segment(data_path, index_path)
+
+        self._segments.move_to_end(video_name)
+        return segment
+
+    def __contains__(self, key: tuple[str, int]) -> bool:
+        segment = self._segment(key[0])
+        return segment is not None and key[1] in segment.index
+
+    def get(self, video_name: str, frame: int) -> memoryview | None:
+        """
+        Get a frame if it is stored.
+        """
+        if (segment := self._segment(video_name)) is None:
+            return None
+        return segment.read(frame)
+
+    async def put(self, video_name: str, frame: int, data: bytes | memoryview) -> None:
+        """
+        Store a frame. The disk writes happen in a thread so they don't block
+        the event loop.
+        """
+        segment = self._segment(video_name, create=True)
+        assert segment is not None
+
+        async with segment.lock:
+            if frame in segment.index:
+                return
+
+            before = segment.size
+            await asyncio.to_thread(segment.write, frame, data)
+            self._size += segment.size - before
+
+        self._evict(keep=video_name)
+
+    async def put_many(self, video_name: str, frames: list[tuple[int, bytes]]) -> None:
+        """
+        Store several frames of a video at once, e.g. when ingesting it.
+        Frames already stored are skipped.
+        """
+        segment = self._segment(video_name, create=True)
+        assert segment is not None
+
+        async with segment.lock:
+            frames = [(frame, data) for frame, data in frames if frame not in segment.index]
+            before = segment.size
+            await asyncio.to_thread(segment.write_many, frames)
+            self._size += segment.size - before
+
+        self._evict(keep=video_name)
+
+    def delete(self, video_name: str) -> None:
+        """
+        Remove all the frames of a video.
+        """
+        if (segment := self._segment(video_name)) is None:
+            return
+
+        del self._segments[video_name]
+        self._size -= segment.size
+        segment.delete()
+
+    def _evict(self, keep: str) -> None:
+        """
+        Delete least recently used videos until the store fits in its size
+        limit. The video being written is never evicted.
+        """
+        if self.max_bytes is None:
+            return
+
+        for video_name in list(self._segments):
+            if self._size <= self.max_bytes:
+                break
+            if video_name == keep or self._segments[video_name].lock.locked():
+                continue
+
+            segment = self._segments.pop(video_name)
+            self._size -= segment.size
+            segment.delete()
+            logger.debug("Evicted frames of %s from the frame store", video_name)
+
+    def close(self) -> None:
+        """
+        Release the memory maps.
+        """
+        for segment in self._segments.values():
+            segment.close()
+
+
+# --- Worker-wide instance ---
+
+_frame_store: FrameStore | None = None
+
+
+def get_frame_store() -> FrameStore | None:
+    """
+    Get the frame store shared by the whole worker, or `None` if
+    `settings.FRAME_STORE_PARAMS` does not enable it.
+    """
+    global _frame_store
+
+    if _frame_store is None and settings.FRAME_STORE_PARAMS:
+        _frame_store = FrameStore(**settings.FRAME_STORE_PARAMS)
+    return _frame_store
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+class _Entry:
+    __slots__ = ("value", "expires", "pending")
+
+    def __init__(self):
+        self.value: bytes | None = None
+        self.expires = 0.0
+        # invalidations caused by our own writes, still to come
+        self.pending = 0
+
+
+_EMPTY = object()
+
+
+class LocalCache:
+    """
+    Bounded in-process copy of recently used Redis values, for a
+    `RedisMixin`. It only holds raw values and knows nothing of Redis: the
+    owner must call `invalidate()` for each invalidation message Redis sends,
+    and `clear()` whenever it may have missed some.
+
+    Values are kept at most `ttl` seconds and never beyond the TTL they have
+    in Redis. Missing keys are cached as well, as `None`.
+
+    Two races are handled here:
+
+    - A value read from Redis may be outdated by the time it is stored, if
+      an invalidation arrived in between. Reads go through `start_fill()` and
+      `fill()`, and the value is dropped if the key was invalidated meanwhile.
+    - Our own writes also cause invalidations, which must not evict the
+      value we just wrote. `expect_write()` is called before writing so the
+      invalidation that follows it is skipped. This is only correct because
+      writes to a key are serialized by its lock.
+    """
+
+    MISS = _EMPTY
+
+    def __init__(self, max_entries: int, ttl: float):
+        """
+        :param max_entries: maximum number of keys in the cache
+        :param ttl: maximum time a value is kept, in seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._fills: dict[str, object] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> bytes | None | object:
+        """
+        Get the cached value of a key, or `LocalCache.MISS`.
+        """
+        entry = self._entries.get(key)
+
+        if entry is None or entry.expires <= monotonic():
+            return self.MISS
+
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def _entry(self, key: str) -> _Entry:
+        try:
+            entry = self._entries[key]
+        except KeyError:
+            entry = self._entries[key] = _Entry()
+
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value: bytes | None, ttl: float | None) -> None:
+        entry = self._entry(key)
+        entry.value = value
+        entry.expires = monotonic() + min(self.ttl, self.ttl if ttl is None else ttl)
+
+    def start_fill(self, key: str) -> object:
+        """
+        Call before reading a key from Redis, and pass the returned token to
+        `fill()` with what was read.
+        """
+        token = self._fills[key] = object()
+        return token
+
+    def fill(self, key: str, token: object, value: bytes | None, ttl: float | None) -> None:
+        """
+        Store a value read from Redis, unless it was invalidated since the
+        read started.
+
+        :param ttl: remaining TTL of the key in Redis, in seconds, or `None`
+            if it has none
+        """
+        if self._fills.get(key) is not token:
+            return
+
+        del self._fills[key]
+        self._store(key, value, ttl)
+
+    def expect_write(self, key: str) -> None:
+        """
+        Call before writing a key: the value is unusable until `put()` and
+        the invalidation caused by the write won't evict it.
+        """
+        entry = self._entry(key)
+        entry.pending += 1
+        entry.expires = 0.0
+        self._fills.pop(key, None)
+
+    def put(self, key: str, value: bytes, ttl: float | None) -> None:
+        """
+        Store the value we just wrote.
+        """
+        self._store(key, value, ttl)
+
+    def discard(self, key: str) -> None:
+        """
+        Forget a key entirely, e.g. when a write failed.
+        """
+        self._entries.pop(key, None)
+        self._fills.pop(key, None)
+
+    def invalidate(self, key: str) -> None:
+        """
+        Handle an invalidation message from Redis.
+        """
+        self._fills.pop(key, None)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return
+
+        if entry.pending:
+            entry.pending -= 1
+        else:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._fills.clear()
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import Generic
+
+from bernard.storage.register import BaseRegisterStore
+
+from rocket_man import metrics
+from rocket_man.storage.codecs import Codec, Context, JsonCodec
+from rocket_man.storage.context import BaseContextStore
+from rocket_man.storage.redis import LockTimeout
+
+logger = logging.getLogger(__name__)
+
+evictions_total = metrics.Counter(
+    "rocket_man_memory_store_evictions_total",
+    "Values dropped from an in-memory store, because they expired or to make room",
+    ["store", "reason"],
+)
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel: expiration times are filed by key in `size` slots
+    of `tick` seconds, and `advance()` hands out the keys of the slots the
+    clock went past. Scheduling and cancelling are O(1) and there is no
+    timer per key.
+
+    Slots are reused on every turn of the wheel, so a key that is handed out
+    may only expire on a later turn: the owner checks its actual expiration
+    and schedules it again if needed.
+    """
+
+    def __init__(self, tick: float = 1.0, size: int = 4096):
+        """
+        :param tick: time covered by each slot, in seconds
+        :param size: number of slots
+        """
+        self.tick = tick
+        self.size = size
+        self._slots: list[set[str]] = [set() for _ in range(size)]
+        self._cursor = int(monotonic() / tick)
+
+    def _slot(self, expires: float) -> set[str]:
+        return self._slots[int(expires / self.tick) % self.size]
+
+    def schedule(self, key: str, expires: float) -> None:
+        self._slot(expires).add(key)
+
+    def cancel(self, key: str, expires: float) -> None:
+        self._slot(expires).discard(key)
+
+    def advance(self, now: float) -> list[str]:
+        """
+        Take the keys of the slots whose time has passed since the last call.
+        """
+        current = int(now / self.tick)
+        due: list[str] = []
+
+        # a slot is past once the clock left it, a full turn at most
+        for tick in range(max(self._cursor, current - self.size), current):
+            slot = self._slots[tick % self.size]
+
+            if slot:
+                due.extend(slot)
+                slot.clear()
+
+        self._cursor = max(self._cursor, current)
+        return due
+
+
+class _Shard:
+    __slots__ = ("entries",)
+
+    def __init__(self):
+        # key -> (encoded value, expiration), least recently used first
+        self.entries: OrderedDict[str, tuple[bytes | str, float]] = OrderedDict()
+
+
+class MemoryMixin(Generic[Context]):
+    """
+    Counterpart of `RedisMixin` that keeps everything in the memory of the
+    process, for single-process deployments and tests: no round trip at all.
+
+    - Values are spread over `shards` dictionaries, each bounded to its
+      share of `max_entries` and evicting the least recently used value, so
+      no dictionary grows (and gets resized) to the size of the whole store.
+    - Locks are per-key `asyncio.Lock`s, created when a key is locked and
+      dropped when nobody waits for them anymore: waiters are woken up in
+      order on release, without polling.
+    - Values expire `ttl` seconds after they were written, through a
+      `TimingWheel` advanced by the operations themselves.
+
+    Values are stored encoded with the codec, like in Redis, so callers get
+    their own copy and the memory used is the same as on a Redis server.
+
+    Nothing is shared between processes: with several workers, each would
+    have its own conversations.
+    """
+
+    def __init__(
+        self,
+        ttl: int = 20 * 60,
+        max_entries: int = 100_000,
+        shards: int = 16,
+        tick: float = 1.0,
+        lock_timeout: float | None = 120.0,
+        codec: Codec | None = None,
+        **kwargs,
+    ):
+        """
+        :param ttl: time after which a value that was not written again
+            expires, in seconds
+        :param max_entries: maximum number of values kept
+        :param shards: number of dictionaries the values are spread over
+        :param tick: precision of the expiration, in seconds
+        :param lock_timeout: how long to wait for a lock before giving up, in
+            seconds (`None` to wait forever)
+        :param codec: how to serialize the content, JSON by default
+        """
+        super().__init__(**kwargs)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock_timeout = lock_timeout
+        self.codec = codec or JsonCodec()
+
+        self._shards = [_Shard() for _ in range(shards)]
+        self._shard_size = max(max_entries // shards, 1)
+        self._wheel = TimingWheel(tick, size=max(int(ttl / tick) + 1, 1))
+
+        # per-key locks, with the number of tasks holding or waiting for them
+        self._locks: dict[str, tuple[asyncio.Lock, list[int]]] = {}
+        self._held: set[str] = set()
+
+    @property
+    def metrics_name(self) -> str:
+        return type(self).__name__
+
+    async def async_init(self) -> None:
+        pass
+
+    def _shard(self, key: str) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _expire(self, now: float) -> None:
+        """
+        Drop the values whose slot of the wheel just passed, if they really
+        expired.
+        """
+        for key in self._wheel.advance(now):
+            entries = self._shard(key).entries
+            entry = entries.get(key)
+
+            if entry is None:
+                continue
+            if entry[1] <= now:
+                del entries[key]
+                evictions_total.labels(self.metrics_name, "ttl").inc()
+            else:
+                self._wheel.schedule(key, entry[1])
+
+    def _read(self, key: str) -> bytes | str | None:
+        now = monotonic()
+        self._expire(now)
+        entries = self._shard(key).entries
+        entry = entries.get(key)
+
+        if entry is None or entry[1] <= now:
+            return None
+
+        entries.move_to_end(key)
+        return entry[0]
+
+    def _write(self, key: str, value: bytes | str) -> None:
+        now = monotonic()
+        self._expire(now)
+        entries = self._shard(key).entries
+        expires = now + self.ttl
+
+        if (previous := entries.get(key)) is not None:
+            self._wheel.cancel(key, previous[1])
+
+        entries[key] = (value, expires)
+        entries.move_to_end(key)
+        self._wheel.schedule(key, expires)
+
+        if len(entries) > self._shard_size:
+            old_key, (_, old_expires) = entries.popitem(last=False)
+            self._wheel.cancel(old_key, old_expires)
+            evictions_total.labels(self.metrics_name, "lru").inc()
+
+    def _decode(self, value: bytes | str | None) -> Context:
+        if value is None:
+            return {}  # type: ignore[return-value]
+        return self.codec.decode(value)  # type: ignore[arg-type]
+
+    async def _start(self, key: str) -> None:
+        """
+        Lock the key, waiting in line if another task holds it.
+        """
+        lock, users = self._locks.setdefault(key, (asyncio.Lock(), [0]))
+        users[0] += 1
+
+        try:
+            async with asyncio.timeout(self.lock_timeout):
+                await lock.acquire()
+        except BaseException as e:
+            self._forget_lock(key, users)
+
+            if isinstance(e, TimeoutError):
+                raise LockTimeout(f"Could not acquire the lock of {key}") from None
+            raise
+
+        self._held.add(key)
+
+    def _forget_lock(self, key: str, users: list[int]) -> None:
+        users[0] -= 1
+
+        if not users[0]:
+            del self._locks[key]
+
+    async def _finish(self, key: str) -> None:
+        """
+        Release the lock of the key, if we hold it.
+        """
+        if key not in self._held:
+            return
+
+        self._held.discard(key)
+        lock, users = self._locks[key]
+        lock.release()
+        self._forget_lock(key, users)
+
+    async def _get(self, key: str) -> Context:
+        """
+        Get the value for the key, an empty dictionary by default.
+        """
+        return self._decode(self._read(key))
+
+    async def _peek(self, key: str) -> Context:
+        """
+        Read the value without locking it.
+        """
+        return self._decode(self._read(key))
+
+    async def _set(self, key: str, data: Context) -> None:
+        """
+        Set the value for the key, resetting its expiration.
+        """
+        self._write(key, self.codec.encode(data))
+
+    async def _replace(self, key: str, data: Context) -> None:
+        """
+        Replace content with a new value.
+        """
+        await self._set(key, data)
+
+
+class MemoryContextStore(MemoryMixin[Context], BaseContextStore[Context]):
+    """
+    Store the contexts in the memory of the process (see `MemoryMixin`).
+    """
+
+
+class MemoryRegisterStore(MemoryMixin[Context], BaseRegisterStore):
+    """
+    Store the registers in the memory of the process (see `MemoryMixin`).
+    """
@@ -0,0 +1,72 @@
+import struct
+from time import monotonic
+
+from rocket_man.storage.redis import RedisStore
+
+# Launch frames are counted in this many bins of equal width per video
+PRIOR_BINS = 64
+
+
+def prior_edges(frames: int) -> list[int]:
+    """
+    First frame of each bin of a video with `frames` frames, followed by
+    `frames`.
+    """
+    return [i * frames // PRIOR_BINS for i in range(PRIOR_BINS + 1)]
+
+
+def prior_bin(frames: int, frame: int) -> int:
+    """
+    Bin of a frame, consistent with `prior_edges()`.
+    """
+    return min(max(frame, 0) * PRIOR_BINS // max(frames, 1), PRIOR_BINS - 1)
+
+
+class LaunchPriorStore(RedisStore):
+    """
+    Where players found the launch in each video, as a histogram of
+    `PRIOR_BINS` counters: a 256 bytes string per video, incremented in place
+    with `BITFIELD`.
+
+    Histograms change slowly, so they are cached in memory for `cache_ttl`
+    seconds.
+    """
+
+    COUNTERS = struct.Struct(f">{PRIOR_BINS}I")
+
+    def __init__(self, content_prefix: str = "prior::", cache_ttl: float = 60.0, **kwargs):
+        super().__init__(content_prefix=content_prefix, **kwargs)
+        self.cache_ttl = cache_ttl
+        self._cache: dict[str, tuple[float, list[int]]] = {}
+
+    def video_key(self, video_name: str, frames: int) -> str:
+        """
+        Compute the content key of a video. The number of frames is part of
+        it, so a video that changes starts over with an empty histogram.
+        """
+        return self.content_key(f"{video_name}::{frames}")
+
+    async def record(self, video_name: str, frames: int, frame: int) -> None:
+        """
+        Count a game that found the launch at `frame`.
+        """
+        await self.ensure_async_init()
+        key = self.video_key(video_name, frames)
+        offset = f"#{prior_bin(frames, frame)}"
+        await self.redis.bitfield(key).overflow("SAT").incrby("u32", offset, 1).execute()
+
+    async def get(self, video_name: str, frames: int) -> list[int]:
+        """
+        Get the histogram of a video, all zeros if no game was recorded.
+        """
+        key = self.video_key(video_name, frames)
+        cached = self._cache.get(key)
+
+        if cached is not None and cached[0] > monotonic():
+            return cached[1]
+
+        await self.ensure_async_init()
+        raw = await self.redis.get(key) or b""
+        counts = list(self.COUNTERS.unpack(raw.ljust(self.COUNTERS.size, b"\0")[: self.COUNTERS.size]))
+        self._cache[key] = (monotonic() + self.cache_ttl, counts)
+        return counts
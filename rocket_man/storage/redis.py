@@ -1,15 +1,207 @@
 import asyncio
-from typing import Mapping, TypeVar
+import logging
+from functools import wraps
+from time import monotonic, perf_counter
+from typing import Any, Generic, TypeAlias
+from uuid import uuid4
 
-import ujson
 from bernard.conf import settings
-from redis.asyncio import Redis
+from redis.asyncio import BlockingConnectionPool, Redis, RedisCluster
 
-Context = TypeVar("Context", bound=Mapping)
+from rocket_man import metrics
+from rocket_man.storage.codecs import Codec, Context, JsonCodec
+from rocket_man.storage.local_cache import LocalCache
 
+logger = logging.getLogger(__name__)
 
-class RedisMixin:
-    redis: Redis
+# Take the lock if it's free and read the content in the same round trip.
+# Otherwise, return the remaining lease of the current owner. Locks without a
+# lease (left by older versions) are given one so they can't block forever.
+#
+# Contenders that are about to wait for the lock are counted, so the owner
+# only wakes someone up when somebody waits. A contender counted by its
+# previous attempt is uncounted first. The count expires with the lease, in
+# case a contender dies while waiting.
+#
+# KEYS: lock, content, waiter count
+# ARGV: token, lease (ms), "1" if counted by the previous attempt, "1" to be
+#   counted if the lock is taken
+ACQUIRE_SCRIPT = """
+if ARGV[3] == "1" and redis.call("DECR", KEYS[3]) <= 0 then
+    redis.call("DEL", KEYS[3])
+end
+if redis.call("SET", KEYS[1], ARGV[1], "NX", "PX", ARGV[2]) then
+    return {1, redis.call("GET", KEYS[2])}
+end
+local pttl = redis.call("PTTL", KEYS[1])
+if pttl == -1 then
+    redis.call("PEXPIRE", KEYS[1], ARGV[2])
+    pttl = tonumber(ARGV[2])
+end
+if ARGV[4] == "1" then
+    redis.call("INCR", KEYS[3])
+    redis.call("PEXPIRE", KEYS[3], ARGV[2])
+end
+return {0, pttl}
+"""
+
+# If we still own the lock, optionally write the content, release the lock and
+# wake up one waiter if there is any, all in the same round trip. The wake-up
+# list holds at most one token, so waiters that come later don't find stale
+# ones.
+#
+# KEYS: lock, content, wake-up list, waiter count
+# ARGV: token, "1" to write the content, content, content TTL (s), wake-up TTL (ms)
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == "1" then
+    redis.call("SET", KEYS[2], ARGV[3], "EX", ARGV[4])
+end
+redis.call("DEL", KEYS[1])
+if tonumber(redis.call("GET", KEYS[4]) or "0") > 0 then
+    redis.call("DEL", KEYS[3])
+    redis.call("RPUSH", KEYS[3], "1")
+    redis.call("PEXPIRE", KEYS[3], ARGV[5])
+end
+return 1
+"""
+
+lock_wait_seconds = metrics.Histogram(
+    "rocket_man_redis_lock_wait_seconds",
+    "Time spent waiting to acquire a Redis lock",
+    ["store"],
+)
+local_lock_waits_total = metrics.Counter(
+    "rocket_man_redis_local_lock_waits_total",
+    "Locks that another task of the same process was already holding or waiting for",
+    ["store"],
+)
+lock_lost_total = metrics.Counter(
+    "rocket_man_redis_lock_lost_total",
+    "Locks whose lease expired before they were released",
+    ["store"],
+)
+
+local_cache_requests_total = metrics.Counter(
+    "rocket_man_redis_local_cache_requests_total",
+    "Reads served from the in-process cache (hit) or from Redis (miss)",
+    ["store", "result"],
+)
+local_cache_invalidations_total = metrics.Counter(
+    "rocket_man_redis_local_cache_invalidations_total",
+    "Invalidation messages received from Redis",
+    ["store"],
+)
+
+op_seconds = metrics.Histogram(
+    "rocket_man_redis_op_seconds",
+    "Duration of the operations of a Redis store, lock waits included",
+    ["store", "op"],
+)
+op_errors_total = metrics.Counter(
+    "rocket_man_redis_op_errors_total",
+    "Operations of a Redis store that raised",
+    ["store", "op"],
+)
+
+
+def _timed(op: str):
+    """
+    Record the duration and the failures of a `RedisMixin` operation.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, key: str, *args):
+            start = perf_counter()
+
+            try:
+                return await func(self, key, *args)
+            except Exception:
+                op_errors_total.labels(self.metrics_name, op).inc()
+                raise
+            finally:
+                op_seconds.labels(self.metrics_name, op).observe(perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+# How often the invalidation connections are checked, in seconds
+TRACKING_HEALTH_INTERVAL = 5.0
+
+
+# `Redis` or `RedisCluster`: both have the commands we use, but the type
+# stubs only know the cluster client's own methods
+RedisClient: TypeAlias = Any
+
+
+class LockTimeout(Exception):
+    """
+    The lock could not be acquired in time.
+    """
+
+
+async def connect_redis(redis_url: str, max_connections: int, cluster: bool) -> RedisClient:
+    """
+    Connect to a standalone Redis, or to the Redis Cluster that `redis_url` is
+    a node of. The cluster client discovers the other nodes and follows the
+    slots when they move (MOVED/ASK redirections), so nodes can be added or
+    removed without restarting the bot.
+
+    A standalone client waits for a free connection when all
+    `max_connections` are in use, rather than failing the command.
+    """
+    if cluster:
+        client: RedisCluster = RedisCluster.from_url(redis_url, max_connections=max_connections)
+        await client.initialize()
+        return client
+
+    return await Redis(connection_pool=BlockingConnectionPool.from_url(redis_url, max_connections=max_connections))
+
+
+class RedisStore:
+    """
+    Base of the stores that only need a connection to Redis, opened on first
+    use, without the locks of `RedisMixin`.
+    """
+
+    redis: RedisClient
+
+    def __init__(
+        self,
+        content_prefix: str = "",
+        redis_url: str | None = None,
+        max_connections: int = 10,
+        cluster: bool | None = None,
+    ):
+        self.content_prefix = content_prefix
+        self.redis_url = redis_url or settings.REDIS_PARAMS["redis_url"]
+        self.max_connections = max_connections
+        self.cluster = settings.REDIS_PARAMS.get("cluster", False) if cluster is None else cluster
+        self._init_done = False
+
+    async def ensure_async_init(self) -> None:
+        """
+        This allows to lazily do the async init
+        """
+        if not self._init_done:
+            self.redis = await connect_redis(self.redis_url, self.max_connections, self.cluster)
+            self._init_done = True
+
+    def content_key(self, key: str) -> str:
+        """
+        Compute the internal content key for the specified key
+        """
+        return f"{self.content_prefix}{key}"
+
+
+class RedisMixin(Generic[Context]):
+    redis: RedisClient
+    waiters: RedisClient
 
     def __init__(
         self,
@@ -18,6 +210,14 @@ class RedisMixin:
         max_connections: int = 10,
         content_prefix: str = "",
         lock_prefix: str = "",
+        lock_ttl: float | None = None,
+        lock_timeout: float | None = None,
+        max_waiters: int = 50,
+        codec: Codec | None = None,
+        local_cache_size: int = 0,
+        local_cache_ttl: float = 60.0,
+        local_cache_prefix: str = "",
+        cluster: bool | None = None,
         **kwargs,
     ):
         """
@@ -25,6 +225,25 @@ class RedisMixin:
 
         :param redis_url: The redis url to connect to.
         :param max_connections: maximum number of connections alive
+        :param lock_ttl: lease of a lock, in seconds. If its owner dies, the
+            lock is released after that time.
+        :param lock_timeout: how long to wait for a lock before giving up, in
+            seconds
+        :param max_waiters: maximum number of connections blocked waiting for
+            a lock, extra waiters queue locally for a connection
+        :param codec: how to serialize the content, JSON by default
+        :param local_cache_size: number of values to keep in memory, kept
+            coherent with Redis through client-side caching invalidations
+            (Redis 6+). 0 disables the in-process cache.
+        :param local_cache_ttl: maximum time a value is kept in memory, in
+            seconds
+        :param local_cache_prefix: prefix of the keys to cache, after the
+            content prefix. Other keys are neither cached nor tracked.
+        :param cluster: whether `redis_url` is a node of a Redis Cluster
+            rather than a standalone Redis. The keys of each conversation then
+            share a hash tag, so they stay in the same slot, which the lock
+            scripts need (even while the slot moves to another node). The
+            local cache is not available with a cluster.
         """
         super().__init__(**kwargs)
         self.redis_url = redis_url or settings.REDIS_PARAMS["redis_url"]
@@ -32,66 +251,377 @@ class RedisMixin:
         self.max_connections = max_connections
         self.content_prefix = content_prefix
         self.lock_prefix = lock_prefix
+        self.lock_ttl = lock_ttl or settings.REDIS_PARAMS.get("lock_ttl", 60)
+        self.lock_timeout = lock_timeout or settings.REDIS_PARAMS.get("lock_timeout", 2 * self.lock_ttl)
+        self.max_waiters = max_waiters
+        self.codec = codec or JsonCodec()
+        self.local_cache_prefix = local_cache_prefix
+        self.cluster = settings.REDIS_PARAMS.get("cluster", False) if cluster is None else cluster
+
+        if self.cluster and local_cache_size > 0:
+            # invalidations would have to be tracked on every node
+            logger.warning("The local cache of %s is not available with Redis Cluster", self.metrics_name)
+            local_cache_size = 0
+
+        self.local_cache = LocalCache(local_cache_size, local_cache_ttl) if local_cache_size > 0 else None
+        self._waiter_slots = asyncio.Semaphore(max_waiters)
+        # in-process lock of each key, with the number of tasks holding or
+        # waiting for it, see `_start()`
+        self._local_locks: dict[str, tuple[asyncio.Lock, list[int]]] = {}
+
+        # the local cache is only used while invalidations are received
+        self._tracking = False
+        self._tracking_task: asyncio.Task | None = None
+
+        # state of the locks held by this process, by key
+        self._tokens: dict[str, str] = {}
+        self._loaded: dict[str, bytes | None] = {}
+        self._pending: dict[str, Context] = {}
+
+    @property
+    def metrics_name(self) -> str:
+        return type(self).__name__
 
     async def async_init(self):
         """
         Handle here the asynchronous part of the init.
         """
-        self.redis = await Redis.from_url(
-            self.redis_url,
-            max_connections=self.max_connections,
+        if self.cluster:
+            await self._cluster_init()
+            return
+
+        self.redis = await connect_redis(self.redis_url, self.max_connections, cluster=False)
+        self.waiters = Redis(
+            connection_pool=BlockingConnectionPool.from_url(
+                self.redis_url,
+                max_connections=self.max_waiters,
+                timeout=None,
+            ),
         )
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+        if self.local_cache is not None:
+            self._tracking_task = asyncio.create_task(self._track_invalidations())
+
+    async def _cluster_init(self) -> None:
+        """
+        Connect to a Redis Cluster.
+        """
+        # connections are pooled per node, and a full pool raises instead of
+        # blocking: waiters are limited with `_waiter_slots` instead
+        self.redis = await connect_redis(self.redis_url, self.max_connections, cluster=True)
+        self.waiters = await connect_redis(self.redis_url, self.max_waiters, cluster=True)
+
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    async def _track_invalidations(self) -> None:
+        """
+        Keep the local cache coherent with Redis, using client-side caching
+        in broadcast mode: Redis notifies a Pub/Sub connection of every
+        change to a key under our prefix, whoever makes it.
+
+        The local cache is only used while both connections are known to be
+        alive. Whenever that is in doubt it is cleared, as invalidations may
+        have been missed, and tracking is set up again.
+        """
+        assert self.local_cache is not None
+        prefix = self.content_key(self.local_cache_prefix)
+        tracked = self.metrics_name
+
+        while True:
+            listener = self.redis.pubsub()
+            tracker = Redis.from_url(self.redis_url, single_connection_client=True)
+
+            try:
+                await listener.connect()
+                await listener.connection.send_command("CLIENT", "ID")  # type: ignore[union-attr]
+                listener_id = await listener.connection.read_response()  # type: ignore[union-attr]
+                await listener.subscribe("__redis__:invalidate")
+
+                tracker_id = await tracker.client_id()
+                args = ["CLIENT", "TRACKING", "ON", "REDIRECT", listener_id, "BCAST"]
+                await tracker.execute_command(*args, *(["PREFIX", prefix] if prefix else []))
+
+                self.local_cache.clear()
+                self._tracking = True
+                last_seen = monotonic()
+
+                while True:
+                    message = await listener.get_message(timeout=TRACKING_HEALTH_INTERVAL)
+
+                    if message is not None:
+                        last_seen = monotonic()
+
+                        if message["type"] == "message":
+                            local_cache_invalidations_total.labels(tracked).inc()
+
+                            if message["data"] is None:
+                                # the whole database was flushed
+                                self.local_cache.clear()
+                            else:
+                                for key in message["data"]:
+                                    self.local_cache.invalidate(key.decode()[len(self.content_prefix) :])
+                        continue
+
+                    if monotonic() - last_seen > 2 * TRACKING_HEALTH_INTERVAL:
+                        raise ConnectionError("Invalidation connection is not answering")
+
+                    if await tracker.client_id() != tracker_id:
+                        raise ConnectionError("Tracking connection was reset")
+
+                    await listener.ping()
+
+            except Exception:
+                logger.warning("Lost Redis invalidations, disabling the local cache for now", exc_info=True)
+            finally:
+                self._tracking = False
+                self.local_cache.clear()
+                await listener.close()
+                await tracker.close(close_connection_pool=True)
+
+            await asyncio.sleep(1)
+
+    def _tagged(self, key: str) -> str:
+        """
+        With a cluster, only the part of a key between braces decides its
+        slot, so the lock, content and wake-up keys of a conversation land
+        together.
+        """
+        return f"{{{key}}}" if self.cluster else key
 
     def lock_key(self, key: str) -> str:
         """
         Compute the internal lock key for the specified key
         """
-        return f"{self.lock_prefix}{key}"
+        return f"{self.lock_prefix}{self._tagged(key)}"
 
     def content_key(self, key: str) -> str:
         """
         Compute the internal content key for the specified key
         """
-        return f"{self.content_prefix}{key}"
+        return f"{self.content_prefix}{self._tagged(key)}"
+
+    def wake_key(self, key: str) -> str:
+        """
+        Compute the key of the list used to wake up the lock waiters
+        """
+        return f"{self.lock_key(key)}:wake"
+
+    def waiters_key(self, key: str) -> str:
+        """
+        Compute the key counting the lock waiters
+        """
+        return f"{self.lock_key(key)}:waiters"
+
+    def _encode(self, data: Context) -> str | bytes:
+        return self.codec.encode(data)
+
+    def _decode(self, value: bytes | None) -> Context:
+        if value is None:
+            return {}  # type: ignore[return-value]
+        return self.codec.decode(value)
+
+    def _forget_local_lock(self, key: str, users: list[int]) -> None:
+        users[0] -= 1
+
+        if not users[0]:
+            del self._local_locks[key]
 
+    def _release_local_lock(self, key: str) -> None:
+        local, users = self._local_locks[key]
+        local.release()
+        self._forget_local_lock(key, users)
+
+    @_timed("start")
     async def _start(self, key: str) -> None:
         """
         Start the lock.
 
-        Here we use a SETNX-based algorithm. It's quite shitty, change it.
+        Tasks of this process first queue on an in-process lock of the key,
+        so only one of them at a time contends for the Redis lock of a key: a
+        double tap or a redelivered update waits its turn locally, in order,
+        and is handed the lock as soon as it is released, without any Redis
+        traffic. The local lock is dropped once no task holds or waits for it.
+
+        The Redis lock holds a random token identifying its owner and has a
+        lease, so a crashed owner can't keep it forever. Acquiring it also
+        reads the content, which `_get()` then returns without another round
+        trip.
+
+        When the Redis lock is taken by another process, we block on a list
+        that the owner pushes to when releasing it (or until its lease
+        expires), instead of polling.
         """
-        for _ in range(0, 1000):
-            just_set = await self.redis.setnx(self.lock_key(key), "")
+        started = monotonic()
+        local, users = self._local_locks.setdefault(key, (asyncio.Lock(), [0]))
+        users[0] += 1
+
+        if local.locked():
+            local_lock_waits_total.labels(self.metrics_name).inc()
+
+        try:
+            async with asyncio.timeout(self.lock_timeout):
+                await local.acquire()
+        except BaseException as e:
+            self._forget_local_lock(key, users)
+
+            if isinstance(e, TimeoutError):
+                raise LockTimeout(f"Could not acquire the lock of {key}") from None
+            raise
+
+        try:
+            value = await self._acquire_redis_lock(key, started)
+        except BaseException:
+            self._release_local_lock(key)
+            raise
+
+        lock_wait_seconds.labels(self.metrics_name).observe(monotonic() - started)
+        self._loaded[key] = value
 
-            if just_set:
+    async def _acquire_redis_lock(self, key: str, started: float) -> bytes | None:
+        """
+        Take the Redis lock of a key, returning its content.
+        """
+        token = uuid4().hex
+        lease = int(self.lock_ttl * 1000)
+        keys = [self.lock_key(key), self.content_key(key), self.waiters_key(key)]
+        counted = False
+
+        while True:
+            # once out of time, try a last time without waiting (nor being
+            # counted as a waiter)
+            remaining = started + self.lock_timeout - monotonic()
+            acquired, value = await self._acquire(keys=keys, args=[token, lease, int(counted), int(remaining > 0)])
+
+            if acquired:
                 break
 
-            await asyncio.sleep(settings.REDIS_POLL_INTERVAL)
+            counted = remaining > 0
+            if not counted:
+                raise LockTimeout(f"Could not acquire the lock of {key}")
 
+            wait = max(min(remaining, value / 1000), 0.01)
+
+            if self.cluster:
+                async with self._waiter_slots:
+                    await self.waiters.blpop(self.wake_key(key), timeout=wait)
+            else:
+                await self.waiters.blpop(self.wake_key(key), timeout=wait)
+
+        self._tokens[key] = token
+        return value
+
+    @_timed("finish")
     async def _finish(self, key: str) -> None:
         """
-        Remove the lock.
+        Remove the lock, saving the content written while holding it.
+        """
+        self._loaded.pop(key, None)
+        token = self._tokens.pop(key, None)
+
+        if token is None:
+            return
+
+        try:
+            await self._release_redis_lock(key, token)
+        finally:
+            self._release_local_lock(key)
+
+    async def _release_redis_lock(self, key: str, token: str) -> None:
+        """
+        Release the Redis lock of a key, writing its pending content.
         """
-        await self.redis.delete(self.lock_key(key))
+        if key in self._pending:
+            write, data = "1", self._encode(self._pending.pop(key))
+        else:
+            write, data = "0", ""
+
+        cache = self.local_cache if write == "1" and self._tracking else None
+
+        if cache is not None:
+            cache.expect_write(key)
+
+        try:
+            released = await self._release(
+                keys=[self.lock_key(key), self.content_key(key), self.wake_key(key), self.waiters_key(key)],
+                args=[token, write, data, self.ttl, int(self.lock_ttl * 1000)],
+            )
+        except BaseException:
+            if cache is not None:
+                cache.discard(key)
+            raise
+
+        if cache is not None:
+            if released:
+                cache.put(key, _as_bytes(data), self.ttl)
+            else:
+                cache.discard(key)
 
+        if not released:
+            lock_lost_total.labels(self.metrics_name).inc()
+            logger.warning("Lock of %s expired before being released, changes were not saved", key)
+
+    @_timed("get")
     async def _get(self, key: str) -> Context:
         """
-        Get the value for the key. It is automatically deserialized from JSON
-        and returns an empty dictionary by default.
+        Get the value for the key. It is automatically deserialized with the
+        codec and returns an empty dictionary by default.
         """
-        value = await self.redis.get(self.content_key(key))
-        if value is None:
-            return {}  # type: ignore[return-value]
-        return ujson.loads(value)
+        if key in self._loaded:
+            return self._decode(self._loaded.pop(key))
+        return await self._peek(key)
+
+    @_timed("peek")
+    async def _peek(self, key: str) -> Context:
+        """
+        Read the value without looking at what the lock returned, as the lock
+        may be held by someone else in this process. It is served by the
+        local cache when possible.
+        """
+        cache = self.local_cache if self._tracking and key.startswith(self.local_cache_prefix) else None
+
+        if cache is None:
+            return self._decode(await self.redis.get(self.content_key(key)))
+
+        value = cache.get(key)
 
+        if value is not LocalCache.MISS:
+            local_cache_requests_total.labels(self.metrics_name, "hit").inc()
+            return self._decode(value)  # type: ignore[arg-type]
+
+        local_cache_requests_total.labels(self.metrics_name, "miss").inc()
+        token = cache.start_fill(key)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            value, pttl = await pipe.get(self.content_key(key)).pttl(self.content_key(key)).execute()
+
+        cache.fill(key, token, value, pttl / 1000 if pttl >= 0 else None)
+        return self._decode(value)
+
+    @_timed("set")
     async def _set(self, key: str, data: Context) -> None:
         """
-        Set the value for the key.
+        Set the value for the key. While the key is locked, the write is
+        deferred to the release of the lock.
         """
-        await self.redis.set(self.content_key(key), ujson.dumps(data), ex=self.ttl)
+        if key in self._tokens:
+            self._pending[key] = data
+            return
+
+        value = self._encode(data)
+        # without the lock, concurrent writes could be cached out of order
+        if self.local_cache is not None:
+            self.local_cache.discard(key)
+        await self.redis.set(self.content_key(key), value, ex=self.ttl)
 
     async def _replace(self, key: str, data: Context) -> None:
         """
         Replace content with a new value.
         """
         await self._set(key, data)
+
+
+def _as_bytes(value: str | bytes) -> bytes:
+    return value.encode() if isinstance(value, str) else value
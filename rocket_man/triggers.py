@@ -1,10 +1,54 @@
+from time import perf_counter
+from typing import Any
+
 from bernard import layers as lyr
 from bernard.engine.request import Request
+from bernard.engine.transition import Transition
 from bernard.engine.triggers import BaseTrigger
 
+from rocket_man import metrics
+from rocket_man.game import verify_game
 from rocket_man.storage import HasLaunchedContext
 from rocket_man.storage import context_store as cs
 
+trigger_rank_seconds = metrics.Histogram(
+    "rocket_man_trigger_rank_seconds",
+    "Time spent ranking the trigger of a transition, by current state",
+    ["state", "transition"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class TimedTransition(Transition):
+    """
+    Transition that records how long its trigger takes to rank each request,
+    labelled by the current state of the conversation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timers: dict[str | None, Any] = {}
+
+    def _timer(self, origin: str | None):
+        try:
+            return self._timers[origin]
+        except KeyError:
+            state = origin.rsplit(".", 1)[-1] if origin else "none"
+            timer = self._timers[origin] = trigger_rank_seconds.labels(state, str(self))
+            return timer
+
+    async def rank(self, request: Request, origin: str | None):
+        if self.origin_name is not None and self.origin_name != origin:
+            # can't leave the current state, the trigger is not even built
+            return await super().rank(request, origin)
+
+        start = perf_counter()
+
+        try:
+            return await super().rank(request, origin)
+        finally:
+            self._timer(origin).observe(perf_counter() - start)
+
 
 class ActionSrcTrigger(BaseTrigger):
     def __init__(self, request: Request, action: str):
@@ -24,20 +68,35 @@ class ActionSrcTrigger(BaseTrigger):
 
         return 1.0
 
+    def game_token_is_valid(self) -> bool:
+        """
+        Check the signature of the game state carried by the payload (see
+        `rocket_man.game`), without touching the context store.
+        """
+        token = self.request.get_layer(lyr.Postback).payload["g"]
+        return verify_game(token, self.request.conversation.id) is not None
+
 
 class MaybeHasLaunchedTrigger(ActionSrcTrigger):
-    @cs.inject()
-    async def rank(self, context: dict) -> float:
+    async def rank(self) -> float:
         rank = await super().rank()
         if rank == 0.0:
             return 0.0
 
         payload = self.request.get_layer(lyr.Postback).payload
 
+        if "g" in payload:
+            # the state is in the payload, it can't expire but it can be forged
+            return 0.0 if self.game_token_is_valid() else 1.0
+
         if payload.get("cond") is None:
             # must show the first frame
             return 0.0
 
+        return await self._rank_context()
+
+    @cs.inject()
+    async def _rank_context(self, context: dict) -> float:
         if context.get("step") is None:
             # missing mandatory step
             # did the context expire?
@@ -48,14 +107,16 @@ class MaybeHasLaunchedTrigger(ActionSrcTrigger):
 
 
 class HasLaunchedTrigger(ActionSrcTrigger):
-    @cs.inject()
-    async def rank(self, context: HasLaunchedContext) -> float:
+    async def rank(self) -> float:
         rank = await super().rank()
         if rank == 0.0:
             return 0.0
 
         payload = self.request.get_layer(lyr.Postback).payload
 
+        if "g" in payload:
+            return 1.0 if self.game_token_is_valid() else 0.0
+
         cond = payload.get("cond")
         if cond is None:
             # must show the first frame
@@ -65,6 +126,10 @@ class HasLaunchedTrigger(ActionSrcTrigger):
             # invalid payload
             return 0.0
 
+        return await self._rank_context()
+
+    @cs.inject()
+    async def _rank_context(self, context: HasLaunchedContext) -> float:
         if context.get("step") is None:
             # missing mandatory step
             # did the context expire?
@@ -72,3 +137,20 @@ class HasLaunchedTrigger(ActionSrcTrigger):
 
         # payload is valid and context is not expired
         return 1.0
+
+
+class GameTokenTrigger(ActionSrcTrigger):
+    """
+    Answers carrying a signed game state, whatever the current state of the
+    conversation: unlike the context, the state they carry does not expire.
+    """
+
+    async def rank(self) -> float:
+        rank = await super().rank()
+        if rank == 0.0:
+            return 0.0
+
+        if "g" not in self.request.get_layer(lyr.Postback).payload:
+            return 0.0
+
+        return 1.0 if self.game_token_is_valid() else 0.0
@@ -1,5 +1,16 @@
+import asyncio
+import logging
+from collections import deque
+from time import monotonic
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
 from yarl import URL
 
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
 md_link_escape_table = str.maketrans(
     {
         ")": r"\)",
@@ -13,3 +24,175 @@ def escape_md_link(url: URL) -> str:
     Convert a URL to a Markdown link.
     """
     return str(url).translate(md_link_escape_table)
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Collapse concurrent calls for the same key into a single one: the first
+    caller starts the call and everyone asking for the same key meanwhile
+    waits for that same result.
+    """
+
+    def __init__(self):
+        self._calls: dict[K, asyncio.Task[V]] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def start(self, key: K, factory: Callable[[], Awaitable[V]]) -> asyncio.Task[V]:
+        """
+        Start the call for this key in the background, unless it is already
+        running. Returns the task doing the call.
+        """
+        try:
+            return self._calls[key]
+        except KeyError:
+            pass
+
+        task = asyncio.ensure_future(factory())
+        self._calls[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    async def do(self, key: K, factory: Callable[[], Awaitable[V]]) -> V:
+        """
+        Run the call for this key, or join the one already running. The call
+        is shielded, so a caller giving up does not cancel it for the others.
+        """
+        return await asyncio.shield(self.start(key, factory))
+
+    def cancel(self, key: K) -> None:
+        """
+        Cancel the running call for this key, if any.
+        """
+        if (task := self._calls.get(key)) is not None:
+            task.cancel()
+
+    def _done(self, key: K, task: asyncio.Task[V]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+        if not task.cancelled() and (err := task.exception()) is not None:
+            logger.debug("Call for %r failed: %r", key, err)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing, so callers fail right away
+    instead of piling up behind timeouts.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    calls are refused for `reset_timeout` seconds. It is then half-open: one
+    trial call is let through, which closes the circuit if it succeeds and
+    opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: how long the circuit stays open, in seconds
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at: float | None = None
+        self._trial_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a call may be made now. When half-open, only the first caller
+        gets to make the trial call (or the next one, if the trial never
+        reported back).
+        """
+        state = self.state
+
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+
+        now = monotonic()
+        if self._trial_at is not None and now - self._trial_at < self.reset_timeout:
+            return False
+
+        self._trial_at = now
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._trial_at = None
+
+    def failure(self) -> bool:
+        """
+        Record a failed call. Returns `True` if it opened the circuit.
+        """
+        self.failures += 1
+        self._trial_at = None
+
+        if self._opened_at is None and self.failures < self.failure_threshold:
+            return False
+
+        was_closed = self._opened_at is None
+        self._opened_at = monotonic()
+        return was_closed
+
+
+class LatencyWindow:
+    """
+    The most recent durations of an operation, to tell what counts as slow
+    for it. Quantiles are only computed again every `refresh` new values.
+    """
+
+    def __init__(self, size: int = 200, min_values: int = 20, refresh: int = 20):
+        """
+        :param size: number of durations kept
+        :param min_values: below this many durations, quantiles are unknown
+        :param refresh: number of new durations before quantiles are updated
+        """
+        self.min_values = min_values
+        self.refresh = refresh
+        self._values: deque[float] = deque(maxlen=size)
+        self._quantiles: dict[float, float] = {}
+        self._added = 0
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+        self._added += 1
+
+        if self._added >= self.refresh:
+            self._added = 0
+            self._quantiles.clear()
+
+    def quantile(self, q: float) -> float | None:
+        """
+        The `q` quantile (between 0 and 1) of the recent durations, or `None`
+        if there are not enough of them yet.
+        """
+        if len(self._values) < self.min_values:
+            return None
+
+        try:
+            return self._quantiles[q]
+        except KeyError:
+            values = sorted(self._values)
+            value = self._quantiles[q] = values[round(q * (len(values) - 1))]
+            return value
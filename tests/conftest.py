@@ -0,0 +1,6 @@
+import os
+from pathlib import Path
+
+# the bot's own settings, with a signing key for the stateless games
+os.environ.setdefault("BERNARD_SETTINGS_FILE", str(Path(__file__).parent.parent / "rocket_man" / "settings.py"))
+os.environ.setdefault("WEBVIEW_SECRET_KEY", "test-secret")
@@ -0,0 +1,35 @@
+import asyncio
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from rocket_man.services.frames import RenditionCache
+
+
+class Source:
+    _service = None
+
+    async def get_video_frame(self, video_name, frame):
+        return b"original"
+
+
+class BrokenExecutor(Executor):
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        future: Future = Future()
+        future.set_exception(BrokenProcessPool())
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_process_pool_is_shut_down_and_replaced():
+    cache = RenditionCache(Source())  # type: ignore[arg-type]
+    broken = cache._executor = BrokenExecutor()  # type: ignore[assignment]
+
+    # the original is sent meanwhile
+    assert asyncio.run(cache._download("video", 1)) == b"original"
+    assert broken.shut_down
+    assert cache._executor is None
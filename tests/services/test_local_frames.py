@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from rocket_man.services.local_frames import split_jpegs
+
+
+def jpeg(scan: bytes) -> bytes:
+    """
+    A minimal JPEG, whose quantization table contains the end marker.
+    """
+    table = bytes([0xFF, 0xD9] + list(range(1, 63)))
+
+    return b"".join(
+        [
+            b"\xff\xd8",
+            b"\xff\xdb" + (67).to_bytes(2, "big") + b"\x00" + table,
+            b"\xff\xc0" + (11).to_bytes(2, "big") + bytes([8, 0, 1, 0, 1, 1, 1, 0x11, 0]),
+            b"\xff\xda" + (8).to_bytes(2, "big") + bytes([1, 1, 0, 0, 63, 0]),
+            scan,
+            b"\xff\xd9",
+        ]
+    )
+
+
+IMAGES = [
+    jpeg(b"\x12\x34\xff\x00\x56"),
+    # restart markers and fill bytes inside the compressed data
+    jpeg(b"\x12\xff\xd0\x34\xff\xff\xff\x00"),
+    jpeg(b""),
+]
+
+
+def split(data: bytes, chunk_size: int) -> list[bytes]:
+    async def scenario():
+        stream = asyncio.StreamReader()
+        stream.feed_data(data)
+        stream.feed_eof()
+        return [image async for image in split_jpegs(stream, chunk_size)]
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1024])
+def test_images_are_split_at_their_end(chunk_size):
+    assert split(b"".join(IMAGES), chunk_size) == IMAGES
+
+
+def test_truncated_stream_is_refused():
+    with pytest.raises(ValueError):
+        split(b"".join(IMAGES)[:-1], 64)
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from rocket_man.storage import has_launched_codec
+from rocket_man.storage.codecs import JsonCodec, StructCodec
+from rocket_man.storage.memory import MemoryContextStore
+
+GAME = {"step": 3, "lo": 0, "hi": 51_234, "mid": 25_617, "video_name": "Falcon Heavy Test Flight ✨"}
+
+
+@pytest.mark.parametrize(
+    "context",
+    [
+        GAME,
+        {"step": 1},
+        {"step": 2, "lo": None, "hi": None, "mid": None, "video_name": None},
+        {"video_name": ""},
+        {"step": 0, "lo": 0},
+    ],
+)
+def test_struct_round_trip(context):
+    value = has_launched_codec.encode(context)
+
+    assert isinstance(value, bytes)
+    assert not value.startswith(b"{")
+    assert has_launched_codec.decode(value) == context
+
+
+def test_struct_is_smaller_than_json():
+    assert len(has_launched_codec.encode(GAME)) < len(JsonCodec().encode(GAME))
+
+
+def test_empty_context_is_empty_value():
+    assert has_launched_codec.encode({}) == b""
+    assert has_launched_codec.decode(b"") == {}
+
+
+@pytest.mark.parametrize(
+    "context",
+    [
+        {**GAME, "extra": True},
+        {**GAME, "lo": -1},
+        {**GAME, "step": 70_000},
+    ],
+)
+def test_struct_falls_back_to_json(context):
+    value = has_launched_codec.encode(context)
+
+    assert isinstance(value, bytes)
+    assert value.startswith(b"{")
+    assert has_launched_codec.decode(value) == context
+
+
+def test_struct_reads_json_of_the_previous_codec():
+    assert has_launched_codec.decode(JsonCodec().encode(GAME).encode()) == GAME
+
+
+def test_struct_rejects_unknown_version():
+    value = bytearray(has_launched_codec.encode(GAME))
+    value[0] = StructCodec.VERSION + 1
+
+    with pytest.raises(ValueError):
+        has_launched_codec.decode(bytes(value))
+
+
+def test_struct_fallback_through_memory_store():
+    store = MemoryContextStore(name="test", codec=has_launched_codec)
+    context = {**GAME, "lo": -1}
+
+    async def scenario():
+        await store._set("conv", context)
+        return await store._peek("conv")
+
+    assert asyncio.run(scenario()) == context
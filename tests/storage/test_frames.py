@@ -0,0 +1,20 @@
+from rocket_man.storage.frame_library import FrameLibrary
+from rocket_man.storage.frames import FrameStore
+
+
+def test_leftovers_of_an_interrupted_write_are_cleaned_up(tmp_path):
+    (tmp_path / "video.seg").write_bytes(b"half a frame")
+
+    FrameStore(tmp_path).get("video", 0)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_readers_leave_a_segment_being_created_alone(tmp_path):
+    # another process is between creating the data file and the index
+    (tmp_path / "video.seg").touch()
+    library = FrameLibrary(tmp_path, read_only=True)
+
+    library.reload()
+    assert library.frames.get("video", 0) is None
+    assert (tmp_path / "video.seg").exists()
@@ -0,0 +1,87 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from rocket_man.storage import memory
+from rocket_man.storage.memory import MemoryContextStore, TimingWheel
+from rocket_man.storage.redis import LockTimeout
+
+
+def test_timing_wheel_hands_out_past_slots():
+    wheel = TimingWheel(tick=1.0, size=8)
+    now = wheel._cursor * wheel.tick
+    wheel.schedule("a", now + 1.5)
+    wheel.schedule("b", now + 3.5)
+    wheel.schedule("c", now + 2.5)
+    wheel.cancel("c", now + 2.5)
+
+    assert wheel.advance(now + 1) == []
+    assert wheel.advance(now + 2) == ["a"]
+    assert wheel.advance(now + 10) == ["b"]
+
+
+def test_values_expire():
+    store = MemoryContextStore(name="test", ttl=10)
+    clock = [1000.0]
+
+    async def scenario():
+        with patch.object(memory, "monotonic", lambda: clock[0]):
+            store._wheel._cursor = int(clock[0])
+            await store._set("conv", {"step": 1})
+            clock[0] += 5
+            kept = await store._peek("conv")
+            clock[0] += 6
+            return kept, await store._peek("conv")
+
+    assert asyncio.run(scenario()) == ({"step": 1}, {})
+    assert not any(shard.entries for shard in store._shards)
+
+
+def test_least_recently_used_values_are_evicted():
+    store = MemoryContextStore(name="test", max_entries=2, shards=1)
+
+    async def scenario():
+        await store._set("a", {"step": 1})
+        await store._set("b", {"step": 2})
+        await store._peek("a")
+        await store._set("c", {"step": 3})
+        return [await store._peek(key) for key in "abc"]
+
+    assert asyncio.run(scenario()) == [{"step": 1}, {}, {"step": 3}]
+
+
+def test_lock_serves_contenders_in_order():
+    store = MemoryContextStore(name="test")
+    order = []
+
+    async def hold(i):
+        async with store.open("conv") as context:
+            order.append(i)
+            context["step"] = context.get("step", 0) + 1
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        await asyncio.gather(*(hold(i) for i in range(5)))
+        return await store._peek("conv")
+
+    assert asyncio.run(scenario()) == {"step": 5}
+    assert order == list(range(5))
+    assert not store._locks
+
+
+def test_lock_times_out():
+    store = MemoryContextStore(name="test", lock_timeout=0.05)
+
+    async def scenario():
+        await store._start("conv")
+
+        with pytest.raises(LockTimeout):
+            await store._start("conv")
+
+        await store._finish("conv")
+        await store._start("conv")
+        await store._finish("conv")
+
+    asyncio.run(scenario())
+    assert not store._locks
@@ -0,0 +1,139 @@
+import asyncio
+from time import monotonic
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from rocket_man.storage.context import ContextStore
+from rocket_man.storage.redis import ACQUIRE_SCRIPT, RELEASE_SCRIPT, LockTimeout
+
+
+class FakeContextStore(ContextStore):
+    """
+    Context store talking to an in-process fake Redis server. Stores sharing
+    a server behave like workers sharing a Redis.
+    """
+
+    def __init__(self, server: FakeServer, **kwargs):
+        kwargs.setdefault("lock_ttl", 5)
+        super().__init__(name="test", redis_url="redis://fake", ttl=60, **kwargs)
+        self.server = server
+
+    async def async_init(self):
+        self.redis = FakeRedis(server=self.server)
+        self.waiters = FakeRedis(server=self.server)
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+
+@pytest.fixture
+def server():
+    return FakeServer()
+
+
+async def hold(store, order, name, duration=0.0, key="conv"):
+    async with store.open(key) as context:
+        order.append(name)
+        context["holders"] = [*context.get("holders", []), name]
+        await asyncio.sleep(duration)
+
+
+def test_lock_is_handed_over_between_processes(server):
+    first, second = FakeContextStore(server), FakeContextStore(server)
+    order = []
+
+    async def scenario():
+        holder = asyncio.create_task(hold(first, order, "first", 0.3))
+        await asyncio.sleep(0.05)
+        start = monotonic()
+        await hold(second, order, "second")
+        await holder
+        return monotonic() - start, await second._peek("conv")
+
+    waited, context = asyncio.run(scenario())
+
+    assert order == ["first", "second"]
+    # woken up by the release, not by the end of the 5s lease
+    assert waited < 1
+    assert context == {"holders": ["first", "second"]}
+
+
+def test_same_process_contenders_are_served_in_order(server):
+    store = FakeContextStore(server)
+    order = []
+
+    async def scenario():
+        await asyncio.gather(*(hold(store, order, i, 0.01) for i in range(5)))
+        return await store._peek("conv")
+
+    context = asyncio.run(scenario())
+
+    assert order == list(range(5))
+    assert context == {"holders": list(range(5))}
+    # the local locks are dropped once nobody waits for them
+    assert store._local_locks == {}
+
+
+def test_other_conversations_do_not_wait_behind_a_lock(server):
+    store = FakeContextStore(server)
+    order = []
+
+    async def scenario():
+        holders = [asyncio.create_task(hold(store, order, f"conv{i}", 0.3, key=f"conv{i}")) for i in range(20)]
+        await asyncio.sleep(0.05)
+        start = monotonic()
+        await hold(store, order, "other", key="other")
+        waited = monotonic() - start
+        await asyncio.gather(*holders)
+        return waited
+
+    assert asyncio.run(scenario()) < 0.2
+    assert order.index("other") == 20
+
+
+def test_lock_times_out(server):
+    first, second = FakeContextStore(server), FakeContextStore(server, lock_timeout=0.2)
+    order = []
+
+    async def scenario():
+        holder = asyncio.create_task(hold(first, order, "first", 0.5))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(LockTimeout):
+            await hold(second, order, "second")
+
+        await holder
+        return sorted(await first.redis.keys("*"))
+
+    # no lock, waiter count or wake-up token left behind
+    assert asyncio.run(scenario()) == [b"conv"]
+    assert order == ["first"]
+
+
+def test_expired_lease_frees_the_lock(server):
+    crashed, second = FakeContextStore(server, lock_ttl=0.2), FakeContextStore(server)
+    order = []
+
+    async def scenario():
+        await crashed.ensure_async_init()
+        # taken and never released
+        await crashed._start("conv")
+        await hold(second, order, "second")
+
+    asyncio.run(scenario())
+
+    assert order == ["second"]
+
+
+def test_uncontended_release_leaves_no_wake_up(server):
+    store = FakeContextStore(server)
+
+    async def scenario():
+        async with store.open("conv"):
+            pass
+        async with store.open("conv") as context:
+            context["step"] = 1
+        return sorted(await store.redis.keys("*"))
+
+    assert asyncio.run(scenario()) == [b"conv"]
@@ -0,0 +1,77 @@
+import pytest
+
+from rocket_man.capture import MAGIC, TrafficRecorder, read_capture
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 7,
+        "from": {"id": 42, "first_name": "Ada", "username": "ada"},
+        "chat": {"id": 42, "type": "private", "first_name": "Ada"},
+        "text": "hi",
+    },
+}
+
+
+def record(path, *update_ids):
+    recorder = TrafficRecorder(path)
+    for update_id in update_ids:
+        recorder.record(f"telegram${update_id}", {**UPDATE, "update_id": update_id})
+    recorder.close()
+
+
+def update_ids(path):
+    return [captured.update["update_id"] for captured in read_capture(path)]
+
+
+def test_round_trip_is_anonymized(tmp_path):
+    path = tmp_path / "bot.cap"
+    record(path, 1, 2)
+    record(path, 3)
+
+    captured = list(read_capture(path))
+
+    assert [c.conversation_id for c in captured] == ["telegram$1", "telegram$2", "telegram$3"]
+    assert captured[0].update["message"]["from"] == {"id": 42}
+    assert captured[0].update["message"]["chat"] == {"id": 42, "type": "private"}
+    assert captured[0].received_at <= captured[2].received_at
+    assert path.read_bytes().count(MAGIC) == 1
+
+
+def test_torn_tail_is_skipped(tmp_path):
+    path = tmp_path / "bot.cap"
+    record(path, 1, 2)
+    data = path.read_bytes()
+    path.write_bytes(data[:-5])
+
+    assert update_ids(path) == [1]
+
+
+def test_records_after_a_torn_one_are_read(tmp_path):
+    path = tmp_path / "bot.cap"
+    record(path, 1, 2)
+    data = path.read_bytes()
+    # crash in the middle of the second record, then a restart appends more
+    path.write_bytes(data[:-5])
+    record(path, 3, 4)
+
+    assert update_ids(path) == [1, 3, 4]
+
+
+def test_corrupted_record_is_skipped(tmp_path):
+    path = tmp_path / "bot.cap"
+    record(path, 1, 2, 3)
+    data = bytearray(path.read_bytes())
+    # in the compressed update of the first record
+    data[len(MAGIC) + 40] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    assert update_ids(path) == [2, 3]
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "bot.cap"
+    path.write_bytes(b"hello")
+
+    with pytest.raises(ValueError):
+        list(read_capture(path))
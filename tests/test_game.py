@@ -0,0 +1,48 @@
+import pytest
+from bernard.conf import settings
+from pydantic import ValidationError
+
+from rocket_man.game import GameState, sign_game, verify_game
+from rocket_man.settings import Settings
+
+GAME = GameState(step=4, lo=1_000, hi=31_250, video_hash=0xDEADBEEF)
+
+
+def test_round_trip():
+    assert verify_game(sign_game(GAME, "telegram$42"), "telegram$42") == GAME
+
+
+def test_token_fits_in_callback_data():
+    payload = f'{{"action":"has_launched","g":"{sign_game(GAME, "telegram$42")}"}}'
+
+    assert len(payload.encode()) <= 64
+
+
+def test_token_is_bound_to_its_conversation():
+    assert verify_game(sign_game(GAME, "telegram$42"), "telegram$43") is None
+
+
+def test_tampered_token_is_rejected():
+    token = sign_game(GAME, "telegram$42")
+    # flip a bit of the state, the signature doesn't match anymore
+    tampered = sign_game(GAME._replace(lo=0), "telegram$42")[:8] + token[8:]
+
+    assert tampered != token
+    assert verify_game(tampered, "telegram$42") is None
+
+
+def test_token_signed_with_another_key_is_rejected(monkeypatch):
+    token = sign_game(GAME, "telegram$42")
+    monkeypatch.setattr(settings, "WEBVIEW_SECRET_KEY", "rotated")
+
+    assert verify_game(token, "telegram$42") is None
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", "AAAA", sign_game(GAME, "telegram$42")[:-2]])
+def test_malformed_token_is_rejected(token):
+    assert verify_game(token, "telegram$42") is None
+
+
+def test_stateless_games_need_a_secret_key():
+    with pytest.raises(ValidationError, match="WEBVIEW_SECRET_KEY"):
+        Settings(stateless_game=True, webview_secret_key="")
@@ -0,0 +1,55 @@
+import asyncio
+
+from rocket_man import dispatch
+from rocket_man.dispatch import UpdateDispatcher
+from rocket_man.polling import UpdatePoller
+
+
+class FakePlatform:
+    """
+    Handles each update by sleeping for its `duration`, in the conversation
+    of its `chat`.
+    """
+
+    def __init__(self):
+        self.handled = []
+
+    def make_update_job(self, update):
+        async def handle():
+            await asyncio.sleep(update["duration"])
+            self.handled.append(update["update_id"])
+
+        return str(update["chat"]), handle
+
+
+def test_batch_is_confirmed_once_handled(monkeypatch):
+    monkeypatch.setattr(dispatch, "_dispatcher", UpdateDispatcher(shards=4))
+    platform = FakePlatform()
+    poller = UpdatePoller(platform)  # type: ignore[arg-type]
+    updates = [{"update_id": i, "chat": i % 2, "duration": 0.01} for i in range(10, 14)]
+
+    async def scenario():
+        offset = await poller._handle(updates)
+        await dispatch.close_dispatcher()
+        return offset
+
+    assert asyncio.run(scenario()) == 14
+    assert sorted(platform.handled) == [10, 11, 12, 13]
+
+
+def test_closing_the_dispatcher_does_not_hang_the_batch(monkeypatch):
+    monkeypatch.setattr(dispatch, "_dispatcher", UpdateDispatcher(shards=1))
+    platform = FakePlatform()
+    poller = UpdatePoller(platform)  # type: ignore[arg-type]
+    # all in the same queue: the last ones never start
+    updates = [{"update_id": i, "chat": 0, "duration": 0.2} for i in range(10, 14)]
+
+    async def scenario():
+        handling = asyncio.create_task(poller._handle(updates))
+        await asyncio.sleep(0.05)
+        await dispatch.get_dispatcher().close(timeout=0.3)
+        return await asyncio.wait_for(handling, 1)
+
+    # the interrupted update and the ones after it are fetched again
+    assert asyncio.run(scenario()) == 11
+    assert platform.handled == [10]
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from rocket_man.ratelimit import (
+    TelegramRateLimiter,
+    TokenBucket,
+    TokenBuckets,
+    counts_for_chat,
+)
+from rocket_man.storage import redis
+
+
+def test_burst_then_steady_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.reserve(10.0) for _ in range(5)] == [0.0, 0.0, 0.0, 0.5, 1.0]
+
+
+def test_bucket_refills_while_idle():
+    bucket = TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        bucket.reserve(10.0)
+
+    assert bucket.reserve(11.5) == 0.0
+    assert bucket.reserve(11.5) == 0.0
+
+
+def test_block_resumes_without_burst():
+    bucket = TokenBucket(rate=2, burst=3)
+    bucket.block(until=20.0)
+
+    assert bucket.reserve(10.0) == 10.0
+    assert bucket.reserve(10.0) == 10.5
+
+
+def test_methods_counting_for_a_chat():
+    assert counts_for_chat("sendMessage")
+    assert counts_for_chat("editMessageMedia")
+    assert counts_for_chat("copyMessage")
+    assert not counts_for_chat("sendChatAction")
+    assert not counts_for_chat("answerCallbackQuery")
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    """
+    Rate limiters of two workers sharing a (fake) Redis.
+    """
+    server = FakeServer()
+
+    async def connect_redis(*args):
+        return FakeRedis(server=server)
+
+    monkeypatch.setattr(redis, "connect_redis", connect_redis)
+    return [TelegramRateLimiter(global_rate=2, global_burst=3, jitter=0) for _ in range(2)]
+
+
+def test_workers_share_the_global_bucket(workers):
+    async def scenario():
+        return [await worker.buckets.reserve(*worker._bucket(None)) for worker in workers * 3]
+
+    delays = asyncio.run(scenario())
+
+    # the burst and then the steady rate of the whole bot, not of each worker
+    assert [round(delay, 1) for delay in delays] == [0.0, 0.0, 0.0, 0.5, 1.0, 1.5]
+
+
+def test_workers_share_the_chat_blocks(workers):
+    first, second = workers
+
+    async def scenario():
+        await first.retry_after(42, 2.0)
+        return await second.buckets.reserve(*second._bucket(42))
+
+    assert asyncio.run(scenario()) == pytest.approx(2.0, abs=0.05)
+
+
+def test_memory_backend_keeps_the_buckets_in_the_process():
+    limiter = TelegramRateLimiter(private_rate=2, private_burst=1, backend="memory")
+
+    async def scenario():
+        return [await limiter.buckets.reserve(*limiter._bucket(42)) for _ in range(2)]
+
+    assert isinstance(limiter.buckets, TokenBuckets)
+    assert asyncio.run(scenario()) == [0.0, pytest.approx(0.5, abs=0.01)]
+
+
+def test_practically_unlimited_bucket(workers):
+    worker = workers[0]
+
+    async def scenario():
+        # the interval between tokens is lost in the precision of the clock
+        return [await worker.buckets.reserve("unlimited", 1e9, 1) for _ in range(3)]
+
+    assert all(delay < 0.01 for delay in asyncio.run(scenario()))